@@ -13,15 +13,31 @@ __author__ = "MICHAL53Q@gmail.com"
 __version__ = "0.1.0"
 __license__ = "MIT"
 
+import io
 import os
+import re
 import sys
+import json
+import time
+import queue
 import shutil
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from logzero import logger
 
+from app.modules.archive.main import Archive, ArchiveManifest
 from app.modules.azure_devops.main import AzureDevops
 from app.modules.git.main import Git
+from app.modules.http.main import Http
+from app.modules.journal.main import Journal
+from app.modules.metrics.main import Metrics
+from app.modules.schedule.main import Schedule
+from app.modules.shard.main import Shard
 from app.modules.sharepoint.main import SharePoint
+from app.modules.state.main import State
 
 
 def set_exit_code(value: int) -> None:
@@ -45,28 +61,26 @@ def except_hook(exctype, excvalue, exctraceback):
 # Set initial exit code
 exit_code = 0
 
+# Collect metrics of run
+metrics = Metrics()
+
+# Track progress of changes of run, opened only when enabled
+journal = Journal()
+
+# Order work by expected cost, started by main with time budget of run
+schedule = Schedule()
+
 # Set default exception handler
 sys.excepthook = except_hook
 
 
-def get_archive_paths(path_archive: str) -> dict:
-    # Get len of path_archive to substring absolute path
-    len_substring_path = len(path_archive) + 1
-
-    dir_paths = set()
-    file_paths = set()
-    for subdir, dirs, files in os.walk(path_archive):
+def get_dir_size(path: str) -> int:
+    size = 0
+    for subdir, dirs, files in os.walk(path):
         for file in files:
-            full_path = os.path.join(subdir, file)
-            absolute_path = os.path.dirname(full_path)
-
-            dir_paths.add(absolute_path[len_substring_path:])
-            file_paths.add(full_path)
+            size += os.path.getsize(os.path.join(subdir, file))
 
-    return {
-        "dir_paths": dir_paths,
-        "file_paths": file_paths
-    }
+    return size
 
 
 def clean_archive_path(path_archive: str) -> None:
@@ -75,123 +89,1098 @@ def clean_archive_path(path_archive: str) -> None:
         shutil.rmtree(path_archive)
 
 
-def get_env_vars() -> tuple:
+# Required ENV Variables of full run
+ENV_VARS = ('DEVOPS_PAT', 'DEVOPS_ORGANIZATION_URL', 'PATH_CLONE', 'PATH_ARCHIVE', 'SHAREPOINT_URL', 'SHAREPOINT_DIR', 'SHAREPOINT_CLIENT_ID', 'SHAREPOINT_CLIENT_SECRET')
+
+# Required ENV Variables of commands running single stage, they hand over changes through state they all have to share
+COMMAND_ENV_VARS = {
+    "discover": ('DEVOPS_PAT', 'DEVOPS_ORGANIZATION_URL', 'PATH_STATE'),
+    "sync": ('DEVOPS_PAT', 'DEVOPS_ORGANIZATION_URL', 'PATH_CLONE', 'PATH_STATE'),
+    "archive": ('PATH_CLONE', 'PATH_ARCHIVE', 'PATH_STATE'),
+    "upload": ('PATH_ARCHIVE', 'SHAREPOINT_URL', 'SHAREPOINT_DIR', 'SHAREPOINT_CLIENT_ID', 'SHAREPOINT_CLIENT_SECRET', 'PATH_STATE'),
+    "run": ENV_VARS
+}
+
+# LFS objects are named by sha256 of their content
+LFS_OID_PATTERN = re.compile("[0-9a-f]{64}")
+
+
+def get_env_vars(names: tuple = ENV_VARS) -> tuple:
     try:
-        devops_pat = os.environ['DEVOPS_PAT']
-        devops_org_url = os.environ['DEVOPS_ORGANIZATION_URL']
-        path_clone = os.environ['PATH_CLONE']
-        path_archive = os.environ['PATH_ARCHIVE']
-        sharepoint_url = os.environ['SHAREPOINT_URL']
-        sharepoint_dir = os.environ['SHAREPOINT_DIR']
-        sharepoint_client_id = os.environ['SHAREPOINT_CLIENT_ID']
-        sharepoint_client_secret = os.environ['SHAREPOINT_CLIENT_SECRET']
+        return tuple(os.environ[name] for name in names)
     except KeyError as exception:
         raise Exception(f"Missing ENV Variable: {exception}")
 
-    return devops_pat, devops_org_url, path_clone, path_archive, sharepoint_url, sharepoint_dir, sharepoint_client_id, sharepoint_client_secret
+
+def get_args(argv: list) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Back up Azure DevOps repos & wikis into SharePoint")
+    parser.add_argument("command", nargs="?", default="run", choices=COMMAND_ENV_VARS, help="Stage to run, every stage requires only its own ENV Variables (default: run, all stages)")
+    return parser.parse_args(argv)
+
+
+def get_env_var_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+
+    try:
+        return int(value)
+    except ValueError:
+        raise Exception(f"Invalid ENV Variable: '{name}' must be integer, got '{value}'")
+
+
+def get_env_var_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+
+    if value.lower() in ("1", "true", "yes", "on"):
+        return True
+    if value.lower() in ("0", "false", "no", "off"):
+        return False
+
+    raise Exception(f"Invalid ENV Variable: '{name}' must be boolean, got '{value}'")
+
+
+def get_options(command: str = "run") -> dict:
+    # Optional ENV Variables, defaults keep behaviour of sequential barrier run
+    # Metrics, state & LFS objects are kept next to mirrors, stage commands keep them next to state they share
+    path_base = os.path.dirname((os.environ.get('PATH_CLONE' if command == "run" else 'PATH_STATE') or "").rstrip("/"))
+
+    return {
+        "sync_workers": get_env_var_int('SYNC_WORKERS', 1),
+        "pipeline_enabled": get_env_var_bool('PIPELINE_ENABLED', False),
+        "pipeline_queue_size": get_env_var_int('PIPELINE_QUEUE_SIZE', 4),
+        "upload_workers": get_env_var_int('UPLOAD_WORKERS', 1),
+        "upload_chunk_size_min": get_env_var_int('UPLOAD_CHUNK_SIZE_MIN', SharePoint.CHUNK_SIZE_MIN),
+        "upload_chunk_size_max": get_env_var_int('UPLOAD_CHUNK_SIZE_MAX', SharePoint.CHUNK_SIZE_MAX),
+        "archive_streaming": get_env_var_bool('ARCHIVE_STREAMING', False),
+        "archive_incremental": get_env_var_bool('ARCHIVE_INCREMENTAL', False),
+        "archive_full_interval_days": get_env_var_int('ARCHIVE_FULL_INTERVAL_DAYS', 7),
+        "archive_format": os.environ.get('ARCHIVE_FORMAT') or "zip",
+        "archive_compression_level": get_env_var_int('ARCHIVE_COMPRESSION_LEVEL', None),
+        "archive_workers": get_env_var_int('ARCHIVE_WORKERS', 1),
+        "archive_threads": get_env_var_int('ARCHIVE_THREADS', 0),
+        "archive_disk_budget": get_env_var_int('ARCHIVE_DISK_BUDGET', 0),
+        "inventory_cache_ttl": get_env_var_int('INVENTORY_CACHE_TTL', 0),
+        "inventory_cache_refresh": get_env_var_bool('INVENTORY_CACHE_REFRESH', False),
+        "inventory_cache_revalidate": get_env_var_bool('INVENTORY_CACHE_REVALIDATE', False),
+        "sharepoint_dir_cache": get_env_var_bool('SHAREPOINT_DIR_CACHE', False),
+        "upload_checkpoints": get_env_var_bool('UPLOAD_CHECKPOINTS', False),
+        "upload_digests": get_env_var_bool('UPLOAD_DIGESTS', False),
+        "upload_digests_mirror": get_env_var_bool('UPLOAD_DIGESTS_MIRROR', False),
+        "sync_metadata_precheck": get_env_var_bool('SYNC_METADATA_PRECHECK', False),
+        "maintenance_enabled": get_env_var_bool('MAINTENANCE_ENABLED', False),
+        "maintenance_interval_days": get_env_var_int('MAINTENANCE_INTERVAL_DAYS', 7),
+        "maintenance_loose_objects": get_env_var_int('MAINTENANCE_LOOSE_OBJECTS', 1000),
+        "maintenance_packs": get_env_var_int('MAINTENANCE_PACKS', 10),
+        "maintenance_workers": get_env_var_int('MAINTENANCE_WORKERS', 1),
+        "maintenance_cpu_budget": get_env_var_int('MAINTENANCE_CPU_BUDGET', os.cpu_count() or 1),
+        "http_pool_size": get_env_var_int('HTTP_POOL_SIZE', 0),
+        "http_retries": get_env_var_int('HTTP_RETRIES', 5),
+        "http_backoff_max": get_env_var_int('HTTP_BACKOFF_MAX', 60),
+        "http_rate_limit": get_env_var_int('HTTP_RATE_LIMIT', 0),
+        "shard_index": get_env_var_int('SHARD_INDEX', 0),
+        "shard_count": get_env_var_int('SHARD_COUNT', 1),
+        "shard_key": os.environ.get('SHARD_KEY') or "repo",
+        "run_journal": get_env_var_bool('RUN_JOURNAL', False),
+        "run_time_budget": get_env_var_int('RUN_TIME_BUDGET', 0),
+        "lfs_enabled": get_env_var_bool('LFS_ENABLED', False),
+        "lfs_concurrent_transfers": get_env_var_int('LFS_CONCURRENT_TRANSFERS', 8),
+        "path_lfs": os.environ.get('PATH_LFS') or os.path.join(path_base, "lfs"),
+        "metrics_enabled": get_env_var_bool('METRICS_ENABLED', False),
+        "path_metrics": os.environ.get('PATH_METRICS') or os.path.join(path_base, "metrics"),
+        "path_state": os.environ.get('PATH_STATE') or os.path.join(path_base, "state")
+    }
+
+
+def discover_inventory(devops: AzureDevops, path_state: str = None, cache_ttl: int = 0, cache_refresh: bool = False, cache_revalidate: bool = False) -> dict:
+    # Inventory cache is enabled by positive TTL
+    if path_state is None or cache_ttl <= 0:
+        return devops.list_inventory()
+
+    state = State(path_state)
+    cache = state.load("inventory")
+
+    if cache is not None and not cache_refresh:
+        cache_age = (datetime.now(timezone.utc) - datetime.fromisoformat(cache['created'])).total_seconds()
+        if cache_age < cache_ttl:
+            # Cheap revalidation lists projects only, new or removed project invalidates cache
+            if not cache_revalidate or set(devops.list_projects_name()) == set(cache['inventory']):
+                logger.info(f"discover_inventory | using cached inventory | age: {int(cache_age)} s")
+                return cache['inventory']
+
+            logger.info(f"discover_inventory | cached inventory is stale, projects changed")
+
+    inventory = devops.list_inventory()
+    state.save("inventory", {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'inventory': inventory
+    })
+
+    return inventory
 
 
-def sync_data(devops_pat: str, devops_org_url, path_clone: str) -> set:
+def get_item_metadata(devops: AzureDevops, project_name: str, item: dict) -> dict:
+    return {
+        'size': item.get('size'),
+        'default_branch': item.get('default_branch'),
+        'last_push_date': devops.get_repo_last_push_date(item['id'], project_name)
+    }
+
+
+def sync_item(git: Git, project_name: str, item_type: str, item: dict, path_clone: str, devops: AzureDevops = None, state: State = None) -> bool:
+    item_name = item['name']
+    item_remote_url = item['remote_url']
+    item_path = f"{path_clone}/{project_name}/{item_type}/{item_name}"
+
+    with metrics.measure("fetch", f"{project_name}/{item_type}/{item_name}") as measurement:
+        # Fetched bytes are measured as growth of mirror, walking mirror is skipped unless metrics are written
+        size_before = get_dir_size(item_path) if metrics.enabled else 0
+
+        # Skip git traffic when metadata exposed by DevOps didn't move since last successful sync
+        metadata = None
+        metadata_name = f"metadata/{project_name}/{item_type}/{item_name}"
+        if state is not None:
+            try:
+                metadata = get_item_metadata(devops, project_name, item)
+            except Exception as exception:
+                # Precheck is only optimization, sync falls back to git
+                logger.warning(f"sync_data | getting metadata | project: {project_name} | {item_type}: {item_name} | exception: {exception}")
+
+            if metadata is not None and os.path.isdir(item_path) and state.load(metadata_name) == metadata:
+                logger.info(f"sync_data | metadata unchanged, skipping sync | project: {project_name} | {item_type}: {item_name}")
+                measurement['skipped'] = True
+                return False
+
+        # Mirror can move as soon as fetch starts, crash from now on leaves item pending in journal
+        journal.record(f"{project_name}/{item_type}/{item_name}", Journal.FETCHING)
+        has_changes = git.sync(item_remote_url, item_path)
+
+        # Metadata of change is committed only once change is uploaded, so failed backup is never skipped by precheck
+        if metadata is not None:
+            state.save(f"metadata-pending/{project_name}/{item_type}/{item_name}" if has_changes else metadata_name, metadata)
+
+        if metrics.enabled:
+            measurement['size'] = max(get_dir_size(item_path) - size_before, 0)
+        measurement['changed'] = has_changes
+
+        return has_changes
+
+
+def commit_metadata(state: State, item: str) -> None:
+    # Metadata recorded by sync becomes baseline of precheck once item is uploaded
+    metadata = state.load(f"metadata-pending/{item}")
+    if metadata is not None:
+        state.save(f"metadata/{item}", metadata)
+        state.delete(f"metadata-pending/{item}")
+
+
+def sync_data(devops_pat: str, devops_org_url, path_clone: str, *, sync_workers: int = 1, on_change=None, path_state: str = None, inventory: dict = None, http: Http = None, path_lfs: str = None, lfs_concurrent_transfers: int = 8, path_state_schedule: str = None) -> set:
     # Initialize Azure DevOps Client
-    devops = AzureDevops(devops_pat, devops_org_url)
+    devops = AzureDevops(devops_pat, devops_org_url, http)
 
-    # Initialize Git
-    git = Git("", devops_pat)
+    # Initialize Git, LFS objects of every mirror are fetched into shared storage when its path is set
+    git = Git("", devops_pat, path_lfs, lfs_concurrent_transfers)
 
-    # List DevOps Projects
-    projects_name = devops.list_projects_name()
+    # List DevOps Projects with their repos & wikis (unless already discovered)
+    if inventory is None:
+        inventory = devops.list_inventory()
+
+    # Collect repos & wikis of every project
+    items = dict()
+    for project_name, project in inventory.items():
+        for repo in project['repos']:
+            items[f"{project_name}/git/{repo['name']}"] = (project_name, "git", repo)
+        for wiki in project['wikis']:
+            items[f"{project_name}/wiki/{wiki['name']}"] = (project_name, "wiki", wiki)
+
+    # Metadata precheck is enabled by state path where metadata of last sync are kept
+    state = State(path_state) if path_state is not None else None
+
+    # Most expensive items start first, durations of earlier runs are kept in state when its path is set
+    state_schedule = State(path_state_schedule) if path_state_schedule is not None else None
+    if state_schedule is not None:
+        schedule.load(state_schedule.load("schedule", dict()))
+    names = schedule.order({name: item.get('size') for name, (_, _, item) in items.items()})
+
+    # Changes not backed up by interrupted run are resumed first, they are changes even when remote didn't move since
+    pending = journal.get_pending(Journal.FETCHING, Journal.FETCHED)
+    names.sort(key=lambda name: name not in pending)
 
     changes = set()
-    for project_name in projects_name:
-        # Sync project repos
-        for repo in devops.list_project_repos(project_name):
-            try:
-                repo_name = repo['name']
-                repo_remote_url = repo['remote_url']
+    for change in sorted(pending - set(items)):
+        # Item is gone from inventory, its mirror is backed up as is
+        if os.path.isdir(f"{path_clone}/{change}"):
+            logger.warning(f"sync_data | resuming change missing in inventory | change: {change}")
+            changes.add(change)
+            journal.record(change, Journal.FETCHED)
+            if on_change is not None:
+                on_change(change)
+        else:
+            logger.warning(f"sync_data | dropping change missing in inventory & clone path | change: {change}")
+            journal.record(change, Journal.UNCHANGED)
 
-                has_changes = git.sync(repo_remote_url, f"{path_clone}/{project_name}/git/{repo_name}")
-                if has_changes:
-                    changes.add(f"{project_name}/git/{repo_name}")
+    def sync_scheduled(change: str) -> bool:
+        # Item not started within time budget is left for next run
+        if schedule.is_exhausted():
+            schedule.defer(change)
+            return None
 
-                logger.info(f"sync_data | syncing repos | project: {project_name} | repo: {repo_name} | has_changes: {has_changes}")
-            except Exception as exception:
-                logger.error(f"sync_data | syncing repos | project: {project_name} | repo: {repo_name} | exception: {exception}")
-                set_exit_code(1)
-                continue
+        project_name, item_type, item = items[change]
+        time_start = time.monotonic()
+        has_changes = sync_item(git, project_name, item_type, item, path_clone, devops, state if change not in pending else None)
+        schedule.record(change, time.monotonic() - time_start)
+
+        return has_changes
 
-        # Sync project wikis
-        for wiki in devops.list_project_wikis(project_name):
+    # Sync repos & wikis, fetches are overlapped when more than one worker is configured
+    deferred = list()
+    with metrics.stage("fetch"), ThreadPoolExecutor(max_workers=max(sync_workers, 1)) as executor:
+        futures = {executor.submit(sync_scheduled, change): change for change in names}
+
+        for future in as_completed(futures):
+            change = futures[future]
+            project_name, item_type, item = items[change]
+            item_name = item['name']
+            item_label = "repo" if item_type == "git" else "wiki"
             try:
-                wiki_name = wiki['name']
-                wiki_remote_url = wiki['remote_url']
+                has_changes = future.result()
+                if has_changes is None:
+                    deferred.append(change)
+                    continue
 
-                has_changes = git.sync(wiki_remote_url, f"{path_clone}/{project_name}/wiki/{wiki_name}")
+                has_changes = has_changes or change in pending
+                journal.record(change, Journal.FETCHED if has_changes else Journal.UNCHANGED)
                 if has_changes:
-                    changes.add(f"{project_name}/wiki/{wiki_name}")
+                    changes.add(change)
+
+                    # Hand over change to next stage as soon as it is fetched
+                    if on_change is not None:
+                        on_change(change)
 
-                logger.info(f"sync_data | syncing wikis | project: {project_name} | wiki: {wiki_name} | has_changes: {has_changes}")
+                logger.info(f"sync_data | syncing {item_label}s | project: {project_name} | {item_label}: {item_name} | has_changes: {has_changes}")
             except Exception as exception:
-                logger.error(f"sync_data | syncing repos | project: {project_name} | repo: {wiki_name} | exception: {exception}")
+                logger.error(f"sync_data | syncing {item_label}s | project: {project_name} | {item_label}: {item_name} | exception: {exception}")
                 set_exit_code(1)
                 continue
 
+    if len(deferred) > 0:
+        # Deferred items go first in next run
+        logger.warning(f"sync_data | time budget exhausted, deferring to next run | budget: {schedule.budget} s | deferred: {len(deferred)} | items: {sorted(deferred)}")
+
+    if state_schedule is not None:
+        state_schedule.save("schedule", schedule.dump(set(items)))
+
     return changes
 
 
-def archive_changes(path_clone: str, path_archive: str, changes: set):
+def list_mirrors(path_clone: str) -> list:
+    # Mirrors are kept in {project}/{git|wiki}/{name}
+    mirrors = list()
+    if not os.path.isdir(path_clone):
+        return mirrors
+
+    for project_name in sorted(os.listdir(path_clone)):
+        for item_type in ("git", "wiki"):
+            item_dir = os.path.join(path_clone, project_name, item_type)
+            if os.path.isdir(item_dir):
+                mirrors += [f"{project_name}/{item_type}/{item_name}" for item_name in sorted(os.listdir(item_dir))]
+
+    return mirrors
+
+
+def maintain_mirror(git: Git, path_clone: str, mirror: str, state: State, interval_days: int, loose_objects: int, packs: int, threads: int) -> bool:
+    state_name = f"maintenance/{mirror}"
+    last_maintenance = state.load(state_name)
+
+    now = datetime.now(timezone.utc)
+    if last_maintenance is not None and now - datetime.fromisoformat(last_maintenance['maintained']) < timedelta(days=interval_days):
+        return False
+
+    # Counting objects only lists object dirs, maintenance runs only on mirrors which degraded since
+    before = git.count_objects(f"{path_clone}/{mirror}")
+    if before['count'] < loose_objects and before['packs'] < packs:
+        return False
+
+    git.maintain(f"{path_clone}/{mirror}", threads)
+    after = git.count_objects(f"{path_clone}/{mirror}")
+
+    logger.info(
+        f"maintain_mirrors | maintained | mirror: {mirror}"
+        f" | loose objects: {before['count']} -> {after['count']}"
+        f" | packs: {before['packs']} -> {after['packs']}"
+        f" | size: {before['size'] + before['size-pack']} KiB -> {after['size'] + after['size-pack']} KiB"
+        f" | seconds: {(datetime.now(timezone.utc) - now).total_seconds():.1f}"
+    )
+    state.save(state_name, {
+        'maintained': now.isoformat(),
+        'before': before,
+        'after': after
+    })
+
+    return True
+
+
+def maintain_mirrors(path_clone: str, path_state: str, interval_days: int = 7, loose_objects: int = 1000, packs: int = 10, workers: int = 1, cpu_budget: int = 1) -> None:
+    git = Git("", "")
+    state = State(path_state)
+    mirrors = list_mirrors(path_clone)
+
+    # Every maintained mirror gets equal share of CPU budget for repack threads
+    workers = max(min(workers, cpu_budget), 1)
+    threads = max(cpu_budget // workers, 1)
+
+    logger.info(f"maintain_mirrors | checking mirrors | mirrors: {len(mirrors)} | workers: {workers} | threads: {threads}")
+    with metrics.stage("maintenance"), ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(maintain_mirror, git, path_clone, mirror, state, interval_days, loose_objects, packs, threads): mirror for mirror in mirrors}
+
+        maintained = 0
+        for future in as_completed(futures):
+            try:
+                maintained += int(future.result())
+            except Exception as exception:
+                # Maintenance is only optimization, mirror is still fetched & archived
+                logger.warning(f"maintain_mirrors | maintaining mirror | mirror: {futures[future]} | exception: {exception}")
+
+    logger.info(f"maintain_mirrors | done | maintained: {maintained}")
+
+
+def get_archive(options: dict) -> Archive:
+    return Archive(options['archive_format'], options['archive_compression_level'], options['archive_threads'])
+
+
+def archive_changes(path_clone: str, path_archive: str, changes: set, path_state: str = None, full_interval_days: int = 7, archive: Archive = None, archive_workers: int = 1, manifest: ArchiveManifest = None):
     if len(changes) == 0:
         logger.info(f"archive_changes | no changes detected")
         return
 
-    for change in changes:
-        logger.info(f"archive_changes | archiving changes: {change}.zip")
-        shutil.make_archive(f"{path_archive}/{change}", 'zip', f"{path_clone}/{change}")
+    # Compression releases GIL, so repos are archived on multiple cores
+    with metrics.stage("archive"), ThreadPoolExecutor(max_workers=max(archive_workers, 1)) as executor:
+        futures = [executor.submit(archive_change, path_clone, path_archive, change, path_state, full_interval_days, archive, manifest) for change in changes]
+        for future in as_completed(futures):
+            future.result()
 
 
-def upload_changes_to_sharepoint(sharepoint_url: str, sharepoint_client_id: str, sharepoint_client_secret: str, path_archive: str, sharepoint_dir: str):
-    # Get len of path_archive to substring absolute path
-    len_substring_path = len(path_archive) + 1
+def archive_change(path_clone: str, path_archive: str, change: str, path_state: str = None, full_interval_days: int = 7, archive: Archive = None, manifest: ArchiveManifest = None) -> list:
+    # Space is reserved before archive is written, size of mirror is upper bound of size of its archive
+    reserved = 0
+    if manifest is not None and manifest.budget > 0:
+        reserved = manifest.reserve(get_dir_size(f"{path_clone}/{change}"))
+    try:
+        # Archives are moved into place by manifest, which tracks them from then on
+        file_paths = write_change(path_clone, path_archive, change, path_state, full_interval_days, archive, manifest.replace if manifest is not None else os.replace)
+        journal.record_archived(change, file_paths)
+
+        return file_paths
+    finally:
+        if reserved > 0:
+            manifest.release(reserved)
+
+
+def write_change(path_clone: str, path_archive: str, change: str, path_state: str = None, full_interval_days: int = 7, archive: Archive = None, replace=os.replace) -> list:
+    sizes = list()
+
+    def publish(src: str, dst: str) -> None:
+        # Size is taken before archive is published, uploader may delete it as soon as it is in place
+        if metrics.enabled:
+            sizes.append(os.path.getsize(src))
+        replace(src, dst)
+
+    with metrics.measure("archive", change) as measurement:
+        # Incremental backup is enabled by state path where bundle manifests are kept
+        if path_state is not None:
+            file_paths = archive_change_bundle(path_clone, path_archive, change, path_state, full_interval_days, publish)
+        else:
+            archive = archive or Archive()
+            logger.info(f"archive_changes | archiving changes: {change}{archive.extension}")
+            file_paths = [archive.write(f"{path_clone}/{change}", f"{path_archive}/{change}", publish)]
+
+        # Walking mirror is skipped unless metrics are written
+        if metrics.enabled:
+            measurement['size'] = sum(sizes)
+            measurement['source_size'] = get_dir_size(f"{path_clone}/{change}")
+            measurement['ratio'] = measurement['size'] / measurement['source_size'] if measurement['source_size'] > 0 else 0
+
+        return file_paths
+
+
+def archive_change_bundle(path_clone: str, path_archive: str, change: str, path_state: str, full_interval_days: int, replace=os.replace) -> list:
+    state = State(path_state)
+    git = Git("", "")
+
+    manifest_name = f"bundles/{change}"
+    manifest = state.load(manifest_name, {"bundles": []})
+    bundles = manifest["bundles"]
+
+    now = datetime.now(timezone.utc)
+    refs = git.list_refs(f"{path_clone}/{change}")
+
+    # Full bundle starts new chain on schedule, otherwise only new objects since last backed up tips are bundled
+    is_full = len(bundles) == 0 or now - datetime.fromisoformat(bundles[0]["created"]) >= timedelta(days=full_interval_days)
+    if not is_full and refs == bundles[-1]["refs"]:
+        logger.info(f"archive_changes | no new refs since last bundle: {change}")
+        return list()
+
+    bundle_type = "full" if is_full else "incremental"
+    bundle_name = f"{now:%Y%m%dT%H%M%SZ}-{bundle_type}.bundle"
+    bundle_path = f"{path_archive}/{change}/{bundle_name}"
+    os.makedirs(os.path.dirname(bundle_path), exist_ok=True)
+
+    logger.info(f"archive_changes | archiving changes: {change}/{bundle_name}")
+    exclude_tips = list() if is_full else list(set(bundles[-1]["refs"].values()))
+    has_objects = git.bundle(f"{path_clone}/{change}", f"{bundle_path}.tmp", exclude_tips)
+
+    # Restore replays bundles of chain in order, then resets refs of latest entry
+    entry = {
+        "file": bundle_name if has_objects else None,
+        "type": bundle_type,
+        "created": now.isoformat(),
+        "refs": refs
+    }
+    manifest = {"bundles": [entry] if is_full else bundles + [entry]}
+
+    # Files are written aside & moved into place at once, manifest.json being uploaded is never rewritten in place
+    manifest_path = f"{path_archive}/{change}/manifest.json"
+    with open(f"{manifest_path}.tmp", "w") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    if has_objects:
+        replace(f"{bundle_path}.tmp", bundle_path)
+    replace(f"{manifest_path}.tmp", manifest_path)
+    state.save(manifest_name, manifest)
+
+    return [bundle_path, manifest_path] if has_objects else [manifest_path]
+
+
+def log_upload_progress(file_path: str, uploaded_bytes: int, file_size: int) -> None:
+    if file_size is None:
+        logger.info(f"upload_archive | uploading file | file_path: {file_path} | progress: {uploaded_bytes} B")
+    else:
+        logger.info(f"upload_archive | uploading file | file_path: {file_path} | progress: {uploaded_bytes * 100 // file_size}% ({uploaded_bytes}/{file_size} B)")
+
+
+def log_upload_report(file_path: str, report: dict) -> None:
+    logger.info(f"upload_archive | uploaded file | file_path: {file_path} | size: {report['size']} B | seconds: {report['seconds']:.1f} | throughput: {report['throughput'] / 1000000:.2f} MB/s")
+
+
+def load_dir_cache(path_state: str, sharepoint_dir: str) -> set:
+    # Folders known to exist in SharePoint, persisted only when state path is set
+    if path_state is None:
+        return set()
+
+    return set(State(path_state).load("sharepoint_dirs", dict()).get(sharepoint_dir, list()))
+
+
+def save_dir_cache(path_state: str, sharepoint_dir: str, dir_cache: set) -> None:
+    if path_state is None:
+        return
+
+    state = State(path_state)
+    sharepoint_dirs = state.load("sharepoint_dirs", dict())
+    sharepoint_dirs[sharepoint_dir] = sorted(dir_cache)
+    state.save("sharepoint_dirs", sharepoint_dirs)
+
+
+def ensure_dirs_exist(shp: SharePoint, sharepoint_dir: str, dir_paths: set, dir_cache: set) -> None:
+    # Only folders not created by earlier runs are created, all of them in single batch
+    missing_dir_paths = sorted(set(dir_paths) - dir_cache)
+    if len(missing_dir_paths) == 0:
+        return
+
+    logger.info(f"ensure_dirs_exist | ensuring dirs exist | sharepoint_dir: {sharepoint_dir} | dir_paths: {missing_dir_paths}")
+    shp.ensure_dirs_exist(sharepoint_dir, missing_dir_paths)
+    dir_cache.update(missing_dir_paths)
+
+
+def call_with_dir_retry(shp: SharePoint, sharepoint_dir: str, relative_dir_path: str, dir_cache: set, function):
+    try:
+        return function()
+    except Exception as exception:
+        if dir_cache is None or not SharePoint.is_not_found(exception):
+            raise
+
+    # Cached folder was deleted outside of backup, create it again & retry once
+    logger.warning(f"call_with_dir_retry | dir not found, retrying | sharepoint_dir: {sharepoint_dir} | dir_path: {relative_dir_path}")
+    dir_cache.discard(relative_dir_path)
+    shp.ensure_dir_exists(sharepoint_dir, relative_dir_path)
+    dir_cache.add(relative_dir_path)
+
+    return function()
+
+
+def load_digests(path_state: str, sharepoint_dir: str) -> dict:
+    # Digests of last uploaded archives, kept only when state path is set
+    if path_state is None:
+        return None
+
+    return State(path_state).load(f"digests/{sharepoint_dir}", dict())
+
+
+def save_digests(path_state: str, sharepoint_dir: str, digests: dict, shp: SharePoint = None) -> None:
+    if path_state is None:
+        return
+
+    State(path_state).save(f"digests/{sharepoint_dir}", digests)
+
+    # Mirror manifest next to archives, so it survives loss of persistent volume
+    if shp is not None:
+        content = json.dumps(digests, indent=2, sort_keys=True).encode()
+        shp.upload_stream(sharepoint_dir, "", "digests.json", io.BytesIO(content))
+
+
+def upload_archive(shp: SharePoint, sharepoint_dir: str, relative_dir_path: str, file_path: str, dir_cache: set = None, path_state: str = None, digests: dict = None) -> int:
+    # Checkpoints of upload sessions are kept on persistent volume when state path is set
+    state = State(path_state) if path_state is not None else None
+    checkpoint_name = f"uploads/{sharepoint_dir}/{relative_dir_path}/{os.path.basename(file_path)}"
+
+    def on_checkpoint(checkpoint: dict) -> None:
+        if checkpoint is None:
+            state.delete(checkpoint_name)
+        else:
+            state.save(checkpoint_name, checkpoint)
+
+    def upload() -> dict:
+        if state is None:
+            return shp.upload_file(sharepoint_dir, relative_dir_path, file_path, lambda uploaded_bytes, file_size: log_upload_progress(file_path, uploaded_bytes, file_size))
+
+        resume = state.load(checkpoint_name)
+        if resume is not None:
+            logger.info(f"upload_archive | resuming upload | file_path: {file_path} | offset: {resume['offset']}")
+        return shp.upload_file(sharepoint_dir, relative_dir_path, file_path, lambda uploaded_bytes, file_size: log_upload_progress(file_path, uploaded_bytes, file_size), resume, on_checkpoint)
+
+    with metrics.measure("upload", f"{relative_dir_path}/{os.path.basename(file_path)}") as measurement:
+        # Archive identical to already stored one is not uploaded again
+        if digests is not None:
+            digest_key = f"{relative_dir_path}/{os.path.basename(file_path)}"
+            digest = Archive.get_digest(file_path)
+            if digests.get(digest_key) == digest:
+                file_size = os.path.getsize(file_path)
+                logger.info(f"upload_archive | archive unchanged, skipping upload | file_path: {file_path} | bytes_saved: {file_size}")
+                measurement['skipped'] = True
+                measurement['bytes_saved'] = file_size
+                return file_size
+
+        logger.info(f"upload_archive | upload file | sharepoint_dir: {sharepoint_dir} | relative_dir_path: {relative_dir_path} | file_path: {file_path}")
+        report = call_with_dir_retry(shp, sharepoint_dir, relative_dir_path, dir_cache, upload)
+        log_upload_report(file_path, report)
+        measurement['size'] = report['size']
+        measurement['throughput'] = report['throughput']
+
+        if digests is not None:
+            digests[digest_key] = digest
+
+        return 0
+
+
+def upload_change_stream(shp: SharePoint, sharepoint_dir: str, path_clone: str, change: str, dir_cache: set = None, archive: Archive = None) -> None:
+    archive = archive or Archive()
+    file_path = f"{change}{archive.extension}"
+    relative_dir_path = os.path.dirname(change)
+
+    def upload() -> dict:
+        # Archive is produced on the fly & fed into upload session, no copy is staged in PATH_ARCHIVE
+        stream = archive.stream(f"{path_clone}/{change}")
+        try:
+            return shp.upload_stream(sharepoint_dir, relative_dir_path, os.path.basename(file_path), stream, lambda uploaded_bytes, file_size: log_upload_progress(file_path, uploaded_bytes, file_size))
+        finally:
+            stream.close()
+
+    with metrics.measure("upload", file_path) as measurement:
+        logger.info(f"upload_archive | stream file | sharepoint_dir: {sharepoint_dir} | relative_dir_path: {relative_dir_path} | file_path: {file_path}")
+        report = call_with_dir_retry(shp, sharepoint_dir, relative_dir_path, dir_cache, upload)
+        log_upload_report(file_path, report)
+        measurement['size'] = report['size']
+        measurement['throughput'] = report['throughput']
+
+    journal.record(change, Journal.UPLOADED)
+
+
+def upload_changes_to_sharepoint(sharepoint_url: str, sharepoint_client_id: str, sharepoint_client_secret: str, path_archive: str, sharepoint_dir: str, upload_workers: int = 1, chunk_size_min: int = SharePoint.CHUNK_SIZE_MIN, chunk_size_max: int = SharePoint.CHUNK_SIZE_MAX, path_state: str = None, path_state_checkpoints: str = None, path_state_digests: str = None, digests_mirror: bool = False, http: Http = None, manifest: ArchiveManifest = None):
+    # Archives produced in this run, without manifest archives found in PATH_ARCHIVE are uploaded
+    if manifest is None:
+        manifest = ArchiveManifest(path_archive)
+        manifest.restore()
 
     # Collect paths required to upload files to SharePoint
-    archive_paths = get_archive_paths(path_archive)
-    dir_paths = archive_paths['dir_paths']
-    file_paths = archive_paths['file_paths']
+    dir_paths = manifest.dir_paths
+    file_paths = manifest.file_paths
 
     # Get SharePoint client
-    shp = SharePoint(sharepoint_url, sharepoint_client_id, sharepoint_client_secret)
+    shp = SharePoint(sharepoint_url, sharepoint_client_id, sharepoint_client_secret, chunk_size_min, chunk_size_max, http)
 
     # Ensure dir_paths exists in SharePoint
-    for dir_path in dir_paths:
-        logger.info(f"upload_changes_to_sharepoint | ensuring dir exists | sharepoint_dir: {sharepoint_dir} | dir_path: {dir_path}")
-        shp.ensure_dir_exists(sharepoint_dir, dir_path)
+    dir_cache = load_dir_cache(path_state, sharepoint_dir)
+    ensure_dirs_exist(shp, sharepoint_dir, dir_paths, dir_cache)
+    save_dir_cache(path_state, sharepoint_dir, dir_cache)
 
     # Upload files to SharePoint
-    for file_path in file_paths:
-        full_dir_path = os.path.dirname(file_path)
-        relative_dir_path = full_dir_path[len_substring_path:]
+    digests = load_digests(path_state_digests, sharepoint_dir)
+    bytes_saved = 0
+    failures = list()
+    with metrics.stage("upload"), ThreadPoolExecutor(max_workers=max(upload_workers, 1)) as executor:
+        futures = dict()
+        for file_path in file_paths:
+            relative_dir_path = os.path.dirname(manifest.get_relative_path(file_path))
+
+            futures[executor.submit(upload_archive, shp, sharepoint_dir, relative_dir_path, file_path, dir_cache, path_state_checkpoints, digests)] = file_path
 
-        logger.info(f"upload_changes_to_sharepoint | upload file | sharepoint_dir: {sharepoint_dir} | relative_dir_path: {relative_dir_path} | file_path: {file_path}")
-        shp.upload_file(sharepoint_dir, relative_dir_path, file_path)
+        for future in as_completed(futures):
+            try:
+                bytes_saved += future.result()
+                manifest.remove(futures[future])
+                journal.record_uploaded_file(futures[future])
+            except Exception as exception:
+                logger.error(f"upload_changes_to_sharepoint | upload file | file_path: {futures[future]} | exception: {exception}")
+                failures.append(futures[future])
+                manifest.keep(futures[future])
+                set_exit_code(1)
 
-    clean_archive_path(path_archive)
+    if digests is not None:
+        logger.info(f"upload_changes_to_sharepoint | skipped unchanged archives | bytes_saved: {bytes_saved}")
+        save_digests(path_state_digests, sharepoint_dir, digests, shp if digests_mirror else None)
 
+    # Keep archives which failed to upload for next run
+    if len(failures) == 0:
+        clean_archive_path(path_archive)
+
+
+def stream_changes_to_sharepoint(sharepoint_url: str, sharepoint_client_id: str, sharepoint_client_secret: str, path_clone: str, sharepoint_dir: str, changes: set, upload_workers: int = 1, chunk_size_min: int = SharePoint.CHUNK_SIZE_MIN, chunk_size_max: int = SharePoint.CHUNK_SIZE_MAX, path_state: str = None, archive: Archive = None, http: Http = None):
+    if len(changes) == 0:
+        logger.info(f"stream_changes_to_sharepoint | no changes detected")
+        return
 
-def main():
-    # Get ENV Variables
-    devops_pat, devops_org_url, path_clone, path_archive, sharepoint_url, sharepoint_dir, sharepoint_client_id, sharepoint_client_secret = get_env_vars()
+    # Get SharePoint client
+    shp = SharePoint(sharepoint_url, sharepoint_client_id, sharepoint_client_secret, chunk_size_min, chunk_size_max, http)
+
+    # Ensure dir_paths exists in SharePoint
+    dir_cache = load_dir_cache(path_state, sharepoint_dir)
+    ensure_dirs_exist(shp, sharepoint_dir, {os.path.dirname(change) for change in changes}, dir_cache)
+    save_dir_cache(path_state, sharepoint_dir, dir_cache)
+
+    # Stream changes to SharePoint
+    with metrics.stage("upload"), ThreadPoolExecutor(max_workers=max(upload_workers, 1)) as executor:
+        futures = {executor.submit(upload_change_stream, shp, sharepoint_dir, path_clone, change, dir_cache, archive): change for change in changes}
+
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as exception:
+                logger.error(f"stream_changes_to_sharepoint | stream file | change: {futures[future]} | exception: {exception}")
+                set_exit_code(1)
 
-    # Sync local data with remote
-    changes = sync_data(devops_pat, devops_org_url, path_clone)
 
-    # Archive changes found during sync
-    archive_changes(path_clone, path_archive, changes)
+def list_lfs_objects(path_lfs: str) -> dict:
+    # Storage is content-addressed (objects/{oid[0:2]}/{oid[2:4]}/{oid}), partial downloads are kept out of it in tmp
+    objects = dict()
+    for subdir, dirs, files in os.walk(os.path.join(path_lfs, "objects")):
+        for file in files:
+            if LFS_OID_PATTERN.fullmatch(file) is not None:
+                objects[file] = os.path.join(subdir, file)
+
+    return objects
+
+
+def upload_lfs_to_sharepoint(sharepoint_url: str, sharepoint_client_id: str, sharepoint_client_secret: str, path_lfs: str, sharepoint_dir: str, path_state_lfs: str, upload_workers: int = 1, chunk_size_min: int = SharePoint.CHUNK_SIZE_MIN, chunk_size_max: int = SharePoint.CHUNK_SIZE_MAX, path_state: str = None, path_state_checkpoints: str = None, http: Http = None) -> None:
+    # Objects are immutable, only objects not uploaded by earlier runs are uploaded
+    state = State(path_state_lfs)
+    uploaded = set(state.load(f"lfs/{sharepoint_dir}", list()))
+    objects = {oid: file_path for oid, file_path in list_lfs_objects(path_lfs).items() if oid not in uploaded}
+    if len(objects) == 0:
+        logger.info(f"upload_lfs_to_sharepoint | no new LFS objects | objects: {len(uploaded)}")
+        return
+
+    # Get SharePoint client
+    shp = SharePoint(sharepoint_url, sharepoint_client_id, sharepoint_client_secret, chunk_size_min, chunk_size_max, http)
+
+    # Objects keep layout of LFS storage, so uploaded folder can be used as lfs.storage when restoring
+    dir_cache = load_dir_cache(path_state, sharepoint_dir)
+    ensure_dirs_exist(shp, sharepoint_dir, {f"lfs/objects/{oid[0:2]}/{oid[2:4]}" for oid in objects}, dir_cache)
+    save_dir_cache(path_state, sharepoint_dir, dir_cache)
+
+    with metrics.stage("lfs"), ThreadPoolExecutor(max_workers=max(upload_workers, 1)) as executor:
+        futures = {
+            executor.submit(upload_archive, shp, sharepoint_dir, f"lfs/objects/{oid[0:2]}/{oid[2:4]}", file_path, dir_cache, path_state_checkpoints): oid
+            for oid, file_path in objects.items()
+        }
+
+        for future in as_completed(futures):
+            try:
+                future.result()
+                uploaded.add(futures[future])
+            except Exception as exception:
+                logger.error(f"upload_lfs_to_sharepoint | upload object | oid: {futures[future]} | exception: {exception}")
+                set_exit_code(1)
+
+    # Objects which failed to upload are retried by next run
+    state.save(f"lfs/{sharepoint_dir}", sorted(uploaded))
+    logger.info(f"upload_lfs_to_sharepoint | uploaded new LFS objects | objects: {len(objects)} | size: {sum(os.path.getsize(file_path) for file_path in objects.values())} B")
+
+
+def archive_worker(path_clone: str, path_archive: str, archive_queue: queue.Queue, upload_queue: queue.Queue, path_state: str = None, full_interval_days: int = 7, archive: Archive = None, archive_workers: int = 1, manifest: ArchiveManifest = None) -> None:
+    # Limit in-flight archives, so archive queue keeps providing backpressure
+    slots = threading.Semaphore(max(archive_workers, 1))
+
+    def archive_one(change: str) -> None:
+        try:
+            for file_path in archive_change(path_clone, path_archive, change, path_state, full_interval_days, archive, manifest):
+                upload_queue.put(file_path)
+        except Exception as exception:
+            logger.error(f"run_pipeline | archiving changes | change: {change} | exception: {exception}")
+            set_exit_code(1)
+        finally:
+            slots.release()
+
+    with metrics.stage("archive"), ThreadPoolExecutor(max_workers=max(archive_workers, 1)) as executor:
+        while True:
+            change = archive_queue.get()
+            if change is None:
+                break
+
+            slots.acquire()
+            executor.submit(archive_one, change)
+
+    # Signal upload stage that no more archives will come
+    upload_queue.put(None)
+
+
+def upload_worker(shp: SharePoint, path_archive: str, sharepoint_dir: str, upload_queue: queue.Queue, failures: list, upload_workers: int = 1, path_clone: str = None, path_state: str = None, path_state_checkpoints: str = None, path_state_digests: str = None, digests_mirror: bool = False, archive: Archive = None, manifest: ArchiveManifest = None) -> None:
+    # Get len of path_archive to substring absolute path
+    len_substring_path = len(path_archive) + 1
+
+    # Limit in-flight uploads, so upload queue keeps providing backpressure
+    slots = threading.Semaphore(max(upload_workers, 1))
+
+    def upload(relative_dir_path: str, file_path: str) -> None:
+        version = None
+        try:
+            if path_clone is not None:
+                # Queue holds changes which are streamed from PATH_CLONE
+                upload_change_stream(shp, sharepoint_dir, path_clone, file_path, dir_cache, archive)
+            else:
+                if manifest is not None:
+                    version = manifest.start_upload(file_path)
+                    if version is None:
+                        logger.info(f"run_pipeline | archive already uploaded | file_path: {file_path}")
+                        return
+
+                bytes_saved.append(upload_archive(shp, sharepoint_dir, relative_dir_path, file_path, dir_cache, path_state_checkpoints, digests))
+
+                # Archive rewritten during upload stays for its queued upload
+                if manifest is None or manifest.remove(file_path, version):
+                    journal.record_uploaded_file(file_path)
+        except Exception as exception:
+            logger.error(f"run_pipeline | upload file | file_path: {file_path} | exception: {exception}")
+            failures.append(file_path)
+            if manifest is not None:
+                manifest.keep(file_path, version)
+            set_exit_code(1)
+        finally:
+            slots.release()
+
+    dir_cache = load_dir_cache(path_state, sharepoint_dir)
+    digests = load_digests(path_state_digests, sharepoint_dir)
+    bytes_saved = list()
+    with metrics.stage("upload"), ThreadPoolExecutor(max_workers=max(upload_workers, 1)) as executor:
+        while True:
+            file_path = upload_queue.get()
+            if file_path is None:
+                break
+
+            if path_clone is not None:
+                relative_dir_path = os.path.dirname(file_path)
+            else:
+                relative_dir_path = os.path.dirname(file_path)[len_substring_path:]
+            try:
+                if relative_dir_path not in dir_cache:
+                    ensure_dirs_exist(shp, sharepoint_dir, {relative_dir_path}, dir_cache)
+                    save_dir_cache(path_state, sharepoint_dir, dir_cache)
+            except Exception as exception:
+                logger.error(f"run_pipeline | ensuring dir exists | file_path: {file_path} | exception: {exception}")
+                failures.append(file_path)
+                if manifest is not None:
+                    manifest.keep(file_path)
+                set_exit_code(1)
+                continue
+
+            slots.acquire()
+            executor.submit(upload, relative_dir_path, file_path)
+
+    if digests is not None:
+        logger.info(f"run_pipeline | skipped unchanged archives | bytes_saved: {sum(bytes_saved)}")
+        save_digests(path_state_digests, sharepoint_dir, digests, shp if digests_mirror else None)
+
+
+def write_metrics(path_metrics: str) -> None:
+    logger.info(f"write_metrics | writing run report | path_metrics: {path_metrics}")
+    metrics.write_report(path_metrics, get_exit_code())
+    metrics.write_prometheus(path_metrics, get_exit_code())
+
+
+def get_http(options: dict) -> Http:
+    # Pool holds connection for every worker which can talk to same host at once
+    pool_size = options['http_pool_size'] or max(options['sync_workers'], options['upload_workers'], 10)
+    return Http(pool_size, options['http_retries'], 1, options['http_backoff_max'], options['http_rate_limit'])
+
+
+def get_state_paths(options: dict) -> dict:
+    # State of optional feature is kept only when feature is enabled
+    path_state = options['path_state']
+    return {
+        "archive": path_state if options['archive_incremental'] else None,
+        "sync": path_state if options['sync_metadata_precheck'] else None,
+        "upload": path_state if options['sharepoint_dir_cache'] else None,
+        "checkpoints": path_state if options['upload_checkpoints'] else None,
+        "digests": path_state if options['upload_digests'] else None
+    }
+
+
+def get_sync_settings(options: dict) -> dict:
+    # Optional keyword arguments of sync_data
+    return {
+        "sync_workers": options['sync_workers'],
+        "path_state": get_state_paths(options)['sync'],
+        "path_lfs": options['path_lfs'] if options['lfs_enabled'] else None,
+        "lfs_concurrent_transfers": options['lfs_concurrent_transfers'],
+        "path_state_schedule": options['path_state']
+    }
+
+
+def get_upload_settings(options: dict) -> dict:
+    # Optional keyword arguments shared by upload stages
+    state_paths = get_state_paths(options)
+    return {
+        "upload_workers": options['upload_workers'],
+        "chunk_size_min": options['upload_chunk_size_min'],
+        "chunk_size_max": options['upload_chunk_size_max'],
+        "path_state": state_paths['upload'],
+        "path_state_checkpoints": state_paths['checkpoints']
+    }
+
+
+def get_shard(options: dict) -> Shard:
+    return Shard(options['shard_index'], options['shard_count'], options['shard_key'])
+
+
+def get_inventory(devops_pat: str, devops_org_url: str, options: dict, http: Http = None, shard: Shard = None) -> dict:
+    devops = AzureDevops(devops_pat, devops_org_url, http)
+
+    with metrics.stage("discovery"), metrics.measure("discovery", "inventory") as measurement:
+        inventory = discover_inventory(devops, options['path_state'], options['inventory_cache_ttl'], options['inventory_cache_refresh'], options['inventory_cache_revalidate'])
+
+        # Whole organization is discovered, only items owned by this shard are synced
+        if shard is not None and shard.enabled:
+            inventory = shard.filter_inventory(inventory)
+            logger.info(f"get_inventory | sharded inventory | shard: {shard.index}/{shard.count} | key: {shard.key}")
+        measurement['repos'] = sum(len(project['repos']) for project in inventory.values())
+        measurement['wikis'] = sum(len(project['wikis']) for project in inventory.values())
+
+    return inventory
+
+
+def run_pipeline(devops_pat: str, devops_org_url: str, path_clone: str, path_archive: str, sharepoint_url: str, sharepoint_dir: str, sharepoint_client_id: str, sharepoint_client_secret: str, options: dict, shard: Shard = None) -> None:
+    archive_streaming = options['archive_streaming']
+    state_paths = get_state_paths(options)
+    archive = get_archive(options)
+    http = get_http(options)
+
+    # Archives staged in PATH_ARCHIVE are tracked in memory & deleted as soon as they are uploaded
+    manifest = ArchiveManifest(path_archive, options['archive_disk_budget'])
+
+    # Bounded queues between stages provide backpressure
+    archive_queue = queue.Queue(maxsize=max(options['pipeline_queue_size'], 1))
+    upload_queue = queue.Queue(maxsize=max(options['pipeline_queue_size'], 1))
+
+    # Get SharePoint client (fail before any data is fetched)
+    shp = SharePoint(sharepoint_url, sharepoint_client_id, sharepoint_client_secret, options['upload_chunk_size_min'], options['upload_chunk_size_max'], http)
+
+    # Start archive & upload stages, streamed changes skip archive stage
+    failures = list()
+    threads = list()
+    upload_settings = {"upload_workers": options['upload_workers'], "path_state": state_paths['upload']}
+    if archive_streaming:
+        threads.append(threading.Thread(target=upload_worker, args=(shp, path_archive, sharepoint_dir, upload_queue, failures), kwargs={**upload_settings, "path_clone": path_clone, "archive": archive}, daemon=True))
+    else:
+        threads.append(threading.Thread(target=archive_worker, args=(path_clone, path_archive, archive_queue, upload_queue), kwargs={"path_state": state_paths['archive'], "full_interval_days": options['archive_full_interval_days'], "archive": archive, "archive_workers": options['archive_workers'], "manifest": manifest}, daemon=True))
+        threads.append(threading.Thread(target=upload_worker, args=(shp, path_archive, sharepoint_dir, upload_queue, failures), kwargs={**upload_settings, "path_state_checkpoints": state_paths['checkpoints'], "path_state_digests": state_paths['digests'], "digests_mirror": options['upload_digests_mirror'], "manifest": manifest}, daemon=True))
+    for thread in threads:
+        thread.start()
+
+    try:
+        if not archive_streaming:
+            # Upload archives left over by previous failed run
+            for file_path in manifest.restore():
+                logger.info(f"run_pipeline | found archive from previous run | file_path: {file_path}")
+                upload_queue.put(file_path)
+
+        # Sync local data with remote, every change flows into next stage
+        inventory = get_inventory(devops_pat, devops_org_url, options, http, shard)
+        changes = sync_data(devops_pat, devops_org_url, path_clone, on_change=upload_queue.put if archive_streaming else archive_queue.put, inventory=inventory, http=http, **get_sync_settings(options))
+        if len(changes) == 0:
+            logger.info(f"run_pipeline | no changes detected")
+    finally:
+        # Drain stages
+        if archive_streaming:
+            upload_queue.put(None)
+        else:
+            archive_queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    # Keep archives which failed to upload for next run
+    if len(failures) == 0 and not archive_streaming:
+        clean_archive_path(path_archive)
+
+
+def run_discover(devops_pat: str, devops_org_url: str, options: dict, shard: Shard = None) -> None:
+    # Inventory is printed, logs go to stderr
+    inventory = get_inventory(devops_pat, devops_org_url, options, get_http(options), shard)
+    print(json.dumps(inventory, indent=2, sort_keys=True))
+
+
+def run_sync(devops_pat: str, devops_org_url: str, path_clone: str, options: dict, shard: Shard = None) -> None:
+    http = get_http(options)
+
+    if options['maintenance_enabled']:
+        # Compact mirrors before they are fetched into
+        maintain_mirrors(path_clone, options['path_state'], options['maintenance_interval_days'], options['maintenance_loose_objects'], options['maintenance_packs'], options['maintenance_workers'], options['maintenance_cpu_budget'])
+
+    # Fetched changes are handed over to archive command through journal
+    changes = sync_data(devops_pat, devops_org_url, path_clone, inventory=get_inventory(devops_pat, devops_org_url, options, http, shard), http=http, **get_sync_settings(options))
+    logger.info(f"run_sync | done | changes: {len(changes)}")
+
+
+def run_archive(path_clone: str, path_archive: str, options: dict) -> None:
+    # Archive every change fetched by sync command (or by interrupted run), archives are handed over to upload command in PATH_ARCHIVE
+    changes = journal.get_pending(Journal.FETCHING, Journal.FETCHED)
+    archive_changes(path_clone, path_archive, changes, get_state_paths(options)['archive'], options['archive_full_interval_days'], get_archive(options), options['archive_workers'], ArchiveManifest(path_archive))
+
+
+def run_upload(path_archive: str, sharepoint_url: str, sharepoint_dir: str, sharepoint_client_id: str, sharepoint_client_secret: str, options: dict) -> None:
+    # Upload every archive staged in PATH_ARCHIVE
+    http = get_http(options)
+    upload_changes_to_sharepoint(sharepoint_url, sharepoint_client_id, sharepoint_client_secret, path_archive, sharepoint_dir, path_state_digests=get_state_paths(options)['digests'], digests_mirror=options['upload_digests_mirror'], http=http, **get_upload_settings(options))
+
+    if options['lfs_enabled']:
+        # Upload LFS objects fetched by sync command
+        upload_lfs_to_sharepoint(sharepoint_url, sharepoint_client_id, sharepoint_client_secret, options['path_lfs'], sharepoint_dir, options['path_state'], http=http, **get_upload_settings(options))
+
+
+def run(devops_pat: str, devops_org_url: str, path_clone: str, path_archive: str, sharepoint_url: str, sharepoint_dir: str, sharepoint_client_id: str, sharepoint_client_secret: str, options: dict, shard: Shard = None) -> None:
+    state_paths = get_state_paths(options)
+    archive = get_archive(options)
+    http = get_http(options)
+
+    if options['maintenance_enabled']:
+        # Compact mirrors before they are fetched into & archived
+        maintain_mirrors(path_clone, options['path_state'], options['maintenance_interval_days'], options['maintenance_loose_objects'], options['maintenance_packs'], options['maintenance_workers'], options['maintenance_cpu_budget'])
+
+    if options['pipeline_enabled']:
+        # Sync, archive & upload every change as soon as previous stage finishes it
+        run_pipeline(devops_pat, devops_org_url, path_clone, path_archive, sharepoint_url, sharepoint_dir, sharepoint_client_id, sharepoint_client_secret, options, shard)
+    elif options['archive_streaming']:
+        # Sync local data with remote
+        changes = sync_data(devops_pat, devops_org_url, path_clone, inventory=get_inventory(devops_pat, devops_org_url, options, http, shard), http=http, **get_sync_settings(options))
+
+        # Stream archives of changes found during sync into sharepoint
+        stream_changes_to_sharepoint(sharepoint_url, sharepoint_client_id, sharepoint_client_secret, path_clone, sharepoint_dir, changes, options['upload_workers'], options['upload_chunk_size_min'], options['upload_chunk_size_max'], state_paths['upload'], archive, http)
+    else:
+        # Sync local data with remote
+        changes = sync_data(devops_pat, devops_org_url, path_clone, inventory=get_inventory(devops_pat, devops_org_url, options, http, shard), http=http, **get_sync_settings(options))
+
+        # Archive changes found during sync, archives left over by previous failed run are uploaded too
+        manifest = ArchiveManifest(path_archive)
+        manifest.restore()
+        archive_changes(path_clone, path_archive, changes, state_paths['archive'], options['archive_full_interval_days'], archive, options['archive_workers'], manifest)
+
+        # Upload archived changes into sharepoint
+        upload_changes_to_sharepoint(sharepoint_url, sharepoint_client_id, sharepoint_client_secret, path_archive, sharepoint_dir, path_state_digests=state_paths['digests'], digests_mirror=options['upload_digests_mirror'], http=http, manifest=manifest, **get_upload_settings(options))
+
+    if options['lfs_enabled']:
+        # LFS objects aren't part of mirrors, new objects are uploaded next to archives
+        upload_lfs_to_sharepoint(sharepoint_url, sharepoint_client_id, sharepoint_client_secret, options['path_lfs'], sharepoint_dir, options['path_state'], http=http, **get_upload_settings(options))
+
+
+def main(argv: list = None):
+    # Get command, full run by default
+    command = get_args(argv or list()).command
+
+    # Get ENV Variables, command requires only ENV Variables of stages it runs
+    env_vars = dict(zip(COMMAND_ENV_VARS[command], get_env_vars(COMMAND_ENV_VARS[command])))
+    devops_pat = env_vars.get('DEVOPS_PAT')
+    devops_org_url = env_vars.get('DEVOPS_ORGANIZATION_URL')
+    path_clone = env_vars.get('PATH_CLONE')
+    path_archive = env_vars.get('PATH_ARCHIVE')
+    sharepoint_url = env_vars.get('SHAREPOINT_URL')
+    sharepoint_dir = env_vars.get('SHAREPOINT_DIR')
+    sharepoint_client_id = env_vars.get('SHAREPOINT_CLIENT_ID')
+    sharepoint_client_secret = env_vars.get('SHAREPOINT_CLIENT_SECRET')
+
+    # Get optional ENV Variables
+    options = get_options(command)
+    if options['archive_streaming'] and options['archive_incremental']:
+        raise Exception("Invalid ENV Variables: 'ARCHIVE_STREAMING' & 'ARCHIVE_INCREMENTAL' can't be enabled together")
+    if options['archive_streaming'] and command in ("archive", "upload"):
+        raise Exception(f"Invalid ENV Variables: 'ARCHIVE_STREAMING' can't be enabled with command '{command}', streamed archives are never staged")
+    if options['archive_disk_budget'] > 0 and not (command == "run" and options['pipeline_enabled']):
+        raise Exception("Invalid ENV Variables: 'ARCHIVE_DISK_BUDGET' requires 'PIPELINE_ENABLED', archives can't wait for uploads which run after whole archive stage")
+
+    # Sharded worker keeps mirrors, archives, state & metrics in its own subtree
+    shard = get_shard(options)
+    if shard.enabled and options['upload_digests_mirror']:
+        raise Exception("Invalid ENV Variables: 'UPLOAD_DIGESTS_MIRROR' can't be enabled with 'SHARD_COUNT' > 1, every shard would overwrite digests.json")
+    if shard.enabled:
+        path_clone = shard.get_path(path_clone)
+        path_archive = shard.get_path(path_archive)
+        options['path_state'] = shard.get_path(options['path_state'])
+        options['path_metrics'] = shard.get_path(options['path_metrics'])
+        options['path_lfs'] = shard.get_path(options['path_lfs'])
+
+    if options['lfs_enabled'] and command in ("sync", "upload") and not os.environ.get('PATH_LFS'):
+        raise Exception(f"Invalid ENV Variables: 'PATH_LFS' is required by command '{command}' with 'LFS_ENABLED', sync & upload have to share LFS storage")
+    if options['lfs_enabled'] and command in ("sync", "run") and not Git.has_lfs():
+        raise Exception("Invalid ENV Variables: 'LFS_ENABLED' requires git-lfs to be installed")
+
+    # Metrics are always collected, measurements which walk mirrors only when they are written
+    metrics.enabled = options['metrics_enabled']
+
+    # Time budget counts from start of run, items not started within it are deferred to next run
+    schedule.start(options['run_time_budget'])
+
+    try:
+        if shard.enabled:
+            # Only one worker at a time may own shard, even when scheduled on different nodes
+            shard.acquire(options['path_state'])
+
+        if options['run_journal'] or options['sync_metadata_precheck'] or command in ("sync", "archive", "upload"):
+            # Changes which interrupted run didn't back up are resumed by this run, stage commands hand over changes through it
+            # & metadata precheck learns from it which changes are uploaded
+            path_state_sync = get_state_paths(options)['sync']
+            journal.open(options['path_state'], (lambda item: commit_metadata(State(path_state_sync), item)) if path_state_sync is not None else None)
+            if len(journal.items) > 0:
+                logger.info(f"main | resuming pending changes | changes: {sorted(journal.items)}")
 
-    # Upload archived changes into sharepoint
-    upload_changes_to_sharepoint(sharepoint_url, sharepoint_client_id, sharepoint_client_secret, path_archive, sharepoint_dir)
+        if command == "discover":
+            run_discover(devops_pat, devops_org_url, options, shard)
+        elif command == "sync":
+            run_sync(devops_pat, devops_org_url, path_clone, options, shard)
+        elif command == "archive":
+            run_archive(path_clone, path_archive, options)
+        elif command == "upload":
+            run_upload(path_archive, sharepoint_url, sharepoint_dir, sharepoint_client_id, sharepoint_client_secret, options)
+        else:
+            run(devops_pat, devops_org_url, path_clone, path_archive, sharepoint_url, sharepoint_dir, sharepoint_client_id, sharepoint_client_secret, options, shard)
+    except Exception:
+        set_exit_code(1)
+        raise
+    finally:
+        journal.close()
+        shard.release()
+        if metrics.enabled:
+            write_metrics(options['path_metrics'])
 
     # Exit script with exit code
     sys.exit(get_exit_code())
 
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv[1:])
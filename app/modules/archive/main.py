@@ -0,0 +1,314 @@
+import os
+import hashlib
+import tarfile
+import zipfile
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Every zstd frame starts with magic number
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+class ArchiveStream:
+    """Readable stream of archive produced on the fly, holds at most buffer_size bytes in memory"""
+
+    def __init__(self, buffer_size: int) -> None:
+        self.__buffer = bytearray()
+        self.__buffer_size = buffer_size
+        self.__condition = threading.Condition()
+        self.__closed = False
+        self.__exception = None
+
+    def write(self, data: bytes) -> int:
+        with self.__condition:
+            # Wait until reader makes room in buffer
+            self.__condition.wait_for(lambda: len(self.__buffer) < self.__buffer_size or self.__closed)
+            if self.__closed:
+                raise BrokenPipeError("Archive stream reader is closed")
+
+            self.__buffer += data
+            self.__condition.notify_all()
+
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close_writer(self, exception: Exception = None) -> None:
+        with self.__condition:
+            self.__closed = True
+            self.__exception = exception
+            self.__condition.notify_all()
+
+    def read(self, size: int) -> bytes:
+        data = bytearray()
+        with self.__condition:
+            # Collect requested size (can be bigger than buffer) until writer is done
+            while len(data) < size:
+                self.__condition.wait_for(lambda: len(self.__buffer) > 0 or self.__closed)
+                if self.__exception is not None:
+                    raise self.__exception
+                if len(self.__buffer) == 0:
+                    break
+
+                length = size - len(data)
+                data += self.__buffer[:length]
+                del self.__buffer[:length]
+                self.__condition.notify_all()
+
+        return bytes(data)
+
+    def close(self) -> None:
+        # Unblock writer when reader gives up
+        with self.__condition:
+            self.__closed = True
+            self.__buffer.clear()
+            self.__condition.notify_all()
+
+
+class Archive:
+    STREAM_BUFFER_SIZE = 64 * 1024 * 1024
+
+    # Format: (extension, default compression level)
+    FORMATS = {
+        "zip": (".zip", 6),
+        "tar.zst": (".tar.zst", 3)
+    }
+
+    # Git objects (packs & loose objects) are already zlib compressed, deflating them again only burns CPU
+    STORED_DIRS = {"objects"}
+    STORED_EXTENSIONS = {".pack", ".bundle", ".zip", ".gz", ".zst"}
+
+    # Files rewritten by every fetch, even when mirror content stays same
+    VOLATILE_FILES = {"FETCH_HEAD"}
+
+    def __init__(self, archive_format: str = "zip", compression_level: int = None, threads: int = 0) -> None:
+        if archive_format not in self.FORMATS:
+            raise Exception(f"Unsupported archive format: '{archive_format}', supported: {', '.join(self.FORMATS)}")
+        if archive_format == "tar.zst" and zstandard is None:
+            raise Exception("Archive format 'tar.zst' requires 'zstandard' package")
+
+        self.archive_format = archive_format
+        self.extension, default_level = self.FORMATS[archive_format]
+        self.compression_level = default_level if compression_level is None else compression_level
+        self.threads = threads
+
+    def write(self, source_dir: str, base_name: str, replace=os.replace) -> str:
+        file_path = f"{base_name}{self.extension}"
+        os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+
+        # Archive is written aside & moved into place at once, archive being uploaded is never rewritten in place
+        with open(f"{file_path}.tmp", "wb") as file:
+            self.__write_to(file, source_dir)
+        replace(f"{file_path}.tmp", file_path)
+
+        return file_path
+
+    def stream(self, source_dir: str, buffer_size: int = STREAM_BUFFER_SIZE) -> ArchiveStream:
+        stream = ArchiveStream(buffer_size)
+
+        def produce() -> None:
+            try:
+                self.__write_to(stream, source_dir)
+                stream.close_writer()
+            except Exception as exception:
+                stream.close_writer(exception)
+
+        threading.Thread(target=produce, daemon=True).start()
+
+        return stream
+
+    @classmethod
+    def is_stored(cls, relative_path: str) -> bool:
+        return relative_path.split(os.sep)[0] in cls.STORED_DIRS or os.path.splitext(relative_path)[1] in cls.STORED_EXTENSIONS
+
+    @staticmethod
+    def walk(source_dir: str):
+        # Entries are sorted, so same content always produces same archive layout
+        for root, dirs, files in os.walk(source_dir):
+            dirs.sort()
+            for name in dirs + sorted(files):
+                full_path = os.path.join(root, name)
+                yield full_path, os.path.relpath(full_path, source_dir)
+
+    def __write_to(self, file, source_dir: str) -> None:
+        if self.archive_format == "zip":
+            self.__write_zip(file, source_dir)
+        else:
+            self.__write_tar_zst(file, source_dir)
+
+    def __write_zip(self, file, source_dir: str) -> None:
+        # Zip is written sequentially when file is not seekable, sizes are stored in data descriptors
+        with zipfile.ZipFile(file, "w", zipfile.ZIP_DEFLATED, compresslevel=self.compression_level) as archive:
+            for full_path, relative_path in self.walk(source_dir):
+                if self.is_stored(relative_path):
+                    archive.write(full_path, relative_path, zipfile.ZIP_STORED)
+                else:
+                    archive.write(full_path, relative_path)
+
+    def __write_tar_zst(self, file, source_dir: str) -> None:
+        # Zstd compresses whole tar stream, threads spread single large repo over multiple cores
+        compressor = zstandard.ZstdCompressor(level=self.compression_level, threads=self.threads)
+        with compressor.stream_writer(file, closefd=False) as writer:
+            with tarfile.open(fileobj=writer, mode="w|") as archive:
+                for full_path, relative_path in self.walk(source_dir):
+                    # Timestamps & owners are dropped, so same mirror always produces same archive
+                    info = archive.gettarinfo(full_path, relative_path)
+                    info.mtime = 0
+                    info.uid = info.gid = 0
+                    info.uname = info.gname = ""
+                    if info.isfile():
+                        with open(full_path, "rb") as member:
+                            archive.addfile(info, member)
+                    else:
+                        archive.addfile(info)
+
+    @staticmethod
+    def get_digest(file_path: str) -> str:
+        digest = hashlib.sha256()
+
+        if zipfile.is_zipfile(file_path):
+            # Digest of zip content (names & CRCs from central directory), timestamps of entries are ignored
+            with zipfile.ZipFile(file_path) as archive:
+                for info in sorted(archive.infolist(), key=lambda info: info.filename):
+                    if os.path.basename(info.filename.rstrip("/")) in Archive.VOLATILE_FILES:
+                        continue
+                    digest.update(f"{info.filename}\0{info.CRC}\0{info.file_size}\n".encode())
+        elif Archive.is_zstd(file_path) and zstandard is not None:
+            # Digest of tar content (names, sizes & content hashes of members in archive order), same as for zip
+            with open(file_path, "rb") as file:
+                with tarfile.open(fileobj=zstandard.ZstdDecompressor().stream_reader(file), mode="r|") as archive:
+                    for info in archive:
+                        if os.path.basename(info.name.rstrip("/")) in Archive.VOLATILE_FILES:
+                            continue
+                        content_digest = hashlib.sha256()
+                        if info.isfile():
+                            member = archive.extractfile(info)
+                            for block in iter(lambda: member.read(1024 * 1024), b""):
+                                content_digest.update(block)
+                        digest.update(f"{info.name}\0{content_digest.hexdigest()}\0{info.size}\n".encode())
+        else:
+            with open(file_path, "rb") as file:
+                for block in iter(lambda: file.read(1024 * 1024), b""):
+                    digest.update(block)
+
+        return digest.hexdigest()
+
+    @staticmethod
+    def is_zstd(file_path: str) -> bool:
+        with open(file_path, "rb") as file:
+            return file.read(4) == ZSTD_MAGIC
+
+
+class ArchiveManifest:
+    """Archives staged in PATH_ARCHIVE during run & disk space they hold until uploaded"""
+
+    def __init__(self, path_archive: str, budget: int = 0) -> None:
+        self.path_archive = path_archive
+        self.budget = budget
+        self.files = dict()
+        self.versions = dict()
+        self.uploading = set()
+        self.reserved = 0
+        self.__condition = threading.Condition()
+
+    @property
+    def used(self) -> int:
+        return sum(self.files.values()) + self.reserved
+
+    @property
+    def file_paths(self) -> list:
+        with self.__condition:
+            return sorted(self.files)
+
+    @property
+    def dir_paths(self) -> set:
+        return {os.path.dirname(self.get_relative_path(file_path)) for file_path in self.file_paths}
+
+    def get_relative_path(self, file_path: str) -> str:
+        return os.path.relpath(file_path, self.path_archive)
+
+    def restore(self) -> list:
+        # Archives left over by previous run (failed uploads) are picked up once, everything else is tracked in memory
+        file_paths = list()
+        for root, dirs, files in os.walk(self.path_archive):
+            for name in files:
+                if name.endswith(".tmp"):
+                    # Archive interrupted while being written
+                    os.remove(os.path.join(root, name))
+                else:
+                    file_paths.append(os.path.join(root, name))
+
+        for file_path in sorted(file_paths):
+            self.add(file_path)
+
+        return sorted(file_paths)
+
+    def reserve(self, size: int) -> int:
+        # Wait until uploads free enough space, archive larger than whole budget still goes when nothing else is staged
+        with self.__condition:
+            if self.budget > 0:
+                self.__condition.wait_for(lambda: self.used == 0 or self.used + size <= self.budget)
+            self.reserved += size
+
+        return size
+
+    def release(self, size: int) -> None:
+        with self.__condition:
+            self.reserved -= size
+            self.__condition.notify_all()
+
+    def add(self, file_path: str, size: int = None) -> None:
+        with self.__condition:
+            self.files[file_path] = os.path.getsize(file_path) if size is None else size
+            self.versions[file_path] = self.versions.get(file_path, 0) + 1
+            self.__condition.notify_all()
+
+    def replace(self, source_path: str, file_path: str) -> None:
+        # Written archive is moved into place under lock, so upload of its previous copy can't delete it
+        with self.__condition:
+            os.replace(source_path, file_path)
+            self.add(file_path)
+
+    def start_upload(self, file_path: str) -> int:
+        # Uploads of same path never overlap, so older copy can't land in SharePoint after newer one
+        with self.__condition:
+            self.__condition.wait_for(lambda: file_path not in self.uploading)
+            if file_path not in self.files:
+                # Path was queued twice (e.g. left over archive rewritten by this run), latest copy is already uploaded
+                return None
+
+            self.uploading.add(file_path)
+            return self.versions[file_path]
+
+    def remove(self, file_path: str, version: int = None) -> bool:
+        # Uploaded archive is deleted right away, its space is handed over to waiting archives
+        with self.__condition:
+            self.uploading.discard(file_path)
+            self.__condition.notify_all()
+
+            if version is not None and self.versions.get(file_path) != version:
+                # Archive was rewritten while its previous copy was uploaded, new copy waits in queue
+                return False
+
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+            self.files.pop(file_path, None)
+            self.versions.pop(file_path, None)
+
+        return True
+
+    def keep(self, file_path: str, version: int = None) -> None:
+        # Archive which failed to upload stays on disk for next run, but it no longer blocks this run
+        with self.__condition:
+            self.uploading.discard(file_path)
+            if version is None or self.versions.get(file_path) == version:
+                self.files.pop(file_path, None)
+                self.versions.pop(file_path, None)
+            self.__condition.notify_all()
@@ -1,22 +1,65 @@
-from azure.devops.released.core.core_client import CoreClient
-from azure.devops.released.git.git_client import GitClient
-from azure.devops.released.wiki.wiki_client import WikiClient
-from azure.devops.connection import Connection
-from msrest.authentication import BasicAuthentication
+import threading
+from typing import TYPE_CHECKING
+
+from app.modules.http.main import Http
+
+if TYPE_CHECKING:
+    from azure.devops.released.core.core_client import CoreClient
+    from azure.devops.released.git.git_client import GitClient
+    from azure.devops.released.wiki.wiki_client import WikiClient
 
 
 class AzureDevops:
-    def __init__(self, personal_access_token: str, organization_url: str) -> None:
+    def __init__(self, personal_access_token: str, organization_url: str, http: Http = None) -> None:
+        # SDK is imported on first use, commands which don't talk to DevOps don't pay for it
+        from azure.devops.connection import Connection
+        from msrest.authentication import BasicAuthentication
+
         credentials = BasicAuthentication('', personal_access_token)
-        connection = Connection(base_url=organization_url, creds=credentials)
-        self.__core_client: CoreClient = connection.clients.get_core_client()
-        self.__git_client: GitClient = connection.clients.get_git_client()
-        self.__wiki_client: WikiClient = connection.clients.get_wiki_client()
+        self.__connection = Connection(base_url=organization_url, creds=credentials)
+        self.__clients = dict()
+        self.__clients_lock = threading.Lock()
+        self.__http = http
+
+    def __get_client(self, name: str):
+        # Creating client requests resource areas, so clients are created on first use only
+        with self.__clients_lock:
+            if name not in self.__clients:
+                client = getattr(self.__connection.clients, f"get_{name}_client")()
+                if self.__http is not None:
+                    client.config.session_configuration_callback = self.__configure_session
+                self.__clients[name] = client
+            return self.__clients[name]
+
+    def __configure_session(self, session, global_config, local_config, **kwargs) -> dict:
+        # Msrest keeps session per thread, all of them share pooled & retrying transport
+        self.__http.mount(session)
+        return kwargs
+
+    @property
+    def __core_client(self) -> "CoreClient":
+        return self.__get_client("core")
+
+    @property
+    def __git_client(self) -> "GitClient":
+        return self.__get_client("git")
+
+    @property
+    def __wiki_client(self) -> "WikiClient":
+        return self.__get_client("wiki")
 
     def list_projects_name(self) -> set:
         response = self.__core_client.get_projects()
 
         result = set()
+
+        # SDK 7.x returns plain list without continuation token, pages are requested by skip
+        if isinstance(response, list):
+            while len(response) > 0:
+                result.update(project.name for project in response)
+                response = self.__core_client.get_projects(skip=len(result))
+            return result
+
         while response is not None:
             for project in response.value:
                 # Add project name to result set
@@ -35,11 +78,7 @@ class AzureDevops:
 
         result = list()
         for repo in response:
-            result.append({
-                'name': repo.name,
-                'remote_url': repo.remote_url,
-                'ssh_url': repo.ssh_url
-            })
+            result.append(self.__get_repo_info(repo))
 
         return result
 
@@ -49,10 +88,53 @@ class AzureDevops:
         result = list()
         for wiki in response:
             repo = self.__git_client.get_repository(wiki.repository_id, project_name)
-            result.append({
-                'name': repo.name,
-                'remote_url': repo.remote_url,
-                'ssh_url': repo.ssh_url
-            })
+            result.append(self.__get_repo_info(repo))
 
         return result
+
+    def list_inventory(self) -> dict:
+        # Every project is part of inventory, even without repos
+        result = dict()
+        for project_name in self.list_projects_name():
+            result[project_name] = {'repos': list(), 'wikis': list()}
+
+        # Single org-wide listing, hidden repos backing project wikis are included
+        repos_by_id = dict()
+        for repo in self.__git_client.get_repositories(include_hidden=True):
+            repos_by_id[repo.id] = repo
+
+        # Resolve wiki repos from index instead of requesting every one of them
+        wiki_repo_ids = set()
+        for wiki in self.__wiki_client.get_all_wikis():
+            repo = repos_by_id.get(wiki.repository_id)
+            if repo is None:
+                repo = self.__git_client.get_repository(wiki.repository_id, wiki.project_id)
+            if wiki.type == "projectWiki":
+                wiki_repo_ids.add(repo.id)
+
+            result.setdefault(repo.project.name, {'repos': list(), 'wikis': list()})['wikis'].append(self.__get_repo_info(repo))
+
+        for repo in repos_by_id.values():
+            if repo.id not in wiki_repo_ids:
+                result.setdefault(repo.project.name, {'repos': list(), 'wikis': list()})['repos'].append(self.__get_repo_info(repo))
+
+        return result
+
+    def get_repo_last_push_date(self, repo_id: str, project_name: str) -> str:
+        response = self.__git_client.get_pushes(repo_id, project_name, top=1)
+
+        # Pushes are returned newest first
+        for push in response:
+            return push.date.isoformat()
+
+        return None
+
+    def __get_repo_info(self, repo) -> dict:
+        return {
+            'id': repo.id,
+            'name': repo.name,
+            'remote_url': repo.remote_url,
+            'ssh_url': repo.ssh_url,
+            'size': repo.size,
+            'default_branch': repo.default_branch
+        }
@@ -1,16 +1,23 @@
 import os
 import base64
-from git import Repo
+import subprocess
 
 
 class Git:
-    def __init__(self, user_name: str, user_password: str) -> None:
+    REMOTE_REFS_FILE = "backup-remote-refs"
+    LFS_REFS_FILE = "backup-lfs-refs"
+
+    def __init__(self, user_name: str, user_password: str, lfs_storage: str = None, lfs_concurrent_transfers: int = 8) -> None:
         # Create Basic auth header
         auth_header_bytes = (f"{user_name}:{user_password}").encode("ascii")
         auth_header_base64_bytes = base64.b64encode(auth_header_bytes)
         auth_header_base64 = auth_header_base64_bytes.decode("ascii")
         self.auth_header = f"Authorization: Basic {auth_header_base64}"
 
+        # LFS objects are fetched only when storage shared by all mirrors is set
+        self.lfs_storage = lfs_storage
+        self.lfs_concurrent_transfers = lfs_concurrent_transfers
+
     def sync(self, remote: str, path: str) -> bool:
         has_changes = False
         if os.path.isdir(path):
@@ -19,24 +26,161 @@ class Git:
             has_changes = True
             self.__clone(remote, path)
 
+        # Mirror stays changed until LFS objects of its refs are fetched, so failed LFS fetch is archived by later run
+        if self.lfs_storage is not None and self.__sync_lfs(path):
+            has_changes = True
+
         return has_changes
 
+    @staticmethod
+    def has_lfs() -> bool:
+        process = subprocess.run(["git", "lfs", "version"], capture_output=True, text=True)
+        return process.returncode == 0
+
+    def fetch_lfs(self, path: str, storage: str, concurrent_transfers: int = 8) -> None:
+        # Mirror keeps auth header in its config since clone, passing it again would send it twice
+        auth_args = list()
+        if not self.__has_auth_header(path):
+            auth_args = ["-c", f"http.extraHeader={self.auth_header}"]
+
+        # Storage is content-addressed, object referenced by many repos is downloaded & stored once
+        process = subprocess.run(
+            [
+                "git",
+                "-c", f"lfs.storage={os.path.abspath(storage)}",
+                "-c", f"lfs.concurrenttransfers={max(concurrent_transfers, 1)}",
+                *auth_args,
+                "lfs", "fetch", "--all", "origin"
+            ],
+            cwd=path,
+            capture_output=True,
+            text=True
+        )
+        if process.returncode != 0:
+            raise Exception(f"git lfs fetch failed: {process.stderr.strip()}")
+
+    @staticmethod
+    def __has_auth_header(path: str) -> bool:
+        process = subprocess.run(["git", "config", "--get-all", "http.extraHeader"], cwd=path, capture_output=True, text=True)
+        return any(line.lower().startswith("authorization:") for line in process.stdout.splitlines())
+
+    @staticmethod
+    def get_repo(path: str):
+        # GitPython is imported on first use, commands which don't touch mirrors don't pay for it
+        from git import Repo
+        return Repo(path)
+
     def __clone(self, remote: str, path: str) -> None:
+        from git import Repo
         Repo.clone_from(
             url=remote,
             c=f"http.extraHeader={self.auth_header}",
             to_path=path,
-            mirror=True
+            mirror=True,
+            allow_unsafe_options=True
         )
 
     def __update(self, path: str) -> bool:
         has_changes = False
 
-        repo_remote = Repo(path).remote()
-        for fetch_info in repo_remote.fetch(prune=True):
+        repo = self.get_repo(path)
+
+        # Single lightweight request, mirror is fetched only when refs of remote moved since last fetch
+        remote_refs = repo.git.ls_remote("origin")
+        remote_refs_path = os.path.join(path, self.REMOTE_REFS_FILE)
+        if os.path.isfile(remote_refs_path):
+            with open(remote_refs_path, "r") as file:
+                if file.read() == remote_refs:
+                    return False
+
+        for fetch_info in repo.remote().fetch(prune=True):
             if fetch_info.flags != fetch_info.HEAD_UPTODATE:
                 has_changes = True
                 break
-        repo_remote.update(prune=True)
+
+        # Record refs only after successful fetch
+        with open(remote_refs_path, "w") as file:
+            file.write(remote_refs)
 
         return has_changes
+
+    def __sync_lfs(self, path: str) -> bool:
+        # Objects of every ref are fetched once per refs of mirror, failed fetch is retried by next sync even when remote didn't move
+        refs = self.get_repo(path).git.for_each_ref(format="%(objectname) %(refname)")
+        lfs_refs_path = os.path.join(path, self.LFS_REFS_FILE)
+        if os.path.isfile(lfs_refs_path):
+            with open(lfs_refs_path, "r") as file:
+                if file.read() == refs:
+                    return False
+
+        self.fetch_lfs(path, self.lfs_storage, self.lfs_concurrent_transfers)
+
+        # Record refs only after successful fetch
+        with open(lfs_refs_path, "w") as file:
+            file.write(refs)
+
+        return True
+
+    def list_refs(self, path: str) -> dict:
+        result = dict()
+        for line in self.get_repo(path).git.for_each_ref(format="%(objectname) %(refname)").splitlines():
+            object_name, ref_name = line.split(" ", 1)
+            result[ref_name] = object_name
+
+        return result
+
+    def bundle(self, path: str, bundle_path: str, exclude_tips: list = None) -> bool:
+        # Objects reachable from excluded tips are left out (prerequisites of incremental bundle)
+        rev_args = [f"^{tip}" for tip in self.__filter_existing_objects(path, exclude_tips or list())]
+
+        process = subprocess.run(
+            ["git", "bundle", "create", bundle_path, "--all", "--stdin"],
+            cwd=path,
+            input="".join(f"{rev_arg}\n" for rev_arg in rev_args),
+            capture_output=True,
+            text=True
+        )
+        if process.returncode != 0:
+            if "empty bundle" in process.stderr:
+                # Only refs moved to already backed up objects
+                return False
+            raise Exception(f"git bundle failed: {process.stderr.strip()}")
+
+        return True
+
+    def count_objects(self, path: str) -> dict:
+        # Sizes are reported by git in KiB
+        result = dict()
+        for line in self.get_repo(path).git.count_objects(v=True).splitlines():
+            key, value = line.split(":", 1)
+            result[key.strip()] = int(value)
+
+        return result
+
+    def maintain(self, path: str, threads: int = 1) -> None:
+        # Gc repacks loose objects & small packs into single pack, graphs speed up fetch negotiation & bundling
+        for args in (["gc", "--quiet"], ["commit-graph", "write", "--reachable"], ["multi-pack-index", "write"]):
+            process = subprocess.run(
+                ["git", "-c", f"pack.threads={threads}", "-c", "gc.autoDetach=false", *args],
+                cwd=path,
+                capture_output=True,
+                text=True
+            )
+            if process.returncode != 0:
+                raise Exception(f"git {args[0]} failed: {process.stderr.strip()}")
+
+    def __filter_existing_objects(self, path: str, object_names: list) -> list:
+        if len(object_names) == 0:
+            return list()
+
+        # Rewritten history may have removed old tips from mirror
+        process = subprocess.run(
+            ["git", "cat-file", "--batch-check=%(objectname)"],
+            cwd=path,
+            input="\n".join(object_names) + "\n",
+            capture_output=True,
+            text=True,
+            check=True
+        )
+
+        return [line for line in process.stdout.splitlines() if not line.endswith(" missing")]
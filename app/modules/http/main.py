@@ -0,0 +1,116 @@
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+from logzero import logger
+
+
+class RateLimiter:
+    """Spaces requests of all threads evenly, throttled response pauses every request"""
+
+    def __init__(self, rate: float = 0) -> None:
+        self.rate = rate
+        self.__lock = threading.Lock()
+        self.__next_time = 0.0
+        self.__paused_until = 0.0
+
+    def acquire(self) -> None:
+        with self.__lock:
+            now = time.monotonic()
+            start = max(now, self.__paused_until)
+            if self.rate > 0:
+                start = max(start, self.__next_time)
+                self.__next_time = start + 1 / self.rate
+
+        if start > now:
+            time.sleep(start - now)
+
+    def pause(self, seconds: float) -> None:
+        with self.__lock:
+            self.__paused_until = max(self.__paused_until, time.monotonic() + seconds)
+
+
+class RetryAdapter(HTTPAdapter):
+    # Throttled requests were not processed by server, so they are safe to retry for every method
+    THROTTLED_STATUS_CODES = {429, 503}
+    RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+    IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+    def __init__(self, pool_size: int, retries: int, backoff_base: float, backoff_max: float, rate_limiter: RateLimiter) -> None:
+        super().__init__(pool_maxsize=pool_size)
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate_limiter = rate_limiter
+
+    def get_backoff(self, attempt: int) -> float:
+        # Full jitter, concurrent workers throttled together don't retry in lockstep
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    @staticmethod
+    def get_retry_after(response: requests.Response) -> float:
+        value = response.headers.get("Retry-After")
+        if value is None:
+            return None
+
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            pass
+
+        try:
+            return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0)
+        except (TypeError, ValueError):
+            return None
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        is_idempotent = request.method in self.IDEMPOTENT_METHODS
+
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                response = super().send(request, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as exception:
+                # Request which failed to connect never reached server
+                if attempt >= self.retries or not (is_idempotent or isinstance(exception, requests.ConnectTimeout)):
+                    raise
+                reason = type(exception).__name__
+                delay = self.get_backoff(attempt)
+            else:
+                is_throttled = response.status_code in self.THROTTLED_STATUS_CODES
+                if attempt >= self.retries or response.status_code not in self.RETRY_STATUS_CODES or not (is_throttled or is_idempotent):
+                    return response
+
+                reason = response.status_code
+                retry_after = self.get_retry_after(response)
+                delay = retry_after if retry_after is not None else self.get_backoff(attempt)
+                if is_throttled:
+                    # Hold back every worker, more concurrent requests would only prolong throttling
+                    self.rate_limiter.pause(delay)
+                response.close()
+
+            attempt += 1
+            logger.warning(f"http | retrying request | method: {request.method} | url: {request.url.split('?')[0]} | reason: {reason} | attempt: {attempt} | delay: {delay:.1f} s")
+            time.sleep(delay)
+
+
+class Http:
+    """Transport shared by all clients, pools connections & retries failed or throttled requests"""
+
+    def __init__(self, pool_size: int = 10, retries: int = 5, backoff_base: float = 1, backoff_max: float = 60, rate_limit: float = 0) -> None:
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.adapter = RetryAdapter(pool_size, retries, backoff_base, backoff_max, self.rate_limiter)
+
+    def mount(self, session: requests.Session) -> requests.Session:
+        if session.get_adapter("https://") is not self.adapter:
+            session.mount("https://", self.adapter)
+            session.mount("http://", self.adapter)
+        return session
+
+    def session(self) -> requests.Session:
+        return self.mount(requests.Session())
@@ -0,0 +1,154 @@
+import os
+import json
+import threading
+from datetime import datetime, timezone
+
+
+class Journal:
+    """Append-only log of progress of every changed repo & wiki, pending items survive crash of run"""
+
+    FILE_NAME = "journal.jsonl"
+
+    FETCHING = "fetching"
+    FETCHED = "fetched"
+    ARCHIVED = "archived"
+    UPLOADED = "uploaded"
+    UNCHANGED = "unchanged"
+
+    PENDING = (FETCHING, FETCHED, ARCHIVED)
+
+    def __init__(self) -> None:
+        # Journal is written only when opened, otherwise every record is no-op
+        self.path = None
+        self.items = dict()
+        self.__files = dict()
+        self.__file = None
+        self.__lock = threading.Lock()
+        self.__on_uploaded = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    @property
+    def file_path(self) -> str:
+        return os.path.join(self.path, self.FILE_NAME)
+
+    def open(self, path: str, on_uploaded=None) -> "Journal":
+        self.path = path
+        self.__on_uploaded = on_uploaded
+        self.items = self.load(self.file_path)
+
+        # Archive staged by crashed run could be lost since, item is archived again
+        for item, entry in self.items.items():
+            if entry['status'] == self.ARCHIVED and not all(os.path.isfile(file_path) for file_path in entry['files']):
+                self.items[item] = {**entry, 'status': self.FETCHED, 'files': list()}
+
+        self.__files = {file_path: item for item, entry in self.items.items() for file_path in entry['files']}
+
+        # Only pending items are carried over, so journal doesn't grow between runs
+        self.__compact()
+        self.__file = open(self.file_path, "a")
+
+        return self
+
+    def close(self) -> None:
+        if self.__file is None:
+            return
+
+        with self.__lock:
+            self.__file.close()
+            self.__file = None
+            self.__compact()
+
+    @classmethod
+    def load(cls, file_path: str) -> dict:
+        # Entries are replayed in order, last entry of item wins
+        items = dict()
+        try:
+            with open(file_path, "r") as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Line torn by crash is skipped, item keeps its previous entry
+                        continue
+                    items[entry['item']] = entry
+        except FileNotFoundError:
+            pass
+
+        return {item: entry for item, entry in items.items() if entry['status'] in cls.PENDING}
+
+    def get_pending(self, *statuses: str) -> set:
+        with self.__lock:
+            return {item for item, entry in self.items.items() if entry['status'] in (statuses or self.PENDING)}
+
+    def record(self, item: str, status: str, files: list = None) -> None:
+        if not self.enabled:
+            return
+
+        with self.__lock:
+            # Archives of item not uploaded yet keep item pending, whatever happens to its mirror since
+            previous = self.items.get(item)
+            files = sorted({file_path for file_path in (previous or {'files': list()})['files'] if self.__files.get(file_path) == item} | {os.path.normpath(file_path) for file_path in files or list()})
+            if status not in self.PENDING and len(files) > 0:
+                status = self.ARCHIVED
+
+            entry = {
+                'item': item,
+                'status': status,
+                'files': files,
+                'time': datetime.now(timezone.utc).isoformat()
+            }
+
+            if status in self.PENDING:
+                self.items[item] = entry
+            else:
+                self.items.pop(item, None)
+            for file_path in entry['files']:
+                self.__files[file_path] = item
+
+            # Item which was never pending leaves nothing to resume, its entry isn't written at all
+            file = self.__file if status in self.PENDING or previous is not None else None
+            if file is not None:
+                file.write(json.dumps(entry, sort_keys=True) + "\n")
+                file.flush()
+
+        # Entry is on disk before item moves on, so crash right after it can't lose change, workers don't wait for fsync of each other
+        if file is not None:
+            os.fsync(file.fileno())
+
+        # Item is backed up once its last archive is uploaded
+        if status == self.UPLOADED and self.__on_uploaded is not None:
+            self.__on_uploaded(item)
+
+    def record_archived(self, item: str, files: list) -> None:
+        # Nothing to upload when no new objects were bundled
+        self.record(item, self.ARCHIVED if len(files) > 0 else self.UPLOADED, files)
+
+    def record_uploaded_file(self, file_path: str) -> None:
+        if not self.enabled:
+            return
+
+        # Item is uploaded when last of its archives is uploaded, paths are normalized as archives are found by walking PATH_ARCHIVE
+        with self.__lock:
+            item = self.__files.pop(os.path.normpath(file_path), None)
+            entry = self.items.get(item)
+            if entry is None or entry['status'] != self.ARCHIVED:
+                return
+            files = [path for path in entry['files'] if self.__files.get(path) == item]
+
+        if len(files) == 0:
+            self.record(item, self.UPLOADED)
+
+    def __compact(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+
+        # Write into temporary file first, so crash never leaves half-written journal
+        file_path_tmp = f"{self.file_path}.tmp"
+        with open(file_path_tmp, "w") as file:
+            for item in sorted(self.items):
+                file.write(json.dumps(self.items[item], sort_keys=True) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(file_path_tmp, self.file_path)
@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+
+class Metrics:
+    """Durations, byte counts & throughput of every stage & item of single run"""
+
+    PROMETHEUS_PREFIX = "devops_backup"
+
+    def __init__(self) -> None:
+        # Expensive measurements (e.g. walking mirrors) are taken only when enabled
+        self.enabled = False
+        self.started = datetime.now(timezone.utc)
+        self.stages = dict()
+        self.items = list()
+        self.__time_start = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def __get_stage(self, stage: str) -> dict:
+        return self.stages.setdefault(stage, {"seconds": 0.0, "items": 0, "bytes": 0, "failures": 0})
+
+    @contextmanager
+    def stage(self, stage: str):
+        # Wall clock of stage, items of stage can overlap when processed by multiple workers
+        time_start = time.monotonic()
+        try:
+            yield
+        finally:
+            with self.__lock:
+                self.__get_stage(stage)["seconds"] += time.monotonic() - time_start
+
+    @contextmanager
+    def measure(self, stage: str, item: str):
+        # Measured code fills values, size is summed into stage totals
+        values = dict()
+        time_start = time.monotonic()
+        try:
+            yield values
+        except Exception:
+            self.record(stage, item, time.monotonic() - time_start, failed=True, **values)
+            raise
+        self.record(stage, item, time.monotonic() - time_start, **values)
+
+    def record(self, stage: str, item: str, seconds: float, size: int = 0, failed: bool = False, **values) -> None:
+        with self.__lock:
+            totals = self.__get_stage(stage)
+            totals["items"] += 1
+            totals["bytes"] += size
+            totals["failures"] += int(failed)
+            self.items.append({"stage": stage, "item": item, "seconds": seconds, "bytes": size, "failed": failed, **values})
+
+    def get_report(self, exit_code: int) -> dict:
+        with self.__lock:
+            stages = dict()
+            for stage, totals in self.stages.items():
+                throughput = totals["bytes"] / totals["seconds"] if totals["seconds"] > 0 else 0
+                stages[stage] = {**totals, "throughput": throughput}
+
+            return {
+                "started": self.started.isoformat(),
+                "seconds": time.monotonic() - self.__time_start,
+                "exit_code": exit_code,
+                "stages": stages,
+                "items": list(self.items)
+            }
+
+    def write_report(self, path: str, exit_code: int) -> None:
+        self.__write(os.path.join(path, "report.json"), json.dumps(self.get_report(exit_code), indent=2, sort_keys=True))
+
+    def write_prometheus(self, path: str, exit_code: int) -> None:
+        report = self.get_report(exit_code)
+        prefix = self.PROMETHEUS_PREFIX
+
+        lines = list()
+
+        def add(name: str, help: str, samples: list) -> None:
+            lines.append(f"# HELP {prefix}_{name} {help}")
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{self.escape_label(value)}"' for key, value in labels.items())
+                lines.append(f"{prefix}_{name}{{{label_text}}} {value}" if label_text else f"{prefix}_{name} {value}")
+
+        stages = sorted(report["stages"].items())
+        items = [item for item in report["items"] if item["item"] is not None]
+
+        add("last_run_timestamp_seconds", "Start time of last run", [({}, self.started.timestamp())])
+        add("last_run_duration_seconds", "Duration of last run", [({}, report["seconds"])])
+        add("last_run_exit_code", "Exit code of last run", [({}, exit_code)])
+        add("stage_duration_seconds", "Wall clock duration of stage", [({"stage": stage}, totals["seconds"]) for stage, totals in stages])
+        add("stage_items", "Items processed by stage", [({"stage": stage}, totals["items"]) for stage, totals in stages])
+        add("stage_bytes", "Bytes processed by stage", [({"stage": stage}, totals["bytes"]) for stage, totals in stages])
+        add("stage_failures", "Items failed in stage", [({"stage": stage}, totals["failures"]) for stage, totals in stages])
+        add("stage_throughput_bytes_per_second", "Bytes processed by stage per second of wall clock", [({"stage": stage}, totals["throughput"]) for stage, totals in stages])
+        add("item_duration_seconds", "Duration of item in stage", [({"stage": item["stage"], "item": item["item"]}, item["seconds"]) for item in items])
+        add("item_bytes", "Bytes of item processed in stage", [({"stage": item["stage"], "item": item["item"]}, item["bytes"]) for item in items])
+
+        # Node exporter textfile collector reads only *.prom files
+        self.__write(os.path.join(path, f"{prefix}.prom"), "\n".join(lines) + "\n")
+
+    @staticmethod
+    def escape_label(value: str) -> str:
+        return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+    @staticmethod
+    def __write(file_path: str, content: str) -> None:
+        # Collector may read file at any time, so it is replaced at once
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(f"{file_path}.tmp", "w") as file:
+            file.write(content)
+        os.replace(f"{file_path}.tmp", file_path)
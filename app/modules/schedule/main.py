@@ -0,0 +1,73 @@
+import time
+import threading
+
+
+class Schedule:
+    """Order of items by expected cost & wall-clock budget of run"""
+
+    def __init__(self, budget: int = 0) -> None:
+        # Budget in seconds since start, 0 disables it
+        self.budget = budget
+        self.durations = dict()
+        self.deferred = list()
+        self.__time_start = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def start(self, budget: int = 0) -> None:
+        self.budget = budget
+        self.__time_start = time.monotonic()
+
+    def load(self, data: dict) -> None:
+        self.durations = dict(data.get("durations", dict()))
+        self.deferred = list(data.get("deferred", list()))
+
+    def dump(self, names: set) -> dict:
+        # Items gone from inventory are forgotten
+        with self.__lock:
+            return {
+                "durations": {name: seconds for name, seconds in self.durations.items() if name in names},
+                "deferred": sorted(name for name in self.deferred if name in names)
+            }
+
+    def get_remaining(self) -> float:
+        if self.budget <= 0:
+            return None
+
+        return self.budget - (time.monotonic() - self.__time_start)
+
+    def is_exhausted(self) -> bool:
+        remaining = self.get_remaining()
+        return remaining is not None and remaining <= 0
+
+    def get_throughput(self, sizes: dict) -> float:
+        # Bytes per second of items with known duration & size, used to turn size into expected seconds
+        known = [(sizes[name], seconds) for name, seconds in self.durations.items() if sizes.get(name) and seconds > 0]
+        total_seconds = sum(seconds for _, seconds in known)
+        if total_seconds <= 0:
+            return None
+
+        return sum(size for size, _ in known) / total_seconds
+
+    def order(self, sizes: dict) -> list:
+        # Items deferred by previous run go first so they can't starve, then most expensive, so long item never starts last
+        throughput = self.get_throughput(sizes)
+        deferred = set(self.deferred)
+
+        def get_key(name: str) -> tuple:
+            # Cheap last sync (e.g. nothing to fetch) doesn't make large item cheap, it may change next time
+            size = sizes[name] or 0
+            cost = max(self.durations.get(name, 0), size / throughput if throughput is not None else 0)
+            return (name not in deferred, -cost, -size, name)
+
+        return sorted(sizes, key=get_key)
+
+    def record(self, name: str, seconds: float) -> None:
+        with self.__lock:
+            self.durations[name] = seconds
+            if name in self.deferred:
+                self.deferred.remove(name)
+
+    def defer(self, name: str) -> None:
+        with self.__lock:
+            if name not in self.deferred:
+                self.deferred.append(name)
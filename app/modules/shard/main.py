@@ -0,0 +1,84 @@
+import os
+import fcntl
+import socket
+import hashlib
+
+
+class Shard:
+    """Stable subset of projects or repos owned by one of multiple workers"""
+
+    KEYS = ("repo", "project")
+
+    def __init__(self, index: int = 0, count: int = 1, key: str = "repo") -> None:
+        if count < 1 or index < 0 or index >= count:
+            raise Exception(f"Invalid shard: index must be in range 0 - {count - 1}, got {index}")
+        if key not in self.KEYS:
+            raise Exception(f"Invalid shard key: '{key}', supported keys: {', '.join(self.KEYS)}")
+
+        self.index = index
+        self.count = count
+        self.key = key
+        self.__lock_file = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.count > 1
+
+    @staticmethod
+    def get_weight(index: int, key: str) -> int:
+        # Built-in hash() is salted per process, every worker has to compute same weights
+        return int.from_bytes(hashlib.sha256(f"{index}/{key}".encode()).digest()[:8], "big")
+
+    def get_owner(self, key: str) -> int:
+        # Rendezvous hashing, when shard count changes only items of added or removed shards move
+        return max(range(self.count), key=lambda index: self.get_weight(index, key))
+
+    def owns(self, project_name: str, item_type: str, item_name: str) -> bool:
+        if not self.enabled:
+            return True
+
+        key = project_name if self.key == "project" else f"{project_name}/{item_type}/{item_name}"
+        return self.get_owner(key) == self.index
+
+    def filter_inventory(self, inventory: dict) -> dict:
+        result = dict()
+        for project_name, project in inventory.items():
+            repos = [repo for repo in project['repos'] if self.owns(project_name, "git", repo['name'])]
+            wikis = [wiki for wiki in project['wikis'] if self.owns(project_name, "wiki", wiki['name'])]
+            if len(repos) > 0 or len(wikis) > 0:
+                result[project_name] = {**project, 'repos': repos, 'wikis': wikis}
+
+        return result
+
+    def get_path(self, path: str) -> str:
+        # Every shard works in its own subtree, so mirrors, archives & state of shards never clash
+        if not self.enabled or path is None:
+            return path
+
+        return os.path.join(path, f"shard-{self.index}")
+
+    def acquire(self, path: str) -> None:
+        # Lock is held by open file, it is released by kernel even when process is killed
+        lock_path = f"{path.rstrip('/')}.lock"
+        os.makedirs(os.path.dirname(lock_path) or ".", exist_ok=True)
+
+        lock_file = open(lock_path, "a+")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.seek(0)
+            owner = lock_file.read().strip()
+            lock_file.close()
+            raise Exception(f"Shard {self.index} is already locked: {lock_path} (owner: {owner or 'unknown'})")
+
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(f"{socket.gethostname()} {os.getpid()}\n")
+        lock_file.flush()
+        self.__lock_file = lock_file
+
+    def release(self) -> None:
+        if self.__lock_file is not None:
+            fcntl.flock(self.__lock_file, fcntl.LOCK_UN)
+            self.__lock_file.close()
+            self.__lock_file = None
@@ -1,18 +1,175 @@
-from office365.runtime.auth.client_credential import ClientCredential
-from office365.sharepoint.client_context import ClientContext
+import os
+import time
+import uuid
+import threading
+from typing import TYPE_CHECKING
+
+from app.modules.http.main import Http
+
+if TYPE_CHECKING:
+    from office365.sharepoint.client_context import ClientContext
 
 
 class SharePoint:
-    def __init__(self, url: str, client_id: str, client_secret: str) -> None:
-        self.client = ClientContext(url).with_credentials(ClientCredential(client_id, client_secret))
+    CHUNK_SIZE_MIN = 10 * 1024 * 1024
+    CHUNK_SIZE_MAX = 250 * 1024 * 1024
+    CHUNK_SIZE_ALIGN = 1024 * 1024
+    CHUNK_TARGET_SECONDS = 10
+
+    def __init__(self, url: str, client_id: str, client_secret: str, chunk_size_min: int = CHUNK_SIZE_MIN, chunk_size_max: int = CHUNK_SIZE_MAX, http: Http = None) -> None:
+        self.__url = url
+        self.__http = http
+
+        # SDK is imported on first use, commands which don't talk to SharePoint don't pay for it
+        from office365.runtime.auth.client_credential import ClientCredential
+        self.__credentials = ClientCredential(client_id, client_secret)
+        self.__local = threading.local()
+        self.chunk_size_min = chunk_size_min
+        self.chunk_size_max = max(chunk_size_min, chunk_size_max)
+
+    @property
+    def client(self) -> "ClientContext":
+        # ClientContext queues requests internally, so every thread gets its own
+        if not hasattr(self.__local, "client"):
+            from office365.sharepoint.client_context import ClientContext
+            client = ClientContext(self.__url).with_credentials(self.__credentials)
+            if self.__http is not None:
+                client.pending_request().with_transport(session=self.__http.session())
+            self.__local.client = client
+        return self.__local.client
+
+    def get_next_chunk_size(self, chunk_size: int, chunk_bytes: int, chunk_seconds: float) -> int:
+        if chunk_seconds <= 0:
+            return self.chunk_size_max
+
+        # Size next chunk to take CHUNK_TARGET_SECONDS at observed throughput
+        throughput = chunk_bytes / chunk_seconds
+        next_chunk_size = int(throughput * self.CHUNK_TARGET_SECONDS)
 
-    def upload_file(self, root_dir: str, target_dir: str, file_path: str):
+        # Don't grow faster than twice per chunk, throughput of first chunk is noisy
+        next_chunk_size = min(next_chunk_size, chunk_size * 2)
+        next_chunk_size = next_chunk_size - next_chunk_size % self.CHUNK_SIZE_ALIGN
+
+        return min(max(next_chunk_size, self.chunk_size_min), self.chunk_size_max)
+
+    def upload_file(self, root_dir: str, target_dir: str, file_path: str, on_progress=None, resume: dict = None, on_checkpoint=None) -> dict:
+        file_size = os.path.getsize(file_path)
+        file_mtime = os.path.getmtime(file_path)
+        resumed_offsets = list()
+
+        def checkpoint(upload: dict) -> None:
+            if upload is not None:
+                upload = {**upload, 'size': file_size, 'mtime': file_mtime}
+                resumed_offsets.append(upload['offset'])
+            if on_checkpoint is not None:
+                on_checkpoint(upload)
+
+        with open(file_path, "rb") as file:
+            # Checkpoint is valid only for same file, archive could be rewritten since
+            if resume is not None and resume.get('size') == file_size and resume.get('mtime') == file_mtime:
+                try:
+                    file.seek(resume['offset'])
+                    return self.upload_stream(root_dir, target_dir, os.path.basename(file_path), file, on_progress, file_size, resume, checkpoint)
+                except Exception:
+                    # Keep checkpoint when resumed session moved on, otherwise session expired & file is uploaded again
+                    if len(resumed_offsets) > 0:
+                        raise
+                    file.seek(0)
+
+            return self.upload_stream(root_dir, target_dir, os.path.basename(file_path), file, on_progress, file_size, None, checkpoint)
+
+    def upload_stream(self, root_dir: str, target_dir: str, file_name: str, stream, on_progress=None, file_size: int = None, resume: dict = None, on_checkpoint=None) -> dict:
         # Get upload folder
-        target_folder = self.client.web.get_folder_by_server_relative_path(f"{root_dir}/{target_dir}")
+        target_folder = self.client.web.get_folder_by_server_relative_path(f"{root_dir}/{target_dir}" if target_dir else root_dir)
+
+        time_start = time.monotonic()
 
-        # Upload file to sharepoint
-        size_chunk = 50000000
-        target_folder.files.create_upload_session(file_path, size_chunk).execute_query()
+        # Resumed upload continues session after last committed chunk, stream is positioned by caller
+        upload_id = None
+        offset = 0
+        if resume is not None:
+            target_file = target_folder.files.get_by_url(file_name)
+            upload_id = resume['upload_id']
+            offset = resume['offset']
+        offset_start = offset
+
+        # Peek single byte after chunk, so last chunk is known even when size of stream is not, only one chunk is held in memory
+        chunk_size = self.chunk_size_min
+        content = stream.read(chunk_size)
+        peek = stream.read(1)
+
+        if upload_id is None and len(peek) == 0:
+            # Upload small file in single request
+            target_folder.files.add(file_name, content, True).execute_query()
+            offset = len(content)
+        else:
+            # Upload file to sharepoint in chunks, SharePoint requires chunks of one file to be sent in order
+            if upload_id is None:
+                target_file = target_folder.files.add(file_name, None, True).execute_query()
+                upload_id = str(uuid.uuid4())
+            while len(content) > 0:
+                time_chunk = time.monotonic()
+
+                if offset == 0:
+                    target_file.start_upload(upload_id, content).execute_query()
+                elif len(peek) > 0:
+                    target_file.continue_upload(upload_id, offset, content).execute_query()
+                else:
+                    target_file.finish_upload(upload_id, offset, content).execute_query()
+
+                offset += len(content)
+                chunk_size = self.get_next_chunk_size(chunk_size, len(content), time.monotonic() - time_chunk)
+
+                if on_progress is not None:
+                    on_progress(offset, file_size)
+                if on_checkpoint is not None and len(peek) > 0:
+                    on_checkpoint({'upload_id': upload_id, 'offset': offset})
+
+                # Chunk is dropped before next one is read, peeked byte starts next chunk
+                content = None
+                content = peek + stream.read(chunk_size - 1) if len(peek) > 0 else b""
+                peek = stream.read(1) if len(content) > 0 else b""
+
+        # Upload is complete, checkpoint is no longer needed
+        if on_checkpoint is not None:
+            on_checkpoint(None)
+
+        seconds = time.monotonic() - time_start
+        return {
+            "size": offset,
+            "seconds": seconds,
+            "throughput": (offset - offset_start) / seconds if seconds > 0 else 0
+        }
 
     def ensure_dir_exists(self, root_dir: str, target_dir: str):
         self.client.web.ensure_folder_path(f"{root_dir}/{target_dir}").execute_query()
+
+    def ensure_dirs_exist(self, root_dir: str, target_dirs: list):
+        # Server relative root is made site relative first, same as ensure_folder_path does
+        site_path = self.client.site_path.strip("/")
+        root_dir = root_dir.strip("/")
+        if site_path and f"{root_dir}/".lower().startswith(f"{site_path}/".lower()):
+            root_dir = root_dir[len(site_path):]
+
+        # Collect every level of every dir, so parent is always created before its children
+        paths = set()
+        for target_dir in target_dirs:
+            names = [name for name in f"{root_dir}/{target_dir}".split("/") if name]
+            for index in range(1, len(names) + 1):
+                paths.add("/".join(names[:index]))
+
+        # Adding existing folder is no-op, all folders are created in single batch request
+        for path in sorted(paths, key=lambda path: (path.count("/"), path)):
+            parent_path, name = os.path.split(path)
+            if parent_path == "":
+                parent_folder = self.client.web.root_folder
+            else:
+                parent_folder = self.client.web.get_folder_by_server_relative_path(parent_path)
+            parent_folder.folders.add(name)
+
+        self.client.execute_batch()
+
+    @staticmethod
+    def is_not_found(exception: Exception) -> bool:
+        response = getattr(exception, "response", None)
+        return getattr(response, "status_code", None) == 404
@@ -0,0 +1,41 @@
+import os
+import json
+import threading
+
+
+class State:
+    """JSON documents kept on persistent volume between runs"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.__lock = threading.Lock()
+
+    def get_file_path(self, name: str) -> str:
+        return os.path.join(self.path, f"{name}.json")
+
+    def load(self, name: str, default=None):
+        try:
+            with open(self.get_file_path(name), "r") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return default
+        except ValueError:
+            # Corrupted document is treated as missing, it is rebuilt on next save
+            return default
+
+    def save(self, name: str, data) -> None:
+        file_path = self.get_file_path(name)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+        # Write into temporary file first, so crash never leaves half-written document
+        with self.__lock:
+            file_path_tmp = f"{file_path}.{threading.get_ident()}.tmp"
+            with open(file_path_tmp, "w") as file:
+                json.dump(data, file, indent=2, sort_keys=True)
+            os.replace(file_path_tmp, file_path)
+
+    def delete(self, name: str) -> None:
+        try:
+            os.remove(self.get_file_path(name))
+        except FileNotFoundError:
+            pass
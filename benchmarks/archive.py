@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Archive benchmark
+
+Compares throughput & size of archive engine against previous
+`shutil.make_archive` path on git mirrors.
+
+Usage: python -m benchmarks.archive [--source PATH ...] [--workers N]
+Without --source, synthetic mirrors are generated into temporary dir.
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from app.modules.archive.main import Archive, zstandard
+
+
+def create_mirror(path: str, files: int = 200, file_size: int = 256 * 1024) -> str:
+    work_path = f"{path}.work"
+    subprocess.run(["git", "init", "-q", work_path], check=True)
+
+    # Mix of compressible text & random binary content, like typical repo
+    for index in range(files):
+        with open(os.path.join(work_path, f"file_{index}.txt"), "w") as file:
+            file.write(f"line {index} of generated source file\n" * (file_size // 40))
+        with open(os.path.join(work_path, f"file_{index}.bin"), "wb") as file:
+            file.write(os.urandom(file_size // 4))
+
+    env = {**os.environ, "GIT_AUTHOR_NAME": "benchmark", "GIT_AUTHOR_EMAIL": "benchmark@localhost", "GIT_COMMITTER_NAME": "benchmark", "GIT_COMMITTER_EMAIL": "benchmark@localhost"}
+    subprocess.run(["git", "-C", work_path, "add", "-A"], check=True, env=env)
+    subprocess.run(["git", "-C", work_path, "commit", "-q", "-m", "generated"], check=True, env=env)
+    subprocess.run(["git", "clone", "-q", "--mirror", work_path, path], check=True)
+    subprocess.run(["git", "-C", path, "gc", "-q"], check=True)
+    shutil.rmtree(work_path)
+
+    return path
+
+
+def get_dir_size(path: str) -> int:
+    return sum(os.path.getsize(full_path) for full_path, _ in Archive.walk(path) if os.path.isfile(full_path))
+
+
+def run_engine(name: str, archive, sources: list, path_output: str, workers: int) -> dict:
+    os.makedirs(path_output, exist_ok=True)
+
+    def archive_source(index: int) -> str:
+        base_name = os.path.join(path_output, f"{name}-{index}")
+        if archive is None:
+            return shutil.make_archive(base_name, "zip", sources[index])
+        return archive.write(sources[index], base_name)
+
+    time_start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        file_paths = list(executor.map(archive_source, range(len(sources))))
+    seconds = time.monotonic() - time_start
+
+    size = sum(os.path.getsize(file_path) for file_path in file_paths)
+    for file_path in file_paths:
+        os.remove(file_path)
+
+    return {"name": name, "seconds": seconds, "size": size}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare archive engine against shutil.make_archive")
+    parser.add_argument("--source", action="append", default=list(), help="Path of git mirror to archive (repeatable)")
+    parser.add_argument("--repos", type=int, default=4, help="Number of synthetic mirrors generated without --source")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of archives written concurrently")
+    args = parser.parse_args()
+
+    path_tmp = tempfile.mkdtemp(prefix="archive-benchmark-")
+    try:
+        sources = args.source or [create_mirror(os.path.join(path_tmp, f"repo_{index}.git")) for index in range(args.repos)]
+        source_size = sum(get_dir_size(source) for source in sources)
+
+        engines = [
+            ("make_archive", None, 1),
+            ("zip-6", Archive("zip", 6), 1),
+            ("zip-6", Archive("zip", 6), args.workers),
+            ("zip-1", Archive("zip", 1), args.workers)
+        ]
+        if zstandard is not None:
+            engines.append(("tar.zst-3", Archive("tar.zst", 3), args.workers))
+            engines.append(("tar.zst-3-mt", Archive("tar.zst", 3, -1), 1))
+        else:
+            print("zstandard is not installed, tar.zst is skipped", file=sys.stderr)
+
+        print(f"sources: {len(sources)} | size: {source_size / 1024 / 1024:.1f} MiB")
+        print(f"{'engine':<14} {'workers':>7} {'seconds':>8} {'MiB/s':>8} {'size MiB':>9} {'ratio':>6}")
+        for name, archive, workers in engines:
+            result = run_engine(name, archive, sources, os.path.join(path_tmp, "output"), workers)
+            throughput = source_size / 1024 / 1024 / result["seconds"] if result["seconds"] > 0 else 0
+            print(f"{name:<14} {workers:>7} {result['seconds']:>8.2f} {throughput:>8.1f} {result['size'] / 1024 / 1024:>9.1f} {result['size'] / source_size:>6.3f}")
+    finally:
+        shutil.rmtree(path_tmp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Local stand-ins for Azure DevOps REST API & SharePoint used by benchmarks
+
+Servers answer only requests issued by this app, they keep no state
+other than what is needed to serve listings & count uploaded bytes.
+"""
+
+import os
+import re
+import json
+import threading
+from urllib.parse import urlparse, unquote, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeServer:
+    """HTTP server running in background thread, handle() of subclass answers every request"""
+
+    def __init__(self) -> None:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, so connection pooling of clients is exercised
+            protocol_version = "HTTP/1.1"
+
+            def respond(self) -> None:
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length > 0 else b""
+
+                status, headers, content = server.handle(self.command, urlparse(self.path), self.headers, body)
+
+                self.send_response(status)
+                for name, value in {**headers, "Content-Length": str(len(content))}.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(content)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = do_HEAD = do_OPTIONS = respond
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def start(self) -> "FakeServer":
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, method: str, url, headers, body: bytes) -> tuple:
+        raise NotImplementedError
+
+    @staticmethod
+    def json(data, status: int = 200, headers: dict = None) -> tuple:
+        return status, {"Content-Type": "application/json", **(headers or {})}, json.dumps(data).encode()
+
+
+class FakeDevOps(FakeServer):
+    """Organization with projects, repos & project wikis backed by local bare repos"""
+
+    # Location ids used by azure-devops SDK clients & route templates of their resources
+    LOCATIONS = {
+        "e81700f7-3be2-46de-8624-2eb35882fcaa": ("Location", "ResourceAreas", "_apis/ResourceAreas/{areaId}"),
+        "603fe2ac-9723-48b9-88ad-09305aa6c6e1": ("core", "projects", "_apis/projects/{*projectId}"),
+        "225f7195-f9c7-4d14-ab28-a83f7ff77e1f": ("git", "repositories", "{project}/_apis/git/repositories/{repositoryId}"),
+        "ea98d07b-3c87-4971-8ede-a613694ffb55": ("git", "pushes", "{project}/_apis/git/repositories/{repositoryId}/pushes/{pushId}"),
+        "288d122c-dbd4-451d-aa5f-7dbbba070728": ("wiki", "wikis", "{project}/_apis/wiki/wikis/{wikiIdentifier}")
+    }
+
+    def __init__(self, organization: str = "organization") -> None:
+        super().__init__()
+        self.organization = organization
+        self.organization_url = f"{self.url}/{organization}"
+        self.projects = dict()
+        self.repos = dict()
+
+    def add_repo(self, project_name: str, repo_name: str, remote_url: str, size: int, is_wiki: bool = False) -> dict:
+        project = self.projects.setdefault(project_name, {"id": f"project-{len(self.projects) + 1}", "name": project_name})
+        repo = {
+            "id": f"repo-{len(self.repos) + 1}",
+            "name": repo_name,
+            "remoteUrl": remote_url,
+            "sshUrl": remote_url,
+            "size": size,
+            "defaultBranch": "refs/heads/main",
+            "project": project,
+            "isWiki": is_wiki,
+            "pushId": 1,
+            "pushDate": "2024-01-01T00:00:00Z"
+        }
+        self.repos[repo["id"]] = repo
+        return repo
+
+    def push(self, repo_id: str, size: int, date: str) -> None:
+        # Pushes are exposed to metadata precheck of sync
+        with self.lock:
+            repo = self.repos[repo_id]
+            repo.update({"size": size, "pushId": repo["pushId"] + 1, "pushDate": date})
+
+    @staticmethod
+    def get_repo_data(repo: dict) -> dict:
+        return {key: value for key, value in repo.items() if key not in ("isWiki", "pushId", "pushDate")}
+
+    def handle(self, method: str, url, headers, body: bytes) -> tuple:
+        with self.lock:
+            self.requests += 1
+
+        path = unquote(url.path)[len(f"/{self.organization}"):].strip("/")
+
+        if method == "OPTIONS":
+            return self.json({"count": len(self.LOCATIONS), "value": [
+                {"id": location_id, "area": area, "resourceName": resource_name, "routeTemplate": route_template, "resourceVersion": 1, "minVersion": "1.0", "maxVersion": "7.1", "releasedVersion": "7.0"}
+                for location_id, (area, resource_name, route_template) in self.LOCATIONS.items()
+            ]})
+
+        if path.startswith("_apis/ResourceAreas"):
+            # Empty list makes clients use organization url (same as on-premises server)
+            return self.json({"count": 0, "value": []})
+
+        if path == "_apis/projects":
+            query = parse_qs(url.query)
+            skip = int(query.get("$skip", ["0"])[0])
+            projects = list(self.projects.values())[skip:skip + int(query.get("$top", ["100"])[0])]
+            return self.json({"count": len(projects), "value": projects})
+
+        if path.endswith("_apis/git/repositories"):
+            repos = [self.get_repo_data(repo) for repo in self.repos.values()]
+            return self.json({"count": len(repos), "value": repos})
+
+        match = re.search(r"_apis/git/repositories/([^/]+)/pushes$", path)
+        if match is not None:
+            repo = self.repos[match.group(1)]
+            return self.json({"count": 1, "value": [{"pushId": repo["pushId"], "date": repo["pushDate"]}]})
+
+        match = re.search(r"_apis/git/repositories/([^/]+)$", path)
+        if match is not None:
+            return self.json(self.get_repo_data(self.repos[match.group(1)]))
+
+        if path.endswith("_apis/wiki/wikis"):
+            wikis = [
+                {"id": f"wiki-{repo['id']}", "name": repo["name"], "projectId": repo["project"]["id"], "repositoryId": repo["id"], "type": "projectWiki", "mappedPath": "/"}
+                for repo in self.repos.values() if repo["isWiki"]
+            ]
+            return self.json({"count": len(wikis), "value": wikis})
+
+        return self.json({"message": f"Not found: {path}"}, 404)
+
+
+class FakeSharePoint(FakeServer):
+    """Site with document library, uploaded files are counted & optionally kept on disk"""
+
+    def __init__(self, site: str = "sites/backups", path_storage: str = None) -> None:
+        super().__init__()
+        self.site = site
+        self.site_url = f"{self.url}/{site}"
+        self.path_storage = path_storage
+        self.files = dict()
+        self.bytes_received = 0
+
+    def reset(self) -> None:
+        with self.lock:
+            self.requests = 0
+            self.bytes_received = 0
+
+    def write(self, server_relative_url: str, content: bytes, append: bool) -> None:
+        with self.lock:
+            self.bytes_received += len(content)
+            self.files[server_relative_url] = (self.files.get(server_relative_url, 0) if append else 0) + len(content)
+
+        if self.path_storage is not None:
+            file_path = os.path.join(self.path_storage, server_relative_url.strip("/"))
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, "ab" if append else "wb") as file:
+                file.write(content)
+
+    def handle(self, method: str, url, headers, body: bytes) -> tuple:
+        with self.lock:
+            self.requests += 1
+
+        path = unquote(url.path)
+
+        # App-only authentication: realm discovery, then token from security token service
+        if headers.get("Authorization") == "Bearer":
+            return 401, {"WWW-Authenticate": 'Bearer realm="realm", client_id="client"'}, b""
+        if path.endswith("/tokens/OAuth/2"):
+            return self.json({"token_type": "Bearer", "access_token": "token", "expires_in": "3600", "expires_on": "9999999999"})
+        if path.lower().endswith("/_api/contextinfo"):
+            return self.json({"d": {"GetContextWebInformation": {"FormDigestValue": "digest", "FormDigestTimeoutSeconds": 1800}}})
+
+        match = re.search(r"getFolderByServerRelativePath\(DecodedUrl='(.*)'\)/Files/add\((.*)\)$", path)
+        if match is not None:
+            file_name = re.search(r"url='([^']*)'", match.group(2)).group(1)
+            server_relative_url = f"/{self.site}/{match.group(1)}/{file_name}"
+            self.write(server_relative_url, body, False)
+            return self.json({"d": {"Name": file_name, "ServerRelativeUrl": server_relative_url}})
+
+        match = re.search(r"getFileByServerRelativeUrl\('(.*)'\)/(startUpload|continueUpload|finishUpload)\(", path)
+        if match is not None:
+            self.write(match.group(1), body, match.group(2) != "startUpload")
+            return self.json({"d": {"StartUpload": "0"}})
+
+        # Folders & batches are accepted as is
+        return self.json({"d": {}})
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Pipeline benchmark
+
+Drives real main() against synthetic organization served from local
+bare repos, fake Azure DevOps REST API & fake SharePoint (both on
+localhost). Reports wall time, per-stage timing, uploaded bytes, peak
+disk & peak RSS of cold run, warm run (no change) & partial change run.
+
+Usage: python -m benchmarks.pipeline [--projects N] [--repos M] [--env KEY=VALUE ...]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timezone
+
+from benchmarks.fakes import FakeDevOps, FakeSharePoint
+
+
+GIT_ENV = {
+    **os.environ,
+    "GIT_AUTHOR_NAME": "benchmark",
+    "GIT_AUTHOR_EMAIL": "benchmark@localhost",
+    "GIT_COMMITTER_NAME": "benchmark",
+    "GIT_COMMITTER_EMAIL": "benchmark@localhost"
+}
+
+
+def git(path: str, *args) -> str:
+    return subprocess.run(["git", *args], cwd=path, env=GIT_ENV, check=True, capture_output=True, text=True).stdout
+
+
+def get_dir_size(path: str) -> int:
+    size = 0
+    for subdir, dirs, files in os.walk(path):
+        for file in files:
+            try:
+                size += os.path.getsize(os.path.join(subdir, file))
+            except FileNotFoundError:
+                # Files come & go while app runs
+                pass
+
+    return size
+
+
+def write_files(path: str, files: int, file_size: int, seed: int) -> None:
+    # Half of content compresses well (source code), half doesn't (binaries)
+    generator = random.Random(seed)
+    for index in range(files):
+        with open(os.path.join(path, f"file_{index}.txt"), "w") as file:
+            file.write("".join(f"line {generator.randint(0, 1000)} of source file {index}\n" for _ in range(file_size // 60)))
+        with open(os.path.join(path, f"file_{index}.bin"), "wb") as file:
+            file.write(generator.randbytes(file_size // 2))
+
+
+def commit(path_work: str, files: int, file_size: int, seed: int) -> None:
+    write_files(path_work, files, file_size, seed)
+    git(path_work, "add", "-A")
+    git(path_work, "commit", "-q", "-m", f"commit {seed}")
+    git(path_work, "push", "-q", "origin", "main")
+
+
+def create_remote(path_work: str, path_remote: str, files: int, file_size: int, commits: int, seed: int) -> None:
+    os.makedirs(path_work)
+    git(os.path.dirname(path_remote) or ".", "init", "-q", "--bare", "-b", "main", path_remote)
+    git(path_work, "init", "-q", "-b", "main")
+    git(path_work, "remote", "add", "origin", path_remote)
+
+    # Every commit rewrites part of files, so history holds multiple versions
+    for index in range(commits):
+        commit(path_work, max(files * (index + 1) // commits, 1), file_size, seed * 1000 + index)
+
+
+def generate_org(path: str, devops: FakeDevOps, args) -> list:
+    repos = list()
+    for project_index in range(args.projects):
+        project_name = f"Project_{project_index + 1}"
+        os.makedirs(os.path.join(path, "remotes", project_name))
+
+        names = [(f"repo_{repo_index + 1}", False) for repo_index in range(args.repos)]
+        if args.wikis:
+            names.append((f"{project_name}.wiki", True))
+
+        for repo_name, is_wiki in names:
+            path_work = os.path.join(path, "work", project_name, repo_name)
+            path_remote = os.path.join(path, "remotes", project_name, f"{repo_name}.git")
+            create_remote(path_work, path_remote, args.files, args.file_size, args.commits, len(repos) + 1)
+
+            # Remote is served over file:// url, so git transfers packs like with real remote
+            repo = devops.add_repo(project_name, repo_name, f"file://{path_remote}", get_dir_size(path_remote), is_wiki)
+            repos.append((repo["id"], path_work, path_remote))
+
+    return repos
+
+
+def change_repos(devops: FakeDevOps, repos: list, args) -> int:
+    changed = repos[:max(int(len(repos) * args.change_ratio), 1)]
+    for index, (repo_id, path_work, path_remote) in enumerate(changed):
+        commit(path_work, max(args.files // 4, 1), args.file_size, 1000000 + index)
+        devops.push(repo_id, get_dir_size(path_remote), datetime.now(timezone.utc).isoformat())
+
+    return len(changed)
+
+
+def run_scenario(name: str, env: dict, path_data: str, devops: FakeDevOps, sharepoint: FakeSharePoint) -> dict:
+    path_result = os.path.join(os.path.dirname(env["PATH_METRICS"]), f"{name}.json")
+    devops_requests = devops.requests
+    sharepoint.reset()
+
+    # Disk is sampled while app runs, archives staged in PATH_ARCHIVE count too
+    peak_disk = [get_dir_size(path_data)]
+    done = threading.Event()
+
+    def sample_disk() -> None:
+        while not done.wait(0.2):
+            peak_disk.append(get_dir_size(path_data))
+
+    sampler = threading.Thread(target=sample_disk, daemon=True)
+    sampler.start()
+
+    # Every run gets its own process, so peak RSS isn't inherited from previous run
+    time_start = time.monotonic()
+    process = subprocess.run([sys.executable, "-m", "benchmarks.pipeline", "--child", path_result], env=env)
+    seconds = time.monotonic() - time_start
+
+    done.set()
+    sampler.join()
+
+    with open(path_result) as file:
+        child = json.load(file)
+    # Sharded run writes metrics into subtree of its shard
+    path_metrics = env["PATH_METRICS"]
+    if int(env.get("SHARD_COUNT") or 1) > 1:
+        path_metrics = os.path.join(path_metrics, f"shard-{env.get('SHARD_INDEX') or 0}")
+
+    with open(os.path.join(path_metrics, "report.json")) as file:
+        report = json.load(file)
+
+    return {
+        "scenario": name,
+        "exit_code": process.returncode,
+        "seconds": seconds,
+        "stages": {stage: totals["seconds"] for stage, totals in report["stages"].items()},
+        "uploaded_bytes": sharepoint.bytes_received,
+        "requests": devops.requests - devops_requests + sharepoint.requests,
+        "peak_disk": max(peak_disk),
+        "peak_rss": child["peak_rss"],
+        "peak_rss_git": child["peak_rss_children"]
+    }
+
+
+def run_child(path_result: str) -> None:
+    from unittest import mock
+    from office365.runtime.auth.providers.acs_token_provider import ACSTokenProvider
+    from app import main as app
+
+    # Security token service url is hard-coded in office365, it is redirected to fake SharePoint
+    sts_url = os.environ["BENCHMARK_STS_URL"]
+    with mock.patch.object(ACSTokenProvider, "get_security_token_service_url", lambda self, realm: f"{sts_url}/{realm}/tokens/OAuth/2"):
+        try:
+            app.main()
+        except SystemExit:
+            pass
+
+    # Max RSS is reported in KiB on Linux
+    with open(path_result, "w") as file:
+        json.dump({
+            "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            "peak_rss_children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+        }, file)
+
+
+def print_results(results: list) -> None:
+    stages = sorted({stage for result in results for stage in result["stages"]})
+    mib = 1024 * 1024
+
+    header = f"{'scenario':<10} {'exit':>4} {'seconds':>8} " + " ".join(f"{stage:>11}" for stage in stages) + f" {'upload MiB':>10} {'requests':>8} {'disk MiB':>9} {'RSS MiB':>8} {'git RSS MiB':>11}"
+    print(header)
+    for result in results:
+        print(
+            f"{result['scenario']:<10} {result['exit_code']:>4} {result['seconds']:>8.2f} "
+            + " ".join(f"{result['stages'].get(stage, 0):>11.2f}" for stage in stages)
+            + f" {result['uploaded_bytes'] / mib:>10.1f} {result['requests']:>8} {result['peak_disk'] / mib:>9.1f} {result['peak_rss'] / mib:>8.1f} {result['peak_rss_git'] / mib:>11.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark whole backup run against local stand-ins of DevOps, git remotes & SharePoint")
+    parser.add_argument("--projects", type=int, default=2, help="Number of projects")
+    parser.add_argument("--repos", type=int, default=4, help="Number of repos in every project")
+    parser.add_argument("--wikis", action=argparse.BooleanOptionalAction, default=True, help="Add project wiki to every project")
+    parser.add_argument("--files", type=int, default=20, help="Number of text & binary files in every repo")
+    parser.add_argument("--file-size", type=int, default=64 * 1024, help="Size of every file in bytes")
+    parser.add_argument("--commits", type=int, default=5, help="Number of commits in history of every repo")
+    parser.add_argument("--change-ratio", type=float, default=0.25, help="Ratio of repos changed before partial change run")
+    parser.add_argument("--env", action="append", default=list(), help="Optional config of app, e.g. --env SYNC_WORKERS=4 (repeatable)")
+    parser.add_argument("--json", help="Write results also into this file")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        run_child(args.child)
+        return
+
+    path_tmp = tempfile.mkdtemp(prefix="pipeline-benchmark-")
+    path_data = os.path.join(path_tmp, "data")
+    devops = FakeDevOps().start()
+    sharepoint = FakeSharePoint().start()
+    try:
+        time_start = time.monotonic()
+        repos = generate_org(path_tmp, devops, args)
+        print(f"generated organization | repos: {len(repos)} | size: {sum(get_dir_size(path_remote) for _, _, path_remote in repos) / 1024 / 1024:.1f} MiB | seconds: {time.monotonic() - time_start:.1f}")
+
+        env = {
+            **os.environ,
+            "PYTHONPATH": os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            "DEVOPS_PAT": "pat",
+            "DEVOPS_ORGANIZATION_URL": devops.organization_url,
+            "PATH_CLONE": os.path.join(path_data, "clone"),
+            "PATH_ARCHIVE": os.path.join(path_data, "archive"),
+            "PATH_STATE": os.path.join(path_data, "state"),
+            "PATH_METRICS": os.path.join(path_tmp, "metrics"),
+            "SHAREPOINT_URL": sharepoint.site_url,
+            "SHAREPOINT_DIR": "Shared Documents/DevOps",
+            "SHAREPOINT_CLIENT_ID": "client",
+            "SHAREPOINT_CLIENT_SECRET": "secret",
+            "METRICS_ENABLED": "true",
+            "BENCHMARK_STS_URL": sharepoint.url,
+            **dict(item.split("=", 1) for item in args.env)
+        }
+
+        results = list()
+        for name in ("cold", "warm", "partial"):
+            if name == "partial":
+                print(f"changed repos: {change_repos(devops, repos, args)}")
+
+            results.append(run_scenario(name, env, path_data, devops, sharepoint))
+
+        print_results(results)
+        if args.json is not None:
+            with open(args.json, "w") as file:
+                json.dump(results, file, indent=2)
+    finally:
+        devops.stop()
+        sharepoint.stop()
+        shutil.rmtree(path_tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark
+
+Measures time from interpreter start until every command is ready to
+work (app imported & clients of its stages created) & which SDKs each
+command loads. Every measurement runs in fresh interpreter, so imports
+are never cached between them.
+
+Usage: python -m benchmarks.startup [--repeat N] [--max-seconds S]
+Exits with 1 when importing app loads SDK or takes more than --max-seconds.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+
+SDKS = ("azure.devops", "office365", "git", "msrest")
+
+# Clients every command creates before it starts working
+COMMAND_SETUP = {
+    "import": "",
+    "discover": "main.AzureDevops('pat', 'http://localhost/organization')",
+    "sync": "main.AzureDevops('pat', 'http://localhost/organization'); main.Git.get_repo(root)",
+    "archive": "main.get_archive(main.get_options())",
+    "upload": "main.SharePoint('http://localhost/sites/backups', 'client', 'secret')",
+    "run": "main.AzureDevops('pat', 'http://localhost/organization'); main.Git.get_repo(root); main.get_archive(main.get_options()); main.SharePoint('http://localhost/sites/backups', 'client', 'secret')"
+}
+
+CHILD = """
+import sys, time, json
+root = sys.argv[1]
+from app import main
+{setup}
+print(json.dumps({{"seconds": time.time() - float(sys.argv[2]), "sdks": [name for name in {sdks!r} if name in sys.modules]}}))
+"""
+
+
+def measure(command: str, root: str) -> dict:
+    # Start time is taken in parent, so interpreter startup counts too
+    code = CHILD.format(setup=COMMAND_SETUP[command], sdks=SDKS)
+    time_start = time.time()
+    process = subprocess.run([sys.executable, "-c", code, root, str(time_start)], capture_output=True, text=True, check=True, cwd=root, env={**os.environ, "PYTHONPATH": root})
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure startup time & SDKs loaded by every command")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of measurements of every command, median is reported")
+    parser.add_argument("--max-seconds", type=float, help="Fail when median import of app takes longer")
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    # Warm up, bytecode of app & SDKs is compiled & cached by first run
+    measure("run", root)
+
+    print(f"{'command':<10} {'seconds':>8} sdks")
+    results = dict()
+    for command in COMMAND_SETUP:
+        measurements = [measure(command, root) for _ in range(max(args.repeat, 1))]
+        results[command] = {
+            "seconds": statistics.median(measurement["seconds"] for measurement in measurements),
+            "sdks": measurements[0]["sdks"]
+        }
+        print(f"{command:<10} {results[command]['seconds']:>8.3f} {', '.join(results[command]['sdks']) or '-'}")
+
+    # Importing app must not load any SDK, commands load only SDKs of their stages
+    failures = list()
+    if len(results["import"]["sdks"]) > 0:
+        failures.append(f"importing app loads SDKs: {', '.join(results['import']['sdks'])}")
+    if args.max_seconds is not None and results["import"]["seconds"] > args.max_seconds:
+        failures.append(f"importing app takes {results['import']['seconds']:.3f} s, limit is {args.max_seconds:.3f} s")
+
+    for failure in failures:
+        print(f"regression: {failure}", file=sys.stderr)
+    sys.exit(1 if len(failures) > 0 else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import io
+import os
+import shutil
+import tarfile
+import zipfile
+import threading
+
+import pytest
+
+from app.modules.archive.main import Archive, ArchiveManifest
+
+
+def test__stream__content(tmp_path):
+    """Check if streamed zip contains every file of source dir"""
+
+    (tmp_path / "refs" / "heads").mkdir(parents=True)
+    (tmp_path / "refs" / "heads" / "main").write_text("0" * 40)
+    (tmp_path / "HEAD").write_text("ref: refs/heads/main")
+
+    # Read in chunks bigger than stream buffer to check backpressure
+    stream = Archive().stream(str(tmp_path), 16)
+    data = bytearray()
+    while True:
+        chunk = stream.read(64)
+        if len(chunk) == 0:
+            break
+        data += chunk
+
+    with zipfile.ZipFile(io.BytesIO(bytes(data))) as archive:
+        assert archive.read("HEAD") == b"ref: refs/heads/main"
+        assert archive.read("refs/heads/main") == b"0" * 40
+
+
+def test__stream__fail(tmp_path):
+    """Check if exception raised while producing zip is raised to reader"""
+
+    stream = Archive().stream(str(tmp_path / "missing"), 16)
+
+    # Missing dir produces empty zip, reading after close of reader must not block
+    assert len(stream.read(1024)) > 0
+    stream.close()
+
+    with pytest.raises(Exception):
+        Archive().stream(None, 16).read(1024)
+
+
+def test__write__stores_compressed_content(tmp_path):
+    """Check if git objects are stored as is and rest is deflated with configured level"""
+
+    source = tmp_path / "source"
+    (source / "objects" / "pack").mkdir(parents=True)
+    (source / "objects" / "pack" / "pack-1.pack").write_bytes(b"PACK" * 1024)
+    (source / "config").write_text("[core]\n" * 1024)
+
+    file_path = Archive("zip", 1).write(str(source), str(tmp_path / "archive" / "repo"))
+
+    assert file_path == str(tmp_path / "archive" / "repo.zip")
+    with zipfile.ZipFile(file_path) as archive:
+        assert archive.getinfo("objects/pack/pack-1.pack").compress_type == zipfile.ZIP_STORED
+        assert archive.getinfo("config").compress_type == zipfile.ZIP_DEFLATED
+        assert archive.read("objects/pack/pack-1.pack") == b"PACK" * 1024
+
+
+def test__write__tar_zst(tmp_path):
+    """Check if tar.zst archive contains every file of source dir"""
+
+    zstandard = pytest.importorskip("zstandard")
+
+    source = tmp_path / "source"
+    (source / "refs" / "heads").mkdir(parents=True)
+    (source / "refs" / "heads" / "main").write_text("0" * 40)
+    (source / "HEAD").write_text("ref: refs/heads/main")
+
+    file_path = Archive("tar.zst", 3, 2).write(str(source), str(tmp_path / "repo"))
+
+    assert file_path.endswith(".tar.zst")
+    with open(file_path, "rb") as file:
+        with tarfile.open(fileobj=zstandard.ZstdDecompressor().stream_reader(file), mode="r|") as archive:
+            content = {member.name: archive.extractfile(member).read() for member in archive if member.isfile()}
+
+    assert content == {"HEAD": b"ref: refs/heads/main", "refs/heads/main": b"0" * 40}
+
+
+def test__init__unsupported_format():
+    """Check if unsupported archive format is rejected"""
+
+    with pytest.raises(Exception):
+        Archive("rar")
+
+
+def test__get_digest__ignores_timestamps(tmp_path):
+    """Check if digest of zip depends on content only, not on timestamps or volatile files"""
+
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "HEAD").write_text("ref: refs/heads/main")
+    (source / "FETCH_HEAD").write_text("1")
+
+    first = shutil.make_archive(str(tmp_path / "first"), "zip", str(source))
+
+    os.utime(source / "HEAD", (1000000000, 1000000000))
+    (source / "FETCH_HEAD").write_text("2")
+    second = shutil.make_archive(str(tmp_path / "second"), "zip", str(source))
+
+    assert Archive.get_digest(first) == Archive.get_digest(second)
+
+    (source / "HEAD").write_text("ref: refs/heads/develop")
+    third = shutil.make_archive(str(tmp_path / "third"), "zip", str(source))
+
+    assert Archive.get_digest(first) != Archive.get_digest(third)
+
+
+def test__reserve__waits_for_budget(tmp_path):
+    """Check if archive waits until uploaded archive frees space & archive over budget goes when nothing is staged"""
+
+    (tmp_path / "name_1.zip").write_bytes(b"0" * 60)
+    manifest = ArchiveManifest(str(tmp_path), 100)
+    manifest.add(str(tmp_path / "name_1.zip"))
+
+    reserved = threading.Event()
+    thread = threading.Thread(target=lambda: reserved.set() if manifest.reserve(50) else None)
+    thread.start()
+
+    assert not reserved.wait(0.2)
+
+    manifest.remove(str(tmp_path / "name_1.zip"))
+    assert reserved.wait(5)
+    thread.join()
+
+    assert not (tmp_path / "name_1.zip").exists()
+    assert manifest.used == 50
+
+    manifest.release(50)
+    assert manifest.reserve(500) == 500
+
+
+def test__remove__keeps_rewritten_archive(tmp_path):
+    """Check if archive rewritten while its previous copy is uploaded is kept for its own upload & queued twice is uploaded once"""
+
+    (tmp_path / "name_1.zip").write_bytes(b"left over")
+    (tmp_path / "name_2.zip.tmp").write_bytes(b"partial")
+    manifest = ArchiveManifest(str(tmp_path))
+    assert manifest.restore() == [str(tmp_path / "name_1.zip")]
+    assert not (tmp_path / "name_2.zip.tmp").exists()
+
+    version = manifest.start_upload(str(tmp_path / "name_1.zip"))
+    (tmp_path / "name_1.zip.tmp").write_bytes(b"new")
+    manifest.replace(str(tmp_path / "name_1.zip.tmp"), str(tmp_path / "name_1.zip"))
+
+    assert manifest.remove(str(tmp_path / "name_1.zip"), version) is False
+    assert (tmp_path / "name_1.zip").read_bytes() == b"new"
+
+    version = manifest.start_upload(str(tmp_path / "name_1.zip"))
+    assert manifest.remove(str(tmp_path / "name_1.zip"), version) is True
+    assert not (tmp_path / "name_1.zip").exists()
+    assert manifest.start_upload(str(tmp_path / "name_1.zip")) is None
+
+
+def test__get_digest__tar_zst_ignores_timestamps(tmp_path):
+    """Check if digest of tar.zst depends on content only, not on timestamps or volatile files"""
+
+    pytest.importorskip("zstandard")
+
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "HEAD").write_text("ref: refs/heads/main")
+    (source / "FETCH_HEAD").write_text("1")
+    archive = Archive("tar.zst")
+
+    first = archive.write(str(source), str(tmp_path / "first"))
+
+    os.utime(source / "HEAD", (1000000000, 1000000000))
+    (source / "FETCH_HEAD").write_text("2")
+    second = archive.write(str(source), str(tmp_path / "second"))
+
+    assert Archive.get_digest(first) == Archive.get_digest(second)
+
+    (source / "HEAD").write_text("ref: refs/heads/develop")
+    third = archive.write(str(source), str(tmp_path / "third"))
+
+    assert Archive.get_digest(first) != Archive.get_digest(third)
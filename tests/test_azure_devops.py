@@ -0,0 +1,81 @@
+import mock
+import requests
+
+from app.modules.azure_devops.main import AzureDevops
+from app.modules.http.main import Http
+
+
+def get_repo(repo_id: str, name: str, project_name: str):
+    repo = mock.Mock(id=repo_id, remote_url=f"remote_url_{repo_id}", ssh_url=f"ssh_url_{repo_id}", size=1, default_branch="refs/heads/main")
+    repo.name = name
+    repo.project.name = project_name
+    return repo
+
+
+@mock.patch("azure.devops.connection.Connection")
+def test__list_inventory__batched(connection):
+    """Check if inventory is built from org-wide listings without request per project or wiki"""
+
+    clients = connection.return_value.clients
+    core_client = clients.get_core_client.return_value
+    git_client = clients.get_git_client.return_value
+    wiki_client = clients.get_wiki_client.return_value
+
+    project_1 = mock.Mock()
+    project_1.name = "Project_1"
+    project_2 = mock.Mock()
+    project_2.name = "Project_2"
+    core_client.get_projects.return_value = mock.Mock(value=[project_1, project_2], continuation_token=None)
+
+    git_client.get_repositories.return_value = [
+        get_repo("1", "repo_1", "Project_1"),
+        get_repo("2", "Project_1.wiki", "Project_1"),
+        get_repo("3", "repo_3", "Project_1")
+    ]
+    wiki_client.get_all_wikis.return_value = [
+        mock.Mock(repository_id="2", project_id="p1", type="projectWiki"),
+        mock.Mock(repository_id="3", project_id="p1", type="codeWiki")
+    ]
+
+    inventory = AzureDevops("", "").list_inventory()
+
+    assert [repo['name'] for repo in inventory['Project_1']['repos']] == ["repo_1", "repo_3"]
+    assert [wiki['name'] for wiki in inventory['Project_1']['wikis']] == ["Project_1.wiki", "repo_3"]
+    assert inventory['Project_2'] == {'repos': [], 'wikis': []}
+
+    # Org-wide listings only
+    git_client.get_repositories.assert_called_once_with(include_hidden=True)
+    wiki_client.get_all_wikis.assert_called_once_with()
+    assert git_client.get_repository.call_count == 0
+
+
+@mock.patch("azure.devops.connection.Connection")
+def test__get_client__shared_transport(connection):
+    """Check if sessions of SDK clients are mounted with shared transport"""
+
+    http = Http()
+    core_client = connection.return_value.clients.get_core_client.return_value
+    core_client.get_projects.return_value = mock.Mock(value=[], continuation_token=None)
+
+    AzureDevops("", "", http).list_projects_name()
+
+    session = requests.Session()
+    assert core_client.config.session_configuration_callback(session, None, None, timeout=10) == {"timeout": 10}
+    assert session.get_adapter("https://dev.azure.com") is http.adapter
+
+
+@mock.patch("azure.devops.connection.Connection")
+def test__list_projects_name__list_pages(connection):
+    """Check if projects are paged by skip when SDK returns plain list"""
+
+    core_client = connection.return_value.clients.get_core_client.return_value
+
+    projects = list()
+    for index in range(3):
+        project = mock.Mock()
+        project.name = f"Project_{index}"
+        projects.append(project)
+    core_client.get_projects.side_effect = lambda skip=0: projects[skip:skip + 2]
+
+    assert AzureDevops("", "").list_projects_name() == {"Project_0", "Project_1", "Project_2"}
+    assert core_client.get_projects.call_count == 3
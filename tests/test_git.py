@@ -0,0 +1,191 @@
+import os
+import subprocess
+
+import mock
+import pytest
+
+from app.modules.git.main import Git
+
+
+GIT_ENV = {
+    **os.environ,
+    "GIT_AUTHOR_NAME": "test",
+    "GIT_AUTHOR_EMAIL": "test@example.com",
+    "GIT_COMMITTER_NAME": "test",
+    "GIT_COMMITTER_EMAIL": "test@example.com"
+}
+
+
+def commit(path: str, message: str) -> None:
+    subprocess.run(["git", "commit", "--allow-empty", "-q", "-m", message], cwd=path, env=GIT_ENV, check=True)
+
+
+@pytest.fixture
+def remote(tmp_path):
+    """Local repo with single commit, used as remote for mirror"""
+
+    path = str(tmp_path / "remote")
+    subprocess.run(["git", "init", "-q", "-b", "main", path], check=True)
+    commit(path, "initial")
+
+    return path
+
+
+def test__sync__clone_and_update(remote, tmp_path):
+    """Check if mirror is cloned & later updates are detected"""
+
+    git = Git("", "")
+    path = str(tmp_path / "mirror")
+
+    assert git.sync(remote, path) is True
+    assert git.sync(remote, path) is False
+
+    commit(remote, "second")
+    assert git.sync(remote, path) is True
+    assert git.list_refs(path) == git.list_refs(remote)
+
+
+def test__bundle__incremental(remote, tmp_path):
+    """Check if incremental bundle requires previous tips & contains only new objects"""
+
+    git = Git("", "")
+    path = str(tmp_path / "mirror")
+    git.sync(remote, path)
+
+    refs_full = git.list_refs(path)
+    assert git.bundle(path, str(tmp_path / "full.bundle")) is True
+
+    # No new objects since previous tips
+    assert git.bundle(path, str(tmp_path / "empty.bundle"), list(refs_full.values())) is False
+
+    commit(remote, "second")
+    git.sync(remote, path)
+    assert git.bundle(path, str(tmp_path / "incremental.bundle"), list(refs_full.values()) + ["0" * 40]) is True
+
+    heads = subprocess.run(["git", "bundle", "list-heads", str(tmp_path / "incremental.bundle")], capture_output=True, text=True, check=True).stdout
+    assert git.list_refs(path)["refs/heads/main"] in heads
+
+    # Incremental bundle applies on top of full bundle only
+    restore = str(tmp_path / "restore")
+    subprocess.run(["git", "clone", "-q", "--mirror", str(tmp_path / "full.bundle"), restore], check=True)
+    subprocess.run(["git", "fetch", "-q", str(tmp_path / "incremental.bundle"), "refs/heads/*:refs/heads/*"], cwd=restore, check=True)
+    assert git.list_refs(restore)["refs/heads/main"] == git.list_refs(path)["refs/heads/main"]
+
+
+def test__bundle__incremental_force_push(remote, tmp_path):
+    """Check if incremental bundle taken after force-push restores on top of full bundle"""
+
+    git = Git("", "")
+    path = str(tmp_path / "mirror")
+    commit(remote, "second")
+    git.sync(remote, path)
+
+    refs_full = git.list_refs(path)
+    assert git.bundle(path, str(tmp_path / "full.bundle")) is True
+
+    # History of main is rewritten
+    subprocess.run(["git", "reset", "-q", "--hard", "HEAD~1"], cwd=remote, check=True)
+    commit(remote, "rewritten")
+    git.sync(remote, path)
+    assert git.bundle(path, str(tmp_path / "incremental.bundle"), list(refs_full.values())) is True
+
+    restore = str(tmp_path / "restore")
+    subprocess.run(["git", "clone", "-q", "--mirror", str(tmp_path / "full.bundle"), restore], check=True)
+    subprocess.run(["git", "fetch", "-q", str(tmp_path / "incremental.bundle"), "+refs/*:refs/*"], cwd=restore, check=True)
+    assert git.list_refs(restore)["refs/heads/main"] == git.list_refs(path)["refs/heads/main"]
+
+
+def test__sync__skip_fetch_when_refs_match(remote, tmp_path):
+    """Check if fetch is skipped when refs of remote match refs recorded by last fetch"""
+
+    git = Git("", "")
+    path = str(tmp_path / "mirror")
+    git.sync(remote, path)
+
+    # First update fetches & records refs of remote
+    assert git.sync(remote, path) is False
+    assert os.path.isfile(os.path.join(path, Git.REMOTE_REFS_FILE))
+
+    with mock.patch("git.remote.Remote.fetch") as remote_fetch:
+        assert git.sync(remote, path) is False
+        assert remote_fetch.call_count == 0
+
+    commit(remote, "second")
+    assert git.sync(remote, path) is True
+
+
+def test__sync__fetch_lfs_once_per_refs(remote, tmp_path):
+    """Check if LFS objects are fetched once per refs of mirror & failed fetch keeps mirror changed"""
+
+    git = Git("", "", str(tmp_path / "lfs"), 4)
+    path = str(tmp_path / "mirror")
+
+    with mock.patch("app.modules.git.main.Git.fetch_lfs") as fetch_lfs:
+        assert git.sync(remote, path) is True
+        fetch_lfs.assert_called_once_with(path, str(tmp_path / "lfs"), 4)
+
+        assert git.sync(remote, path) is False
+        assert fetch_lfs.call_count == 1
+
+        # Refs are fetched, objects aren't
+        commit(remote, "second")
+        fetch_lfs.side_effect = Exception("git lfs fetch failed")
+        with pytest.raises(Exception):
+            git.sync(remote, path)
+
+        fetch_lfs.side_effect = None
+        assert git.sync(remote, path) is True
+        assert git.sync(remote, path) is False
+        assert fetch_lfs.call_count == 3
+
+
+def test__fetch_lfs__auth_header_once(remote, tmp_path):
+    """Check if auth header kept in mirror config since clone isn't passed again & is passed to mirror without it"""
+
+    git = Git("user", "password")
+    path = str(tmp_path / "mirror")
+    git.sync(remote, path)
+    run = subprocess.run
+    commands = list()
+
+    def run_lfs(args, **kwargs):
+        if "lfs" not in args:
+            return run(args, **kwargs)
+        commands.append(args)
+        return subprocess.CompletedProcess(args, 0, "", "")
+
+    with mock.patch("app.modules.git.main.subprocess.run", side_effect=run_lfs):
+        git.fetch_lfs(path, str(tmp_path / "lfs"))
+        assert not any(arg.startswith("http.extraHeader=") for arg in commands[-1])
+
+        subprocess.run(["git", "config", "--unset-all", "http.extraHeader"], cwd=path, check=True)
+        git.fetch_lfs(path, str(tmp_path / "lfs"))
+        assert [arg for arg in commands[-1] if arg.startswith("http.extraHeader=")] == [f"http.extraHeader={git.auth_header}"]
+
+
+def test__maintain__repacks_mirror(remote, tmp_path):
+    """Check if maintenance packs loose objects & small packs into single pack with graphs"""
+
+    git = Git("", "")
+    path = str(tmp_path / "mirror")
+    git.sync(remote, path)
+
+    # Every fetch of few objects leaves loose objects in mirror
+    for index in range(3):
+        commit(remote, f"commit {index}")
+        git.sync(remote, path)
+    subprocess.run(["git", "repack", "-q"], cwd=path, check=True)
+    commit(remote, "loose")
+    git.sync(remote, path)
+
+    before = git.count_objects(path)
+    assert before['count'] > 0
+
+    git.maintain(path, 2)
+
+    after = git.count_objects(path)
+    assert after['count'] == 0
+    assert after['packs'] == 1
+    assert os.path.isfile(os.path.join(path, "objects", "info", "commit-graph"))
+    assert os.path.isfile(os.path.join(path, "objects", "pack", "multi-pack-index"))
+    assert git.list_refs(path) == git.list_refs(remote)
@@ -0,0 +1,101 @@
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.modules.http.main import Http, RateLimiter, RetryAdapter
+
+
+@pytest.fixture
+def server():
+    """Local server answering queued (status, headers) responses, last one repeats"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def respond(self) -> None:
+            server.requests.append((self.command, self.path))
+            status, headers = server.responses[min(len(server.requests), len(server.responses)) - 1]
+            self.send_response(status)
+            for name, value in {**headers, "Content-Length": "0"}.items():
+                self.send_header(name, value)
+            self.end_headers()
+
+        do_GET = respond
+        do_POST = respond
+
+        def log_message(self, *args) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.requests = list()
+    server.responses = [(200, {})]
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    yield server
+
+    server.shutdown()
+
+
+def test__send__retry_after(server):
+    """Check if throttled request is retried after delay requested by server"""
+
+    server.responses = [(429, {"Retry-After": "1"}), (200, {})]
+
+    time_start = time.monotonic()
+    response = Http(retries=3, backoff_base=0).session().get(f"{server.url}/projects")
+
+    assert response.status_code == 200
+    assert len(server.requests) == 2
+    assert time.monotonic() - time_start >= 1
+
+
+def test__send__retries_exhausted(server):
+    """Check if last response is returned when every retry failed"""
+
+    server.responses = [(503, {})]
+
+    response = Http(retries=2, backoff_base=0).session().get(f"{server.url}/projects")
+
+    assert response.status_code == 503
+    assert len(server.requests) == 3
+
+
+def test__send__post_not_retried_on_server_error(server):
+    """Check if non-idempotent request is retried only when it was throttled"""
+
+    session = Http(retries=2, backoff_base=0).session()
+
+    server.responses = [(500, {}), (200, {})]
+    assert session.post(f"{server.url}/upload").status_code == 500
+    assert len(server.requests) == 1
+
+    server.requests.clear()
+    server.responses = [(429, {"Retry-After": "0"}), (200, {})]
+    assert session.post(f"{server.url}/upload").status_code == 200
+    assert len(server.requests) == 2
+
+
+def test__get_backoff__jitter():
+    """Check if backoff grows exponentially with jitter & is capped"""
+
+    adapter = RetryAdapter(1, 5, 1, 10, RateLimiter())
+
+    for attempt in range(10):
+        assert 0 <= adapter.get_backoff(attempt) <= min(10, 2 ** attempt)
+
+
+def test__acquire__rate_and_pause():
+    """Check if rate limiter spaces requests & pause holds back every request"""
+
+    limiter = RateLimiter(20)
+
+    time_start = time.monotonic()
+    for _ in range(5):
+        limiter.acquire()
+    assert time.monotonic() - time_start >= 0.2
+
+    limiter.pause(0.3)
+    time_start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - time_start >= 0.25
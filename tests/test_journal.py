@@ -0,0 +1,71 @@
+import json
+
+from app.modules.journal.main import Journal
+
+
+def test__open__pending_items_survive_crash(tmp_path):
+    """Check if items which didn't get uploaded are pending after crash & done items are compacted away"""
+
+    (tmp_path / "archive").mkdir()
+    (tmp_path / "archive" / "name_3.zip").write_bytes(b"archive")
+
+    journal = Journal().open(str(tmp_path / "state"))
+    journal.record("Project_1/git/name_1", Journal.FETCHING)
+    journal.record("Project_1/git/name_2", Journal.FETCHING)
+    journal.record("Project_1/git/name_2", Journal.UNCHANGED)
+    journal.record("Project_1/git/name_3", Journal.FETCHED)
+    journal.record_archived("Project_1/git/name_3", [str(tmp_path / "archive" / "name_3.zip")])
+    journal.record_archived("Project_1/git/name_4", [str(tmp_path / "archive" / "name_4.zip")])
+
+    # Crash leaves torn line at the end of journal
+    with open(journal.file_path, "a") as file:
+        file.write('{"item": "Project_1/git/na')
+
+    resumed = Journal().open(str(tmp_path / "state"))
+
+    assert resumed.get_pending(Journal.FETCHING, Journal.FETCHED) == {"Project_1/git/name_1", "Project_1/git/name_4"}
+    assert resumed.get_pending(Journal.ARCHIVED) == {"Project_1/git/name_3"}
+    with open(resumed.file_path) as file:
+        assert len(file.readlines()) == 3
+
+
+def test__record_uploaded_file__item_done_after_last_archive(tmp_path):
+    """Check if item is done only when every archive is uploaded, unchanged mirror keeps item with staged archive pending"""
+
+    journal = Journal().open(str(tmp_path / "state"))
+    journal.record_archived("Project_1/git/name_1", ["archive/name_1.bundle", "archive/manifest.json"])
+
+    journal.record("Project_1/git/name_1", Journal.FETCHING)
+    journal.record("Project_1/git/name_1", Journal.UNCHANGED)
+    assert journal.get_pending(Journal.ARCHIVED) == {"Project_1/git/name_1"}
+
+    journal.record_uploaded_file("archive/name_1.bundle")
+    assert journal.get_pending() == {"Project_1/git/name_1"}
+
+    journal.record_uploaded_file("archive/manifest.json")
+    assert journal.get_pending() == set()
+
+    journal.close()
+    assert Journal.load(journal.file_path) == dict()
+
+
+def test__record__disabled():
+    """Check if nothing is recorded when journal isn't opened"""
+
+    journal = Journal()
+    journal.record("Project_1/git/name_1", Journal.FETCHING)
+
+    assert journal.get_pending() == set()
+
+
+def test__record__skip_items_never_pending(tmp_path):
+    """Check if item which was never pending is done without any entry written"""
+
+    journal = Journal().open(str(tmp_path / "state"))
+    journal.record("Project_1/git/name_1", Journal.UNCHANGED)
+    journal.record("Project_1/git/name_2", Journal.FETCHING)
+    journal.record("Project_1/git/name_2", Journal.UNCHANGED)
+
+    with open(journal.file_path) as file:
+        assert [json.loads(line)['item'] for line in file] == ["Project_1/git/name_2", "Project_1/git/name_2"]
+    assert journal.get_pending() == set()
@@ -1,4 +1,9 @@
 import os
+import sys
+import json
+import zipfile
+import threading
+import subprocess
 
 import pytest
 import mock
@@ -6,11 +11,12 @@ import mock
 from app import main as app
 
 
+@mock.patch("app.main.get_inventory")
 @mock.patch("app.main.upload_changes_to_sharepoint")
 @mock.patch("app.main.archive_changes")
 @mock.patch("app.main.sync_data")
 @mock.patch("app.main.get_env_vars")
-def test__main__success(get_env_vars, sync_data, archive_changes, upload_changes_to_sharepoint):
+def test__main__success(get_env_vars, sync_data, archive_changes, upload_changes_to_sharepoint, get_inventory):
     """Check Main to complete with exit code 0 (success)"""
 
     get_env_vars.return_value = ("", "", "", "", "", "", "", "")
@@ -31,7 +37,8 @@ def test__main__success(get_env_vars, sync_data, archive_changes, upload_changes
 @mock.patch("app.main.sync_data")
 @mock.patch("app.main.archive_changes")
 @mock.patch("app.main.upload_changes_to_sharepoint")
-def test__main__fail(upload_changes_to_sharepoint, archive_changes, sync_data, get_env_vars):
+@mock.patch("app.main.get_inventory")
+def test__main__fail(get_inventory, upload_changes_to_sharepoint, archive_changes, sync_data, get_env_vars):
     """Check Main to complete with exit code 1 (fail)"""
 
     get_env_vars.return_value = ("", "", "", "", "", "", "", "")
@@ -81,29 +88,27 @@ def test__get_env_vars__fail():
         app.get_env_vars()
 
 
-@mock.patch("app.main.AzureDevops.list_projects_name")
+@mock.patch("app.main.AzureDevops.list_inventory")
 @mock.patch("app.main.AzureDevops.__init__", return_value=None)
 @mock.patch("app.main.Git.__init__", return_value=None)
-def test__sync_data__no_projects(git_init, devops_init, devops_list_projects_name):
+def test__sync_data__no_projects(git_init, devops_init, devops_list_inventory):
     """Check if no changes are detected when no projects are found"""
 
-    devops_list_projects_name.return_value = set()
+    devops_list_inventory.return_value = dict()
 
     # Assert that no changes are found
     assert app.sync_data("", "", "") == set()
 
 
-@mock.patch("app.main.AzureDevops.list_project_wikis")
-@mock.patch("app.main.AzureDevops.list_project_repos")
-@mock.patch("app.main.AzureDevops.list_projects_name")
+@mock.patch("app.main.AzureDevops.list_inventory")
 @mock.patch("app.main.AzureDevops.__init__", return_value=None)
 @mock.patch("app.main.Git.sync")
 @mock.patch("app.main.Git.__init__", return_value=None)
-def test__sync_data__no_changes(git_init, git_sync, devops_init, devops_list_projects_name, devops_list_project_repos, devops_list_project_wikis):
+def test__sync_data__no_changes(git_init, git_sync, devops_init, devops_list_inventory):
     """Check if no changes are returned when aren't detected"""
 
-    devops_list_projects_name.return_value = ('Project_1', 'Project_2')
-    devops_list_project_repos.return_value = [{
+    projects_name = ('Project_1', 'Project_2')
+    repos = [{
         'name': "name_1",
         'remote_url': "remote_url_1",
         'ssh_url': "ssh_url_1"
@@ -112,7 +117,7 @@ def test__sync_data__no_changes(git_init, git_sync, devops_init, devops_list_pro
         'remote_url': "remote_url_2",
         'ssh_url': "ssh_url_2"
     }]
-    devops_list_project_wikis.return_value = [{
+    wikis = [{
         'name': "name_1",
         'remote_url': "remote_url_1",
         'ssh_url': "ssh_url_1"
@@ -121,23 +126,22 @@ def test__sync_data__no_changes(git_init, git_sync, devops_init, devops_list_pro
         'remote_url': "remote_url_2",
         'ssh_url': "ssh_url_2"
     }]
+    devops_list_inventory.return_value = {project_name: {'repos': repos, 'wikis': wikis} for project_name in projects_name}
     git_sync.return_value = False
 
     # Assert that no changes are found
     assert app.sync_data("", "", "") == set()
 
 
-@mock.patch("app.main.AzureDevops.list_project_wikis")
-@mock.patch("app.main.AzureDevops.list_project_repos")
-@mock.patch("app.main.AzureDevops.list_projects_name")
+@mock.patch("app.main.AzureDevops.list_inventory")
 @mock.patch("app.main.AzureDevops.__init__", return_value=None)
 @mock.patch("app.main.Git.sync")
 @mock.patch("app.main.Git.__init__", return_value=None)
-def test__sync_data__has_changes(git_init, git_sync, devops_init, devops_list_projects_name, devops_list_project_repos, devops_list_project_wikis):
+def test__sync_data__has_changes(git_init, git_sync, devops_init, devops_list_inventory):
     """Check if changes are returned when they are detected"""
 
-    devops_list_projects_name.return_value = ('Project_1', 'Project_2')
-    devops_list_project_repos.return_value = [{
+    projects_name = ('Project_1', 'Project_2')
+    repos = [{
         'name': "name_1",
         'remote_url': "remote_url_1",
         'ssh_url': "ssh_url_1"
@@ -146,7 +150,7 @@ def test__sync_data__has_changes(git_init, git_sync, devops_init, devops_list_pr
         'remote_url': "remote_url_2",
         'ssh_url': "ssh_url_2"
     }]
-    devops_list_project_wikis.return_value = [{
+    wikis = [{
         'name': "name_1",
         'remote_url': "remote_url_1",
         'ssh_url': "ssh_url_1"
@@ -155,6 +159,7 @@ def test__sync_data__has_changes(git_init, git_sync, devops_init, devops_list_pr
         'remote_url': "remote_url_2",
         'ssh_url': "ssh_url_2"
     }]
+    devops_list_inventory.return_value = {project_name: {'repos': repos, 'wikis': wikis} for project_name in projects_name}
     git_sync.return_value = True
 
     # Assert that changes are found
@@ -162,17 +167,15 @@ def test__sync_data__has_changes(git_init, git_sync, devops_init, devops_list_pr
     assert len(app.sync_data("", "", "")) == 8
 
 
-@mock.patch("app.main.AzureDevops.list_project_wikis")
-@mock.patch("app.main.AzureDevops.list_project_repos")
-@mock.patch("app.main.AzureDevops.list_projects_name")
+@mock.patch("app.main.AzureDevops.list_inventory")
 @mock.patch("app.main.AzureDevops.__init__", return_value=None)
 @mock.patch("app.main.Git.sync")
 @mock.patch("app.main.Git.__init__", return_value=None)
-def test__sync_data__fail(git_init, git_sync, devops_init, devops_list_projects_name, devops_list_project_repos, devops_list_project_wikis):
+def test__sync_data__fail(git_init, git_sync, devops_init, devops_list_inventory):
     """Check if exit code has changed and no changes are detected (because of fail during sync)"""
 
-    devops_list_projects_name.return_value = ('Project_1', 'Project_2')
-    devops_list_project_repos.return_value = [{
+    projects_name = ('Project_1', 'Project_2')
+    repos = [{
         'name': "name_1",
         'remote_url': "remote_url_1",
         'ssh_url': "ssh_url_1"
@@ -181,7 +184,7 @@ def test__sync_data__fail(git_init, git_sync, devops_init, devops_list_projects_
         'remote_url': "remote_url_2",
         'ssh_url': "ssh_url_2"
     }]
-    devops_list_project_wikis.return_value = [{
+    wikis = [{
         'name': "name_1",
         'remote_url': "remote_url_1",
         'ssh_url': "ssh_url_1"
@@ -190,6 +193,7 @@ def test__sync_data__fail(git_init, git_sync, devops_init, devops_list_projects_
         'remote_url': "remote_url_2",
         'ssh_url': "ssh_url_2"
     }]
+    devops_list_inventory.return_value = {project_name: {'repos': repos, 'wikis': wikis} for project_name in projects_name}
     git_sync.return_value = True
     git_sync.side_effect = Exception()
 
@@ -201,7 +205,7 @@ def test__sync_data__fail(git_init, git_sync, devops_init, devops_list_projects_
 
 
 @mock.patch("app.main.clean_archive_path")
-@mock.patch("shutil.make_archive")
+@mock.patch("app.main.Archive.write")
 def test__archive_changes__no_changes(make_archive, clean_archive_path):
     """Check if archive path is purged and for each change, archive is made"""
 
@@ -212,7 +216,7 @@ def test__archive_changes__no_changes(make_archive, clean_archive_path):
     assert make_archive.call_count == len(changes)
 
 
-@mock.patch("shutil.make_archive")
+@mock.patch("app.main.Archive.write")
 def test__archive_changes__has_changes(make_archive):
     """Check if nothing happen because no changes"""
 
@@ -222,41 +226,628 @@ def test__archive_changes__has_changes(make_archive):
     assert make_archive.call_count == len(changes)
 
 
+def test__archive_changes__workers(tmp_path):
+    """Check if every change is archived in configured format when archived on multiple workers"""
+
+    for change in ("Project_1/git/name_1", "Project_1/git/name_2"):
+        (tmp_path / "clone" / change / "objects" / "pack").mkdir(parents=True)
+        (tmp_path / "clone" / change / "objects" / "pack" / "pack-1.pack").write_bytes(b"PACK" * 1024)
+        (tmp_path / "clone" / change / "HEAD").write_text("ref: refs/heads/main")
+
+    changes = {"Project_1/git/name_1", "Project_1/git/name_2"}
+    app.archive_changes(str(tmp_path / "clone"), str(tmp_path / "archive"), changes, None, 7, app.Archive("zip", 9), 2)
+
+    for change in changes:
+        with zipfile.ZipFile(tmp_path / "archive" / f"{change}.zip") as archive:
+            assert archive.getinfo("objects/pack/pack-1.pack").compress_type == zipfile.ZIP_STORED
+            assert archive.getinfo("HEAD").compress_type == zipfile.ZIP_DEFLATED
+
+
+def test__write_change__metrics_archive_uploaded_at_once(tmp_path):
+    """Check if size of archive is measured even when uploader deletes archive as soon as it is published"""
+
+    (tmp_path / "clone" / "Project_1/git/name_1").mkdir(parents=True)
+    (tmp_path / "clone" / "Project_1/git/name_1" / "HEAD").write_text("ref: refs/heads/main")
+
+    def replace_and_upload(src: str, dst: str) -> None:
+        os.replace(src, dst)
+        os.remove(dst)
+
+    metrics = app.Metrics()
+    metrics.enabled = True
+    with mock.patch("app.main.metrics", metrics):
+        app.write_change(str(tmp_path / "clone"), str(tmp_path / "archive"), "Project_1/git/name_1", archive=app.Archive("zip"), replace=replace_and_upload)
+
+    assert metrics.items[0]['bytes'] > 0
+
+
 @mock.patch("app.main.clean_archive_path")
-@mock.patch("app.main.get_archive_paths")
 @mock.patch("app.main.SharePoint.upload_file")
-@mock.patch("app.main.SharePoint.ensure_dir_exists")
+@mock.patch("app.main.SharePoint.ensure_dirs_exist")
 @mock.patch("app.main.SharePoint.__init__", return_value=None)
-def test__upload_changes_to_sharepoint__no_archives(sharepoint_init, sharepoint_ensure_dir_exists, sharepoint_upload_file, get_archive_paths, clean_archive_path):
+def test__upload_changes_to_sharepoint__no_archives(sharepoint_init, sharepoint_ensure_dirs_exist, sharepoint_upload_file, clean_archive_path):
     """Check if no archive being uploaded to sharepoint"""
 
-    get_archive_paths.return_value = {
-        "dir_paths": set(),
-        "file_paths": set()
-    }
-
-    app.upload_changes_to_sharepoint("", "", "", "", "")
+    app.upload_changes_to_sharepoint("", "", "", "archive", "", manifest=app.ArchiveManifest("archive"))
 
-    assert sharepoint_ensure_dir_exists.call_count == 0
+    assert sharepoint_ensure_dirs_exist.call_count == 0
     assert sharepoint_upload_file.call_count == 0
     assert clean_archive_path.call_count == 1
 
 
 @mock.patch("app.main.clean_archive_path")
-@mock.patch("app.main.get_archive_paths")
 @mock.patch("app.main.SharePoint.upload_file")
-@mock.patch("app.main.SharePoint.ensure_dir_exists")
+@mock.patch("app.main.SharePoint.ensure_dirs_exist")
+@mock.patch("app.main.SharePoint.__init__", return_value=None)
+def test__upload_changes_to_sharepoint__has_archives(sharepoint_init, sharepoint_ensure_dirs_exist, sharepoint_upload_file, clean_archive_path, tmp_path):
+    """Check if every archive being uploaded to sharepoint & removed as soon as it is uploaded"""
+
+    path_archive = str(tmp_path / "archive")
+    manifest = app.ArchiveManifest(path_archive)
+    for file_path in ("dir_path_1/file_path_1", "dir_path_1/file_path_2", "dir_path_2/file_path_3", "dir_path_2/file_path_4", "dir_path_2/file_path_5"):
+        (tmp_path / "archive" / file_path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / "archive" / file_path).write_bytes(b"archive")
+        manifest.add(f"{path_archive}/{file_path}")
+    sharepoint_upload_file.return_value = {"size": 1, "seconds": 1, "throughput": 1}
+
+    app.upload_changes_to_sharepoint("", "", "", path_archive, "", manifest=manifest)
+
+    # All dirs are created in single batch
+    assert sharepoint_ensure_dirs_exist.call_count == 1
+    assert sharepoint_ensure_dirs_exist.call_args[0][1] == ["dir_path_1", "dir_path_2"]
+    assert sharepoint_upload_file.call_count == 5
+    assert clean_archive_path.call_count == 1
+    assert manifest.file_paths == []
+    assert list((tmp_path / "archive").rglob("file_path_*")) == []
+
+
+@mock.patch("app.main.SharePoint.upload_file")
+@mock.patch("app.main.SharePoint.ensure_dirs_exist")
 @mock.patch("app.main.SharePoint.__init__", return_value=None)
-def test__upload_changes_to_sharepoint__has_archives(sharepoint_init, sharepoint_ensure_dir_exists, sharepoint_upload_file, get_archive_paths, clean_archive_path):
-    """Check if every archive being uploaded to sharepoint"""
+def test__upload_lfs_to_sharepoint__new_objects_only(sharepoint_init, sharepoint_ensure_dirs_exist, sharepoint_upload_file, tmp_path):
+    """Check if only LFS objects not uploaded by earlier runs are uploaded, in layout of LFS storage"""
 
-    get_archive_paths.return_value = {
-        "dir_paths": ("dir_path_1", "dir_path_2"),
-        "file_paths": ("file_path_1", "file_path_2", "file_path_3", "file_path_4", "file_path_5")
+    def add_object(oid: str) -> None:
+        (tmp_path / "lfs" / "objects" / oid[0:2] / oid[2:4]).mkdir(parents=True, exist_ok=True)
+        (tmp_path / "lfs" / "objects" / oid[0:2] / oid[2:4] / oid).write_bytes(b"object")
+
+    path_lfs = str(tmp_path / "lfs")
+    path_state = str(tmp_path / "state")
+    add_object("a" * 64)
+    add_object("b" * 64)
+    (tmp_path / "lfs" / "tmp").mkdir()
+    (tmp_path / "lfs" / "tmp" / ("c" * 64)).write_bytes(b"partial")
+    sharepoint_upload_file.return_value = {"size": 1, "seconds": 1, "throughput": 1}
+
+    app.upload_lfs_to_sharepoint("", "", "", path_lfs, "dir", path_state)
+    assert sharepoint_upload_file.call_count == 2
+    assert sorted(call[0][1] for call in sharepoint_upload_file.call_args_list) == ["lfs/objects/aa/aa", "lfs/objects/bb/bb"]
+
+    # Nothing new, SharePoint isn't touched
+    app.upload_lfs_to_sharepoint("", "", "", path_lfs, "dir", path_state)
+    assert sharepoint_init.call_count == 1
+
+    add_object("d" * 64)
+    app.upload_lfs_to_sharepoint("", "", "", path_lfs, "dir", path_state)
+    assert sharepoint_upload_file.call_count == 3
+    assert sharepoint_upload_file.call_args[0][2] == str(tmp_path / "lfs" / "objects" / "dd" / "dd" / ("d" * 64))
+
+
+@mock.patch("app.main.AzureDevops.list_inventory")
+@mock.patch("app.main.AzureDevops.__init__", return_value=None)
+@mock.patch("app.main.Git.sync")
+@mock.patch("app.main.Git.__init__", return_value=None)
+def test__sync_data__has_changes_concurrent(git_init, git_sync, devops_init, devops_list_inventory):
+    """Check if concurrent sync returns same changes as sequential sync"""
+
+    projects_name = ('Project_1', 'Project_2')
+    repos = [{
+        'name': "name_1",
+        'remote_url': "remote_url_1",
+        'ssh_url': "ssh_url_1"
+    }, {
+        'name': "name_2",
+        'remote_url': "remote_url_2",
+        'ssh_url': "ssh_url_2"
+    }]
+    wikis = [{
+        'name': "name_1",
+        'remote_url': "remote_url_1",
+        'ssh_url': "ssh_url_1"
+    }]
+    devops_list_inventory.return_value = {project_name: {'repos': repos, 'wikis': wikis} for project_name in projects_name}
+    git_sync.side_effect = lambda remote, path: remote != "remote_url_2"
+
+    # Assert that only changed repos & wikis are found
+    assert app.sync_data("", "", "clone", sync_workers=4) == {
+        "Project_1/git/name_1",
+        "Project_1/wiki/name_1",
+        "Project_2/git/name_1",
+        "Project_2/wiki/name_1"
     }
+    assert git_sync.call_count == 6
 
-    app.upload_changes_to_sharepoint("", "", "", "", "")
 
-    assert sharepoint_ensure_dir_exists.call_count == 2
-    assert sharepoint_upload_file.call_count == 5
+def test__get_env_var_int__default():
+    """Check if default value is returned when ENV Variable is missing"""
+
+    if 'SYNC_WORKERS' in os.environ:
+        del os.environ['SYNC_WORKERS']
+
+    assert app.get_env_var_int('SYNC_WORKERS', 1) == 1
+
+
+def test__get_env_var_int__fail():
+    """Check if Exception is raised when ENV Variable is not integer"""
+
+    os.environ['SYNC_WORKERS'] = "many"
+
+    with pytest.raises(Exception):
+        app.get_env_var_int('SYNC_WORKERS', 1)
+
+    del os.environ['SYNC_WORKERS']
+
+
+def archive_change_tracked(path_clone, path_archive, change, path_state, full_interval_days, archive, manifest):
+    """Fake archive_change, archive is tracked by manifest like written one"""
+
+    manifest.add(f"{path_archive}/{change}.zip", 1)
+    return [f"{path_archive}/{change}.zip"]
+
+
+@mock.patch("app.main.get_inventory")
+@mock.patch("app.main.clean_archive_path")
+@mock.patch("app.main.archive_change")
+@mock.patch("app.main.sync_data")
+@mock.patch("app.main.SharePoint.upload_file")
+@mock.patch("app.main.SharePoint.ensure_dirs_exist")
+@mock.patch("app.main.SharePoint.__init__", return_value=None)
+def test__run_pipeline__has_changes(sharepoint_init, sharepoint_ensure_dirs_exist, sharepoint_upload_file, sync_data, archive_change, clean_archive_path, get_inventory, tmp_path):
+    """Check if every change flows through archive & upload stage"""
+
+    def sync(devops_pat, devops_org_url, path_clone, on_change=None, **settings):
+        changes = {"Project_1/git/name_1", "Project_1/git/name_2", "Project_2/wiki/name_1"}
+        for change in changes:
+            on_change(change)
+        return changes
+
+    sync_data.side_effect = sync
+    archive_change.side_effect = archive_change_tracked
+    (tmp_path / "archive" / "Project_3" / "git").mkdir(parents=True)
+    (tmp_path / "archive" / "Project_3" / "git" / "name_1.zip").write_bytes(b"left over")
+    sharepoint_upload_file.return_value = {"size": 1, "seconds": 1, "throughput": 1}
+
+    app.run_pipeline("", "", "clone", str(tmp_path / "archive"), "", "", "", "", {**app.get_options(), "pipeline_queue_size": 1})
+
+    assert archive_change.call_count == 3
+    assert sharepoint_upload_file.call_count == 4
+    assert sharepoint_ensure_dirs_exist.call_count == 3
     assert clean_archive_path.call_count == 1
+
+
+@mock.patch("app.main.get_inventory")
+@mock.patch("app.main.clean_archive_path")
+@mock.patch("app.main.archive_change")
+@mock.patch("app.main.sync_data")
+@mock.patch("app.main.SharePoint.upload_file")
+@mock.patch("app.main.SharePoint.ensure_dirs_exist")
+@mock.patch("app.main.SharePoint.__init__", return_value=None)
+def test__run_pipeline__upload_fail(sharepoint_init, sharepoint_ensure_dirs_exist, sharepoint_upload_file, sync_data, archive_change, clean_archive_path, get_inventory, tmp_path):
+    """Check if archives are kept & exit code is set when upload fails"""
+
+    def sync(devops_pat, devops_org_url, path_clone, on_change=None, **settings):
+        on_change("Project_1/git/name_1")
+        return {"Project_1/git/name_1"}
+
+    sync_data.side_effect = sync
+    archive_change.side_effect = archive_change_tracked
+    sharepoint_upload_file.side_effect = Exception()
+
+    app.set_exit_code(0)
+    app.run_pipeline("", "", "clone", str(tmp_path / "archive"), "", "", "", "", {**app.get_options(), "pipeline_queue_size": 1})
+
+    assert sharepoint_upload_file.call_count == 1
+    assert clean_archive_path.call_count == 0
+    assert app.get_exit_code() > 0
+
+
+@mock.patch("app.main.get_inventory")
+@mock.patch("app.main.write_change")
+@mock.patch("app.main.sync_data")
+@mock.patch("app.main.SharePoint.upload_file")
+@mock.patch("app.main.SharePoint.ensure_dirs_exist")
+@mock.patch("app.main.SharePoint.__init__", return_value=None)
+def test__run_pipeline__left_over_rewritten(sharepoint_init, sharepoint_ensure_dirs_exist, sharepoint_upload_file, sync_data, write_change, get_inventory, tmp_path):
+    """Check if archive of same repo left over by previous run & rewritten while it is uploaded is uploaded after it & not deleted"""
+
+    path_archive = str(tmp_path / "archive")
+    file_path = f"{path_archive}/Project_1/git/name_1.zip"
+    (tmp_path / "archive" / "Project_1" / "git").mkdir(parents=True)
+    (tmp_path / "archive" / "Project_1" / "git" / "name_1.zip").write_bytes(b"left over")
+    upload_started = threading.Event()
+    written = threading.Event()
+    uploaded = list()
+
+    def sync(devops_pat, devops_org_url, path_clone, on_change=None, **settings):
+        on_change("Project_1/git/name_1")
+        return {"Project_1/git/name_1"}
+
+    def write(path_clone, path_archive, change, path_state, full_interval_days, archive, replace):
+        # Archive of same repo is written while left over copy is uploaded
+        upload_started.wait(5)
+        with open(f"{file_path}.tmp", "wb") as file:
+            file.write(b"new")
+        replace(f"{file_path}.tmp", file_path)
+        written.set()
+        return [file_path]
+
+    def upload_file(root_dir, target_dir, upload_path, on_progress):
+        with open(upload_path, "rb") as file:
+            uploaded.append(file.read())
+        upload_started.set()
+        written.wait(5)
+        return {"size": 1, "seconds": 1, "throughput": 1}
+
+    sync_data.side_effect = sync
+    write_change.side_effect = write
+    sharepoint_upload_file.side_effect = upload_file
+
+    app.set_exit_code(0)
+    app.run_pipeline("", "", "clone", path_archive, "", "", "", "", {**app.get_options(), "pipeline_queue_size": 1, "upload_workers": 2})
+
+    assert uploaded == [b"left over", b"new"]
+    assert app.get_exit_code() == 0
+    assert not os.path.exists(path_archive)
+
+
+@mock.patch("app.main.clean_archive_path")
+@mock.patch("app.main.SharePoint.upload_file")
+@mock.patch("app.main.SharePoint.ensure_dirs_exist")
+@mock.patch("app.main.SharePoint.__init__", return_value=None)
+def test__upload_changes_to_sharepoint__upload_fail(sharepoint_init, sharepoint_ensure_dirs_exist, sharepoint_upload_file, clean_archive_path):
+    """Check if archives are kept & exit code is set when one of concurrent uploads fails"""
+
+    manifest = app.ArchiveManifest("archive")
+    for file_path in ("archive/dir_path_1/file_path_1", "archive/dir_path_1/file_path_2", "archive/dir_path_1/file_path_3"):
+        manifest.add(file_path, 1)
+    sharepoint_upload_file.side_effect = lambda root_dir, target_dir, file_path, on_progress: {"size": 1, "seconds": 1, "throughput": 1} if file_path != "archive/dir_path_1/file_path_2" else 1 / 0
+
+    app.set_exit_code(0)
+    app.upload_changes_to_sharepoint("", "", "", "archive", "", 3, manifest=manifest)
+
+    assert sharepoint_upload_file.call_count == 3
+    assert clean_archive_path.call_count == 0
+    assert app.get_exit_code() > 0
+
+
+@mock.patch("app.main.Git.bundle")
+@mock.patch("app.main.Git.list_refs")
+def test__archive_change__incremental(git_list_refs, git_bundle, tmp_path):
+    """Check if full bundle starts chain, incremental bundle excludes backed up tips & unchanged refs are skipped"""
+
+    path_archive = str(tmp_path / "archive")
+    path_state = str(tmp_path / "state")
+    git_bundle.side_effect = lambda path, bundle_path, exclude_tips: open(bundle_path, "w").close() or True
+
+    git_list_refs.return_value = {"refs/heads/main": "a" * 40}
+    file_paths = app.archive_change("clone", path_archive, "Project_1/git/name_1", path_state, 7)
+    assert len(file_paths) == 2
+    assert file_paths[0].endswith("-full.bundle")
+    assert git_bundle.call_args[0][2] == []
+
+    # Refs didn't move since last bundle
+    assert app.archive_change("clone", path_archive, "Project_1/git/name_1", path_state, 7) == []
+
+    git_list_refs.return_value = {"refs/heads/main": "b" * 40}
+    file_paths = app.archive_change("clone", path_archive, "Project_1/git/name_1", path_state, 7)
+    assert file_paths[0].endswith("-incremental.bundle")
+    assert git_bundle.call_args[0][2] == ["a" * 40]
+
+    # Manifest describes whole chain
+    with open(file_paths[1]) as file:
+        manifest = json.load(file)
+    assert [bundle["type"] for bundle in manifest["bundles"]] == ["full", "incremental"]
+
+    # Full bundle is forced once interval has passed
+    file_paths = app.archive_change("clone", path_archive, "Project_1/git/name_1", path_state, 0)
+    assert file_paths[0].endswith("-full.bundle")
+
+
+@mock.patch("app.main.AzureDevops.get_repo_last_push_date")
+@mock.patch("app.main.AzureDevops.list_inventory")
+@mock.patch("app.main.AzureDevops.__init__", return_value=None)
+@mock.patch("app.main.Git.sync")
+@mock.patch("app.main.Git.__init__", return_value=None)
+def test__sync_data__metadata_precheck(git_init, git_sync, devops_init, devops_list_inventory, devops_get_repo_last_push_date, tmp_path):
+    """Check if repos with unchanged DevOps metadata are skipped without git traffic"""
+
+    path_clone = str(tmp_path / "clone")
+    path_state = str(tmp_path / "state")
+    os.makedirs(f"{path_clone}/Project_1/git/name_1")
+
+    projects_name = ('Project_1',)
+    repos = [{
+        'id': "id_1",
+        'name': "name_1",
+        'remote_url': "remote_url_1",
+        'ssh_url': "ssh_url_1",
+        'size': 100,
+        'default_branch': "refs/heads/main"
+    }]
+    wikis = []
+    devops_list_inventory.return_value = {project_name: {'repos': repos, 'wikis': wikis} for project_name in projects_name}
+    devops_get_repo_last_push_date.return_value = "2022-01-01T00:00:00+00:00"
+    git_sync.return_value = True
+
+    journal = app.Journal().open(str(tmp_path / "journal"), lambda item: app.commit_metadata(app.State(path_state), item))
+    with mock.patch("app.main.journal", journal):
+        # First sync records metadata
+        assert app.sync_data("", "", path_clone, path_state=path_state) == {"Project_1/git/name_1"}
+        assert git_sync.call_count == 1
+
+        # Change not uploaded yet is synced again although metadata didn't move
+        assert app.sync_data("", "", path_clone, path_state=path_state) == {"Project_1/git/name_1"}
+        assert git_sync.call_count == 2
+
+        # Unchanged metadata skips sync once change is uploaded
+        journal.record("Project_1/git/name_1", app.Journal.UPLOADED)
+        assert app.sync_data("", "", path_clone, path_state=path_state) == set()
+        assert git_sync.call_count == 2
+
+        # New push triggers sync
+        devops_get_repo_last_push_date.return_value = "2022-01-02T00:00:00+00:00"
+        assert app.sync_data("", "", path_clone, path_state=path_state) == {"Project_1/git/name_1"}
+        assert git_sync.call_count == 3
+    journal.close()
+
+
+@mock.patch("app.main.AzureDevops.list_projects_name")
+@mock.patch("app.main.AzureDevops.list_inventory")
+@mock.patch("app.main.AzureDevops.__init__", return_value=None)
+def test__discover_inventory__cache(devops_init, devops_list_inventory, devops_list_projects_name, tmp_path):
+    """Check if cached inventory is served without REST calls within TTL & refreshed when forced or stale"""
+
+    devops = app.AzureDevops("", "")
+    path_state = str(tmp_path / "state")
+    devops_list_inventory.return_value = {"Project_1": {"repos": [], "wikis": []}}
+
+    # Cache miss lists whole inventory
+    assert app.discover_inventory(devops, path_state, 3600) == devops_list_inventory.return_value
+    assert devops_list_inventory.call_count == 1
+
+    # Cache hit
+    assert app.discover_inventory(devops, path_state, 3600) == devops_list_inventory.return_value
+    assert devops_list_inventory.call_count == 1
+    assert devops_list_projects_name.call_count == 0
+
+    # Forced refresh
+    app.discover_inventory(devops, path_state, 3600, True)
+    assert devops_list_inventory.call_count == 2
+
+    # Revalidation detects new project
+    devops_list_projects_name.return_value = {"Project_1", "Project_2"}
+    app.discover_inventory(devops, path_state, 3600, False, True)
+    assert devops_list_inventory.call_count == 3
+
+    # Disabled cache
+    app.discover_inventory(devops, path_state, 0)
+    assert devops_list_inventory.call_count == 4
+
+
+@mock.patch("app.main.clean_archive_path")
+@mock.patch("app.main.SharePoint.upload_file")
+@mock.patch("app.main.SharePoint.ensure_dir_exists")
+@mock.patch("app.main.SharePoint.ensure_dirs_exist")
+@mock.patch("app.main.SharePoint.__init__", return_value=None)
+def test__upload_changes_to_sharepoint__dir_cache(sharepoint_init, sharepoint_ensure_dirs_exist, sharepoint_ensure_dir_exists, sharepoint_upload_file, clean_archive_path, tmp_path):
+    """Check if only folders missing in cache are created & upload is retried once when cached folder was deleted"""
+
+    def upload(*file_paths: str) -> None:
+        manifest = app.ArchiveManifest("archive")
+        for file_path in file_paths:
+            manifest.add(f"archive/{file_path}", 1)
+        app.upload_changes_to_sharepoint("", "", "", "archive", "", 1, 1, 1, path_state, manifest=manifest)
+
+    path_state = str(tmp_path / "state")
+    sharepoint_upload_file.return_value = {"size": 1, "seconds": 1, "throughput": 1}
+
+    upload("dir_path_1/file_path_1", "dir_path_2/file_path_2")
+    assert sharepoint_ensure_dirs_exist.call_count == 1
+
+    # Every folder is cached
+    upload("dir_path_1/file_path_1", "dir_path_3/file_path_3")
+    assert sharepoint_ensure_dirs_exist.call_args[0][1] == ["dir_path_3"]
+
+    # Cached folder deleted in SharePoint
+    not_found = Exception()
+    not_found.response = mock.Mock(status_code=404)
+    sharepoint_upload_file.side_effect = [not_found, {"size": 1, "seconds": 1, "throughput": 1}]
+    upload("dir_path_1/file_path_1")
+    sharepoint_ensure_dir_exists.assert_called_once_with("", "dir_path_1")
+    assert sharepoint_upload_file.call_count == 6
+
+
+@mock.patch("app.main.SharePoint.upload_file")
+@mock.patch("app.main.SharePoint.__init__", return_value=None)
+def test__upload_archive__checkpoint(sharepoint_init, sharepoint_upload_file, tmp_path):
+    """Check if upload checkpoint survives failed run & is handed over to next upload"""
+
+    path_state = str(tmp_path / "state")
+    shp = app.SharePoint("", "", "")
+
+    def upload_fail(root_dir, target_dir, file_path, on_progress, resume, on_checkpoint):
+        on_checkpoint({'upload_id': "upload_id", 'offset': 4})
+        raise Exception()
+
+    sharepoint_upload_file.side_effect = upload_fail
+    with pytest.raises(Exception):
+        app.upload_archive(shp, "root", "Project_1/git", "archive/Project_1/git/name_1.zip", None, path_state)
+
+    def upload(root_dir, target_dir, file_path, on_progress, resume, on_checkpoint):
+        assert resume == {'upload_id': "upload_id", 'offset': 4}
+        on_checkpoint(None)
+        return {"size": 1, "seconds": 1, "throughput": 1}
+
+    sharepoint_upload_file.side_effect = upload
+    app.upload_archive(shp, "root", "Project_1/git", "archive/Project_1/git/name_1.zip", None, path_state)
+
+    # Checkpoint is removed after upload is complete
+    assert app.State(path_state).load("uploads/root/Project_1/git/name_1.zip") is None
+
+
+@mock.patch("app.main.Archive.get_digest")
+@mock.patch("app.main.SharePoint.upload_file")
+@mock.patch("app.main.SharePoint.__init__", return_value=None)
+def test__upload_archive__digest(sharepoint_init, sharepoint_upload_file, archive_get_digest, tmp_path):
+    """Check if archive identical to last uploaded one is skipped & its size reported as saved"""
+
+    file_path = tmp_path / "name_1.zip"
+    file_path.write_bytes(b"0123456789")
+    shp = app.SharePoint("", "", "")
+    sharepoint_upload_file.return_value = {"size": 10, "seconds": 1, "throughput": 10}
+    archive_get_digest.return_value = "digest_1"
+
+    digests = dict()
+    assert app.upload_archive(shp, "root", "Project_1/git", str(file_path), None, None, digests) == 0
+    assert digests == {"Project_1/git/name_1.zip": "digest_1"}
+
+    assert app.upload_archive(shp, "root", "Project_1/git", str(file_path), None, None, digests) == 10
+    assert sharepoint_upload_file.call_count == 1
+
+    archive_get_digest.return_value = "digest_2"
+    assert app.upload_archive(shp, "root", "Project_1/git", str(file_path), None, None, digests) == 0
+    assert sharepoint_upload_file.call_count == 2
+
+
+@mock.patch("app.main.Git.maintain")
+@mock.patch("app.main.Git.count_objects")
+def test__maintain_mirrors__threshold_and_cadence(git_count_objects, git_maintain, tmp_path):
+    """Check if only degraded mirrors are maintained & not again before interval passes"""
+
+    for mirror in ("Project_1/git/degraded", "Project_1/git/healthy", "Project_1/wiki/wiki"):
+        (tmp_path / "clone" / mirror).mkdir(parents=True)
+
+    degraded = {'count': 5000, 'size': 100, 'packs': 1, 'size-pack': 100}
+    healthy = {'count': 10, 'size': 1, 'packs': 1, 'size-pack': 100}
+    git_count_objects.side_effect = lambda path: degraded if path.endswith("degraded") and git_maintain.call_count == 0 else healthy
+
+    path_state = str(tmp_path / "state")
+    app.maintain_mirrors(str(tmp_path / "clone"), path_state, 7, 1000, 10, 2, 4)
+
+    assert git_maintain.call_count == 1
+    assert git_maintain.call_args[0] == (str(tmp_path / "clone" / "Project_1/git/degraded"), 2)
+
+    # Maintained mirror is skipped until interval passes, even when it degrades again
+    git_count_objects.side_effect = lambda path: degraded
+    app.maintain_mirrors(str(tmp_path / "clone"), path_state, 7, 1000, 10, 2, 4)
+
+    assert git_maintain.call_count == 3
+    assert str(tmp_path / "clone" / "Project_1/git/degraded") not in [call[0][0] for call in git_maintain.call_args_list[1:]]
+
+
+@mock.patch("app.main.AzureDevops.list_inventory")
+@mock.patch("app.main.AzureDevops.__init__", return_value=None)
+@mock.patch("app.main.Git.sync")
+@mock.patch("app.main.Git.__init__", return_value=None)
+def test__sync_data__resumes_journal(git_init, git_sync, devops_init, devops_list_inventory, tmp_path):
+    """Check if change fetched by interrupted run is synced first & returned although remote didn't move since"""
+
+    interrupted = app.Journal().open(str(tmp_path / "state"))
+    interrupted.record("Project_1/git/name_2", app.Journal.FETCHING)
+    interrupted.record("Project_1/git/name_3", app.Journal.FETCHED)
+
+    repos = [{'name': "name_1", 'remote_url': "remote_url_1"}, {'name': "name_2", 'remote_url': "remote_url_2"}]
+    devops_list_inventory.return_value = {'Project_1': {'repos': repos, 'wikis': []}}
+    git_sync.return_value = False
+
+    journal = app.Journal().open(str(tmp_path / "state"))
+    with mock.patch("app.main.journal", journal):
+        assert app.sync_data("", "", str(tmp_path / "clone")) == {"Project_1/git/name_2"}
+
+    # Pending change is synced first, change of repo missing in inventory & clone path is dropped
+    assert git_sync.call_args_list[0] == mock.call("remote_url_2", f"{tmp_path}/clone/Project_1/git/name_2")
+    assert journal.get_pending() == {"Project_1/git/name_2"}
+
+
+@mock.patch("app.main.AzureDevops.list_inventory")
+@mock.patch("app.main.AzureDevops.__init__", return_value=None)
+@mock.patch("app.main.Git.sync")
+@mock.patch("app.main.Git.__init__", return_value=None)
+def test__sync_data__time_budget_defers(git_init, git_sync, devops_init, devops_list_inventory, tmp_path):
+    """Check if largest repo is synced first & repos not started within time budget are deferred to next run"""
+
+    repos = [{'name': f"name_{index}", 'remote_url': f"remote_url_{index}", 'size': size} for index, size in enumerate((10, 1000, 100))]
+    devops_list_inventory.return_value = {'Project_1': {'repos': repos, 'wikis': []}}
+    git_sync.return_value = True
+    path_state = str(tmp_path / "state")
+
+    with mock.patch("app.main.schedule", app.Schedule()), mock.patch("app.main.Schedule.is_exhausted", side_effect=[False, True, True]):
+        assert app.sync_data("", "", "clone", path_state_schedule=path_state) == {"Project_1/git/name_1"}
+    assert git_sync.call_args_list == [mock.call("remote_url_1", "clone/Project_1/git/name_1")]
+
+    # Deferred repos go first, largest of them before smaller one
+    git_sync.reset_mock()
+    with mock.patch("app.main.schedule", app.Schedule()):
+        assert len(app.sync_data("", "", "clone", path_state_schedule=path_state)) == 3
+    assert [call[0][0] for call in git_sync.call_args_list] == ["remote_url_2", "remote_url_0", "remote_url_1"]
+    assert app.State(path_state).load("schedule")['deferred'] == []
+
+
+def test__main__archive_command(tmp_path, monkeypatch):
+    """Check if archive command requires only its own ENV Variables & archives changes fetched by sync command"""
+
+    for env_name in app.ENV_VARS:
+        monkeypatch.delenv(env_name, raising=False)
+    monkeypatch.setenv('PATH_CLONE', str(tmp_path / "clone"))
+    monkeypatch.setenv('PATH_ARCHIVE', str(tmp_path / "archive"))
+    monkeypatch.setenv('PATH_STATE', str(tmp_path / "state"))
+
+    (tmp_path / "clone" / "Project_1" / "git" / "name_1").mkdir(parents=True)
+    (tmp_path / "clone" / "Project_1" / "git" / "name_1" / "HEAD").write_text("ref: refs/heads/main")
+    synced = app.Journal().open(str(tmp_path / "state"))
+    synced.record("Project_1/git/name_1", app.Journal.FETCHED)
+    synced.close()
+
+    journal = app.Journal()
+    app.set_exit_code(0)
+    with mock.patch("app.main.journal", journal), pytest.raises(SystemExit) as e:
+        app.main(["archive"])
+
+    assert e.value.code == 0
+    assert (tmp_path / "archive" / "Project_1" / "git" / "name_1.zip").is_file()
+    assert app.Journal().open(str(tmp_path / "state")).get_pending(app.Journal.ARCHIVED) == {"Project_1/git/name_1"}
+
+
+def test__main__stage_commands_share_state(tmp_path, monkeypatch):
+    """Check if stage commands require shared PATH_STATE (and PATH_LFS with LFS) & derive other paths from it"""
+
+    for env_name in app.ENV_VARS + ('PATH_STATE', 'PATH_LFS', 'PATH_METRICS'):
+        monkeypatch.delenv(env_name, raising=False)
+    monkeypatch.setenv('PATH_CLONE', str(tmp_path / "clone"))
+    monkeypatch.setenv('PATH_ARCHIVE', str(tmp_path / "other" / "archive"))
+
+    with pytest.raises(Exception, match="PATH_STATE"):
+        app.main(["archive"])
+
+    monkeypatch.setenv('PATH_STATE', str(tmp_path / "shared" / "state"))
+    assert app.get_options("upload")['path_lfs'] == str(tmp_path / "shared" / "lfs")
+    assert app.get_options("upload")['path_metrics'] == str(tmp_path / "shared" / "metrics")
+
+    monkeypatch.setenv('LFS_ENABLED', "true")
+    for name in ('SHAREPOINT_URL', 'SHAREPOINT_DIR', 'SHAREPOINT_CLIENT_ID', 'SHAREPOINT_CLIENT_SECRET'):
+        monkeypatch.setenv(name, "")
+    with pytest.raises(Exception, match="PATH_LFS"):
+        app.main(["upload"])
+
+
+def test__main__sdks_imported_lazily():
+    """Check if importing app doesn't import DevOps, SharePoint & git SDKs"""
+
+    process = subprocess.run(
+        [sys.executable, "-c", "import sys, app.main; print(sorted(name for name in ('azure.devops', 'office365', 'git', 'msrest') if name in sys.modules))"],
+        capture_output=True,
+        text=True,
+        check=True
+    )
+
+    assert process.stdout.strip() == "[]"
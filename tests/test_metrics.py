@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from app.modules.metrics.main import Metrics
+
+
+def test__measure__records_items_and_stages():
+    """Check if measured items are summed into stage totals, failed item is recorded too"""
+
+    metrics = Metrics()
+
+    with metrics.stage("upload"):
+        with metrics.measure("upload", "Project_1/git/name_1.zip") as measurement:
+            measurement['size'] = 100
+            measurement['throughput'] = 50
+
+        with pytest.raises(Exception):
+            with metrics.measure("upload", "Project_1/git/name_2.zip"):
+                raise Exception("upload failed")
+
+    report = metrics.get_report(1)
+
+    assert report['exit_code'] == 1
+    assert report['stages']['upload']['items'] == 2
+    assert report['stages']['upload']['bytes'] == 100
+    assert report['stages']['upload']['failures'] == 1
+    assert report['stages']['upload']['seconds'] > 0
+    assert [(item['item'], item['bytes'], item['failed']) for item in report['items']] == [
+        ("Project_1/git/name_1.zip", 100, False),
+        ("Project_1/git/name_2.zip", 0, True)
+    ]
+    assert report['items'][0]['throughput'] == 50
+
+
+def test__write__report_and_prometheus(tmp_path):
+    """Check if run report & textfile collector file are written into metrics path"""
+
+    metrics = Metrics()
+    metrics.record("fetch", 'Project "1"/git/name_1', 1.5, 2048, changed=True)
+
+    metrics.write_report(str(tmp_path), 0)
+    metrics.write_prometheus(str(tmp_path), 0)
+
+    with open(tmp_path / "report.json") as file:
+        assert json.load(file)['stages']['fetch']['bytes'] == 2048
+
+    lines = (tmp_path / "devops_backup.prom").read_text().splitlines()
+    assert "devops_backup_last_run_exit_code 0" in lines
+    assert 'devops_backup_stage_bytes{stage="fetch"} 2048' in lines
+    assert 'devops_backup_item_duration_seconds{stage="fetch",item="Project \\"1\\"/git/name_1"} 1.5' in lines
+    assert "# TYPE devops_backup_stage_bytes gauge" in lines
+    assert not list(tmp_path.glob("*.tmp"))
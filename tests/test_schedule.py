@@ -0,0 +1,42 @@
+from app.modules.schedule.main import Schedule
+
+
+def test__order__by_expected_cost():
+    """Check if items are ordered by size until timed, then by past duration or size at measured throughput"""
+
+    schedule = Schedule()
+    sizes = {"small": 10, "large": 1000, "wiki": None, "medium": 100}
+
+    assert schedule.order(sizes) == ["large", "medium", "small", "wiki"]
+
+    # Throughput of timed items is ~11 B/s, slow small item goes before medium item, large item is never cheaper than its size
+    schedule.load({"durations": {"small": 89, "large": 1, "medium": 10}})
+    assert schedule.order({**sizes, "new": 2000}) == ["new", "large", "small", "medium", "wiki"]
+
+
+def test__order__deferred_first():
+    """Check if items deferred by previous run go first & are forgotten once synced or removed"""
+
+    schedule = Schedule()
+    schedule.load({"durations": {"large": 100}, "deferred": ["small", "gone"]})
+
+    assert schedule.order({"large": 1000, "small": 10}) == ["small", "large"]
+    assert schedule.dump({"large", "small"}) == {"durations": {"large": 100}, "deferred": ["small"]}
+
+    schedule.record("small", 1)
+    assert schedule.dump({"large", "small"}) == {"durations": {"large": 100, "small": 1}, "deferred": []}
+
+
+def test__is_exhausted__budget():
+    """Check if only positive budget can be exhausted"""
+
+    schedule = Schedule()
+    assert schedule.is_exhausted() is False
+    assert schedule.get_remaining() is None
+
+    schedule.start(-1)
+    assert schedule.is_exhausted() is False
+
+    schedule.start(1)
+    assert schedule.is_exhausted() is False
+    assert 0 < schedule.get_remaining() <= 1
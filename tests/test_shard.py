@@ -0,0 +1,53 @@
+import pytest
+
+from app.modules.shard.main import Shard
+
+
+def test__owns__every_item_has_one_owner():
+    """Check if every repo is owned by exactly one shard & only items of new shard move when shard is added"""
+
+    keys = [("Project_1", "git", f"name_{index}") for index in range(200)]
+
+    owners = {key: [index for index in range(4) if Shard(index, 4).owns(*key)] for key in keys}
+    assert all(len(shards) == 1 for shards in owners.values())
+    assert len({shards[0] for shards in owners.values()}) == 4
+
+    owners_grown = {key: [index for index in range(5) if Shard(index, 5).owns(*key)][0] for key in keys}
+    assert all(owners_grown[key] in (owners[key][0], 4) for key in keys)
+
+
+def test__filter_inventory__by_project():
+    """Check if project with its repos & wikis stays on one shard, not owned projects are dropped"""
+
+    inventory = {
+        f"Project_{index}": {'repos': [{'name': "name_1"}, {'name': "name_2"}], 'wikis': [{'name': f"Project_{index}.wiki"}]}
+        for index in range(20)
+    }
+
+    shards = [Shard(index, 3, "project").filter_inventory(inventory) for index in range(3)]
+
+    assert sorted(project_name for shard in shards for project_name in shard) == sorted(inventory)
+    assert all(shard[project_name] == inventory[project_name] for shard in shards for project_name in shard)
+    assert Shard().filter_inventory(inventory) == inventory
+
+
+def test__acquire__locked_by_other_worker(tmp_path):
+    """Check if shard can't be acquired while other worker holds its lock"""
+
+    path = str(tmp_path / "clone" / "shard-1")
+
+    shard = Shard(1, 2)
+    shard.acquire(path)
+
+    with pytest.raises(Exception, match="already locked"):
+        Shard(1, 2).acquire(path)
+
+    shard.release()
+    Shard(1, 2).acquire(path)
+
+
+def test__init__invalid_shard():
+    """Check if shard index out of shard count is rejected"""
+
+    with pytest.raises(Exception):
+        Shard(2, 2)
@@ -0,0 +1,174 @@
+import io
+import os
+
+import mock
+import pytest
+
+from app.modules.http.main import Http
+from app.modules.sharepoint.main import SharePoint
+
+
+MB = 1024 * 1024
+
+
+@mock.patch("office365.runtime.auth.client_credential.ClientCredential")
+def test__get_next_chunk_size__grows_with_throughput(client_credential):
+    """Check if chunk size grows when chunk uploads faster than target"""
+
+    shp = SharePoint("", "", "", 10 * MB, 100 * MB)
+
+    # 10 MB in 1 second, target is 10 seconds, growth is capped to double
+    assert shp.get_next_chunk_size(10 * MB, 10 * MB, 1) == 20 * MB
+
+
+@mock.patch("office365.runtime.auth.client_credential.ClientCredential")
+def test__get_next_chunk_size__bounds(client_credential):
+    """Check if chunk size stays within configured bounds"""
+
+    shp = SharePoint("", "", "", 10 * MB, 100 * MB)
+
+    assert shp.get_next_chunk_size(80 * MB, 80 * MB, 0.1) == 100 * MB
+    assert shp.get_next_chunk_size(20 * MB, 20 * MB, 60) == 10 * MB
+    assert shp.get_next_chunk_size(20 * MB, 20 * MB, 0) == 100 * MB
+
+
+@mock.patch("office365.sharepoint.client_context.ClientContext")
+@mock.patch("office365.runtime.auth.client_credential.ClientCredential")
+def test__upload_stream__chunks(client_credential, client_context):
+    """Check if stream of unknown size is uploaded in ordered chunks ending with finish"""
+
+    shp = SharePoint("", "", "", 4, 4)
+    folder = client_context.return_value.with_credentials.return_value.web.get_folder_by_server_relative_path.return_value
+    target_file = folder.files.add.return_value.execute_query.return_value
+
+    report = shp.upload_stream("root", "dir", "file.zip", io.BytesIO(b"0123456789"))
+
+    target_file.start_upload.assert_called_once_with(mock.ANY, b"0123")
+    target_file.continue_upload.assert_called_once_with(mock.ANY, 4, b"4567")
+    target_file.finish_upload.assert_called_once_with(mock.ANY, 8, b"89")
+    assert report["size"] == 10
+
+
+@mock.patch("office365.sharepoint.client_context.ClientContext")
+@mock.patch("office365.runtime.auth.client_credential.ClientCredential")
+def test__upload_stream__reads_one_chunk_ahead_at_most(client_credential, client_context):
+    """Check if end of stream is detected by peeking single byte, not by reading whole next chunk"""
+
+    shp = SharePoint("", "", "", 4, 4)
+    stream = io.BytesIO(b"0123456789")
+    read_sizes = list()
+    read = stream.read
+    stream.read = lambda size: read_sizes.append(size) or read(size)
+
+    shp.upload_stream("root", "dir", "file.zip", stream)
+
+    assert read_sizes == [4, 1, 3, 1, 3, 1]
+
+
+@mock.patch("office365.sharepoint.client_context.ClientContext")
+@mock.patch("office365.runtime.auth.client_credential.ClientCredential")
+def test__upload_stream__single_request(client_credential, client_context):
+    """Check if stream smaller than one chunk is uploaded in single request"""
+
+    shp = SharePoint("", "", "", 4, 4)
+    folder = client_context.return_value.with_credentials.return_value.web.get_folder_by_server_relative_path.return_value
+
+    shp.upload_stream("root", "dir", "file.zip", io.BytesIO(b"012"))
+
+    folder.files.add.assert_called_once_with("file.zip", b"012", True)
+
+
+@mock.patch("office365.sharepoint.client_context.ClientContext")
+@mock.patch("office365.runtime.auth.client_credential.ClientCredential")
+def test__ensure_dirs_exist__batch(client_credential, client_context):
+    """Check if every level of every folder is queued parent first & sent in single batch"""
+
+    shp = SharePoint("", "", "")
+    client = client_context.return_value.with_credentials.return_value
+    client.site_path = ""
+
+    shp.ensure_dirs_exist("Documents", ["Project_1/git", "Project_1/wiki"])
+
+    parents = [call[0][0] for call in client.web.get_folder_by_server_relative_path.call_args_list]
+    assert parents == ["Documents", "Documents/Project_1", "Documents/Project_1"]
+    client.web.root_folder.folders.add.assert_called_once_with("Documents")
+    assert client.execute_batch.call_count == 1
+    assert client.execute_query.call_count == 0
+
+
+@mock.patch("office365.sharepoint.client_context.ClientContext")
+@mock.patch("office365.runtime.auth.client_credential.ClientCredential")
+def test__ensure_dirs_exist__server_relative_root(client_credential, client_context):
+    """Check if site path is stripped from server relative root, so folders are created inside library of site"""
+
+    shp = SharePoint("", "", "")
+    client = client_context.return_value.with_credentials.return_value
+    client.site_path = "/sites/backups"
+
+    shp.ensure_dirs_exist("/sites/backups/Shared Documents/DevOps", ["Project_1/git"])
+
+    parents = [call[0][0] for call in client.web.get_folder_by_server_relative_path.call_args_list]
+    assert parents == ["Shared Documents", "Shared Documents/DevOps", "Shared Documents/DevOps/Project_1"]
+    client.web.root_folder.folders.add.assert_called_once_with("Shared Documents")
+    assert client.execute_batch.call_count == 1
+
+
+@mock.patch("office365.sharepoint.client_context.ClientContext")
+@mock.patch("office365.runtime.auth.client_credential.ClientCredential")
+def test__upload_file__resume(client_credential, client_context, tmp_path):
+    """Check if interrupted upload is checkpointed & later continues after last committed chunk"""
+
+    file_path = tmp_path / "file.zip"
+    file_path.write_bytes(b"0123456789")
+
+    shp = SharePoint("", "", "", 4, 4)
+    folder = client_context.return_value.with_credentials.return_value.web.get_folder_by_server_relative_path.return_value
+    target_file = folder.files.add.return_value.execute_query.return_value
+    target_file.continue_upload.side_effect = Exception("throttled")
+
+    checkpoints = list()
+    with pytest.raises(Exception):
+        shp.upload_file("root", "dir", str(file_path), None, None, checkpoints.append)
+    assert checkpoints[-1]['offset'] == 4
+
+    # Resume continues existing session
+    resumed_file = folder.files.get_by_url.return_value
+    shp.upload_file("root", "dir", str(file_path), None, checkpoints[-1], checkpoints.append)
+    resumed_file.continue_upload.assert_called_once_with(checkpoints[0]['upload_id'], 4, b"4567")
+    resumed_file.finish_upload.assert_called_once_with(checkpoints[0]['upload_id'], 8, b"89")
+    assert checkpoints[-1] is None
+
+
+@mock.patch("office365.sharepoint.client_context.ClientContext")
+@mock.patch("office365.runtime.auth.client_credential.ClientCredential")
+def test__upload_file__resume_expired(client_credential, client_context, tmp_path):
+    """Check if file is uploaded from start when checkpointed session is gone"""
+
+    file_path = tmp_path / "file.zip"
+    file_path.write_bytes(b"0123456789")
+
+    shp = SharePoint("", "", "", 4, 4)
+    folder = client_context.return_value.with_credentials.return_value.web.get_folder_by_server_relative_path.return_value
+    folder.files.get_by_url.return_value.continue_upload.side_effect = Exception("session expired")
+    target_file = folder.files.add.return_value.execute_query.return_value
+
+    resume = {'upload_id': "expired", 'offset': 4, 'size': 10, 'mtime': os.path.getmtime(file_path)}
+    report = shp.upload_file("root", "dir", str(file_path), None, resume)
+
+    target_file.start_upload.assert_called_once_with(mock.ANY, b"0123")
+    assert report["size"] == 10
+
+
+@mock.patch("office365.sharepoint.client_context.ClientContext")
+@mock.patch("office365.runtime.auth.client_credential.ClientCredential")
+def test__client__shared_transport(client_credential, client_context):
+    """Check if client of every thread sends requests through shared transport"""
+
+    http = Http()
+    shp = SharePoint("", "", "", http=http)
+    client = shp.client
+
+    pending_request = client_context.return_value.with_credentials.return_value.pending_request.return_value
+    session = pending_request.with_transport.call_args[1]['session']
+    assert session.get_adapter("https://example.sharepoint.com") is http.adapter
+    assert shp.client is client